@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import bedrock_clients
+import providers
+import stream_decoder
+import throttling
+
+MAX_CONCURRENCY = 100
+
+_DONE = object()
+
+class AsyncInvoker:
+    """asyncio front end to the Bedrock runtime for one region.
+
+    botocore has no native asyncio transport, so every call runs on a
+    dedicated thread pool sized to the concurrency limit, sharing one pooled
+    client. Streamed responses are pumped event by event into an
+    asyncio.Queue, so callers consume them with `async for` and cancelling
+    the consumer closes the underlying stream."""
+
+    def __init__(self, region, max_concurrency=MAX_CONCURRENCY, endpoint_url=None):
+        self.client = bedrock_clients.get_client(
+            region, max_pool_connections=max_concurrency, endpoint_url=endpoint_url)
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="bedrock")
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def invoke_model(self, modelId, body):
+        """Return the decoded InvokeModel response body."""
+        loop = asyncio.get_running_loop()
+
+        def call():
+            response = throttling.invoke_model(self.client, modelId, body, False)
+            return json.loads(response['body'].read())
+
+        return await loop.run_in_executor(self.executor, call)
+
+    async def invoke_model_with_response_stream(self, modelId, body):
+        """Yield the decoded chunks of an InvokeModelWithResponseStream call."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancelled = False
+
+        def pump():
+            try:
+                response = throttling.invoke_model(self.client, modelId, body, True)
+                stream = response['body']
+                try:
+                    for event in stream:
+                        if cancelled:
+                            break
+                        loop.call_soon_threadsafe(queue.put_nowait, event)
+                finally:
+                    stream.close()
+                loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+            except Exception as err:
+                loop.call_soon_threadsafe(queue.put_nowait, err)
+
+        loop.run_in_executor(self.executor, pump)
+        try:
+            while True:
+                event = await queue.get()
+                if event is _DONE:
+                    break
+                if isinstance(event, Exception):
+                    raise event
+                yield stream_decoder.loads(event['chunk']['bytes'])
+        finally:
+            # Makes the pumping thread close the stream at the next event
+            cancelled = True
+
+    async def complete(self, modelId, body, streaming):
+        """Invoke the model and return the completion text."""
+        provider = providers.get_provider(modelId)
+        if not streaming:
+            return provider.result_text(await self.invoke_model(modelId, body)).lstrip()
+
+        chunk_text = provider.chunk_text
+        chunks = []
+        async for response_chunk in self.invoke_model_with_response_stream(modelId, body):
+            chunks.append(chunk_text(response_chunk))
+        return ''.join(chunks).lstrip()
+
+async def evaluate_many(invoker, requests, max_concurrency=None):
+    """Complete (modelId, body, streaming) requests concurrently.
+
+    At most max_concurrency (default: the invoker's limit) are in flight at
+    once. Returns one result per request, in request order, where failed
+    requests hold their exception instead of the completion text."""
+    semaphore = asyncio.Semaphore(max_concurrency or invoker.max_concurrency)
+
+    async def evaluate(modelId, body, streaming):
+        async with semaphore:
+            return await invoker.complete(modelId, body, streaming)
+
+    return await asyncio.gather(
+        *(evaluate(modelId, body, streaming) for modelId, body, streaming in requests),
+        return_exceptions=True)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure invocation throughput, e.g. against bedrock_standin.py.")
+    parser.add_argument('--region', type=str, default='us-east-1', help='AWS Region')
+    parser.add_argument('--endpoint-url', type=str, required=False,
+                        help='Bedrock endpoint, e.g. http://127.0.0.1:8088 for the stand-in')
+    parser.add_argument('--model-id', type=str, default='anthropic.claude-v2',
+                        help='The foundation model identifier')
+    parser.add_argument('--requests', type=int, default=200, help='Number of requests to send')
+    parser.add_argument('--concurrency', type=int, default=MAX_CONCURRENCY,
+                        help='Maximum number of requests in flight')
+    parser.add_argument('--no-stream', action='store_true', help='Use InvokeModel instead of streaming')
+    args = parser.parse_args()
+
+    if args.endpoint_url:
+        # The stand-in does not check signatures, but botocore still signs
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'standin')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'standin')
+
+    provider = providers.get_provider(args.model_id)
+    requests = [
+        (args.model_id, provider.payload("Request {}: grade this partner response.".format(i), 512),
+         not args.no_stream)
+        for i in range(args.requests)
+    ]
+
+    invoker = AsyncInvoker(args.region, args.concurrency, args.endpoint_url)
+    started = time.time()
+    results = asyncio.run(evaluate_many(invoker, requests))
+    elapsed = time.time() - started
+    invoker.close()
+
+    failed = [r for r in results if isinstance(r, Exception)]
+    print("Requests: {}, failed: {}, concurrency: {}".format(len(results), len(failed), args.concurrency))
+    print("Elapsed: {:.2f}s, throughput: {:.1f} requests/s".format(elapsed, len(results) / elapsed))
+    if failed:
+        print("First error: {}".format(failed[0]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from termcolor import colored, cprint
+
+import softr
+import grades
+import history
+import bedrock_clients
+import model_catalog
+
+parser = argparse.ArgumentParser(
+    description="Evaluate a JSONL or CSV file of (partner_id, control, body) rows "
+                "and append the results to an NDJSON file.")
+
+parser.add_argument(
+    '--input',
+    type=str,
+    required=True,
+    help='JSONL or CSV file of partner_id, control and body rows')
+
+parser.add_argument(
+    '--output',
+    type=str,
+    required=True,
+    help='NDJSON file the results are appended to')
+
+parser.add_argument(
+    '--checkpoint',
+    type=str,
+    required=False,
+    help='Checkpoint file of finished rows (default: OUTPUT.ckpt)')
+
+parser.add_argument(
+    '--format',
+    type=str,
+    required=False,
+    choices=['jsonl', 'csv'],
+    help='Input format (default: guessed from the file extension)')
+
+parser.add_argument(
+    '--region',
+    type=str,
+    required=True,
+    choices=list(softr.regions.values()),
+    help='AWS Region')
+
+parser.add_argument(
+    '--model-id',
+    type=str,
+    required=True,
+    help='The foundation model identifier')
+
+parser.add_argument(
+    '--max-workers',
+    type=int,
+    default=softr.MAX_WORKERS,
+    help='Maximum number of concurrent model invocations (default: {})'.format(softr.MAX_WORKERS))
+
+REQUIRED_FIELDS = ('partner_id', 'control', 'body')
+
+def read_rows(input_path, input_format):
+    """Yield (line number, row, error) one at a time so the input file is
+    never held in memory. A line that is not a JSON object is yielded with
+    the error and {"line": its text} as the row."""
+    with open(input_path, "r", newline='') as input_file:
+        if input_format == 'csv':
+            csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+            reader = csv.DictReader(input_file)
+            for row in reader:
+                yield reader.line_num, row, None
+        else:
+            for number, line in enumerate(input_file, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as err:
+                    yield number, {"line": line}, "not valid JSON: {}".format(err)
+                    continue
+                if not isinstance(row, dict):
+                    yield number, {"line": line}, "not a JSON object"
+                    continue
+                yield number, row, None
+
+def check_row(row, controls):
+    """Why the row cannot be evaluated, or None if it can."""
+    missing = [field for field in REQUIRED_FIELDS if row.get(field) in (None, "")]
+    if missing:
+        return "missing {}".format(", ".join(missing))
+    if not isinstance(row['body'], str):
+        return "body is not text"
+    if row['control'] not in controls:
+        return "unknown control: {}".format(row['control'])
+    return None
+
+def row_key(modelId, row):
+    h = hashlib.sha256()
+    for field in (modelId, row['partner_id'], row['control'], row['body']):
+        h.update(str(field).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def invalid_row_key(modelId, number, row):
+    # Invalid rows are told apart by where they are as well as what they hold
+    h = hashlib.sha256()
+    h.update("invalid\0{}\0{}\0".format(modelId, number).encode('utf-8'))
+    # csv.DictReader puts the values of extra columns under the key None,
+    # which cannot be sorted with the others
+    h.update(json.dumps({str(k): v for k, v in row.items()}, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+def read_checkpoint(checkpoint_path):
+    if not os.path.isfile(checkpoint_path):
+        return set()
+    with open(checkpoint_path, "r") as checkpoint_file:
+        return set(line.strip() for line in checkpoint_file if line.strip())
+
+def evaluate_row(client, modelId, streaming, row):
+    started = time.time()
+    result = softr.evaluate_control(client, row['control'], modelId, row['body'], streaming)
+    return {
+        "partner_id": row['partner_id'],
+        "control": row['control'],
+        "model_id": modelId,
+        "result": result,
+        "duration": round(time.time() - started, 3),
+    }
+
+def main():
+    args = parser.parse_args()
+
+    input_format = args.format
+    if input_format is None:
+        input_format = 'csv' if args.input.lower().endswith('.csv') else 'jsonl'
+
+    checkpoint_path = args.checkpoint or args.output + '.ckpt'
+    finished = read_checkpoint(checkpoint_path)
+    if finished:
+        print("Resuming, rows already evaluated: ", end="")
+        cprint(len(finished), "black", "on_green")
+
+    models, streaming_models = model_catalog.get_known_models(args.region, [args.model_id]) or \
+        model_catalog.get_models(args.region)
+    if args.model_id not in models.values():
+        cprint("Unknown model: {}".format(args.model_id), "black", "on_red")
+        exit(1)
+    modelId = args.model_id
+    streaming = modelId in streaming_models
+
+    max_workers = max(1, args.max_workers)
+    client = bedrock_clients.get_client(args.region, max_pool_connections=max_workers)
+
+    controls = set(softr.requirements.values())
+    done = failed = skipped = invalid = 0
+
+    with open(args.output, "a") as output_file, \
+         open(checkpoint_path, "a") as checkpoint_file, \
+         ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        pending = {}
+
+        def drain(block_until):
+            nonlocal done, failed
+            while len(pending) > block_until:
+                completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    key, row = pending.pop(future)
+                    try:
+                        record = future.result()
+                    except Exception as err:
+                        failed += 1
+                        cprint("{} {}: {}".format(row['partner_id'], row['control'], err), "black", "on_red")
+                        continue
+
+                    # The result must be on disk before the row is checkpointed
+                    output_file.write(json.dumps(record) + "\n")
+                    output_file.flush()
+                    checkpoint_file.write(key + "\n")
+                    checkpoint_file.flush()
+                    history.record(row['partner_id'], row['control'], modelId, args.region, row['body'],
+                                   record['result'], "batch", grade=grades.parse_grade(record['result']))
+                    done += 1
+                    print("{} {}: ".format(row['partner_id'], row['control']), end="")
+                    cprint("done", "black", "on_green")
+
+        try:
+            for number, row, error in read_rows(args.input, input_format):
+                error = error or check_row(row, controls)
+                key = invalid_row_key(modelId, number, row) if error else row_key(modelId, row)
+                if key in finished:
+                    skipped += 1
+                    continue
+
+                if error:
+                    # Recorded as an error and checkpointed: the row is
+                    # skipped rather than failing the run, now and on resume
+                    invalid += 1
+                    output_file.write(json.dumps({
+                        "line": number,
+                        "partner_id": row.get('partner_id'),
+                        "control": row.get('control'),
+                        "model_id": modelId,
+                        "error": error,
+                    }, default=str) + "\n")
+                    output_file.flush()
+                    checkpoint_file.write(key + "\n")
+                    checkpoint_file.flush()
+                    cprint("Line {}: {}".format(number, error), "black", "on_red")
+                    continue
+
+                # Only keep a bounded number of rows in flight so memory stays flat
+                drain(max_workers * 2 - 1)
+                pending[executor.submit(evaluate_row, client, modelId, streaming, row)] = (key, row)
+
+            drain(0)
+        except KeyboardInterrupt:
+            for future in pending:
+                future.cancel()
+            cprint("Interrupted, rerun the same command to resume.", "black", "on_red")
+            exit(130)
+
+    print("="*78)
+    print("Evaluated: {}, skipped (already done): {}, invalid: {}, failed: {}".format(done, skipped, invalid, failed))
+    if failed:
+        print("Rerun the same command to retry the failed rows.")
+        exit(1)
+
+if __name__ == "__main__":
+    main()
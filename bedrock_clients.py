@@ -0,0 +1,72 @@
+import os
+import hashlib
+import threading
+
+# Tunable through the environment so deployments can size the pools
+# without code changes
+MAX_POOL_CONNECTIONS = int(os.environ.get("SOFTR_MAX_POOL_CONNECTIONS", "25"))
+TCP_KEEPALIVE = os.environ.get("SOFTR_TCP_KEEPALIVE", "1") != "0"
+# Points every client at another endpoint, e.g. the local bedrock_standin.py
+ENDPOINT_URL = os.environ.get("SOFTR_BEDROCK_ENDPOINT_URL") or None
+
+_clients = {}
+_session = None
+_lock = threading.Lock()
+
+def cache_dir(*names):
+    """Path of a file or folder in the apps' cache folder."""
+    return os.path.join(os.path.expanduser("~"), ".cache", "softr-evaluator", *names)
+
+def endpoint_suffix():
+    """Added to the names of files holding what was learned from an
+    endpoint, so the data of other endpoints (e.g. the stand-in) is kept
+    apart: empty for AWS itself."""
+    if not ENDPOINT_URL:
+        return ""
+    return "-" + hashlib.sha1(ENDPOINT_URL.encode('utf-8')).hexdigest()[:8]
+
+def identity():
+    """Which AWS credentials the clients of this process sign with, as far
+    as the environment tells without resolving them: the access key id
+    when one is set, and the profile."""
+    return {
+        "access_key_id": os.environ.get("AWS_ACCESS_KEY_ID") or None,
+        "profile": os.environ.get("AWS_PROFILE") or os.environ.get("AWS_DEFAULT_PROFILE") or "default",
+    }
+
+def get_client(region, service='bedrock-runtime', max_pool_connections=None, endpoint_url=None):
+    """Return the process-wide client for a service, region and endpoint.
+
+    Clients are created once and then reused by every caller, including
+    every Streamlit rerun and session, so credential resolution and the
+    connection pool (with its open TLS connections) are paid for only once.
+    Asking for a larger pool than the existing client has replaces it."""
+    global _session
+    # boto3 takes a few hundred milliseconds to import, which commands that
+    # never reach AWS (such as --help or a mistyped argument) should not pay
+    import boto3
+    from botocore.config import Config
+
+    pool_size = max(MAX_POOL_CONNECTIONS, max_pool_connections or 0)
+    endpoint_url = endpoint_url or ENDPOINT_URL
+    key = (service, region, endpoint_url)
+
+    with _lock:
+        cached = _clients.get(key)
+        if cached is not None and cached[0] >= pool_size:
+            return cached[1]
+
+        # boto3's default session is not thread safe, so clients are built
+        # from a session of our own while holding the lock
+        if _session is None:
+            _session = boto3.session.Session()
+
+        config = Config(max_pool_connections=pool_size, tcp_keepalive=TCP_KEEPALIVE)
+        if service == 'bedrock-runtime':
+            # Invocations are retried by the throttling module, which needs
+            # to see every throttle to adapt its rate
+            config = config.merge(Config(retries={'mode': 'standard', 'total_max_attempts': 1}))
+
+        client = _session.client(service, region_name=region, endpoint_url=endpoint_url, config=config)
+        _clients[key] = (pool_size, client)
+        return client
@@ -0,0 +1,239 @@
+import json
+import time
+import uuid
+import base64
+import random
+import struct
+import argparse
+import binascii
+import threading
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import providers
+
+# Local stand-in for the Bedrock control plane and runtime APIs. It speaks
+# the same wire format as the real service, including the
+# application/vnd.amazon.eventstream framing of streamed responses, so the
+# apps (or any botocore client) can be pointed at it with
+# SOFTR_BEDROCK_ENDPOINT_URL=http://127.0.0.1:8088 and measured offline.
+
+WORDS = ("the partner response describes a service offering on AWS with a clear "
+         "engagement model target customers and delivery mechanism grade").split()
+
+# One model of every family the providers module handles
+MODELS = [
+    ("cohere.command-text-v14", "Command", True),
+    ("meta.llama2-13b-chat-v1", "Llama 2 Chat 13B", True),
+    ("amazon.titan-text-express-v1", "Titan Text G1 - Express", True),
+    ("anthropic.claude-v2", "Claude", True),
+    ("ai21.j2-ultra-v1", "Jurassic-2 Ultra", False),
+]
+
+parser = argparse.ArgumentParser(description="Local stand-in for Amazon Bedrock.")
+parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+parser.add_argument('--port', type=int, default=8088, help='Port to listen on')
+parser.add_argument('--ttft', type=float, default=0.2, help='Seconds before the first chunk')
+parser.add_argument('--chunk-delay', type=float, default=0.02, help='Seconds between chunks')
+parser.add_argument('--chunks', type=int, default=20, help='Chunks per streamed response')
+parser.add_argument('--words-per-chunk', type=int, default=5, help='Words in each chunk')
+parser.add_argument('--throttle-rate', type=float, default=0.0,
+                    help='Fraction of requests rejected with ThrottlingException')
+parser.add_argument('--quota', type=float, default=0.0,
+                    help='Requests per second accepted before throttling (default: unlimited)')
+
+class Quota:
+    """Server side token bucket, like an account's requests-per-second quota."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+def encode_header(name, value):
+    name = name.encode('utf-8')
+    value = value.encode('utf-8')
+    # Header value type 7 is a string with a 2 byte length prefix
+    return struct.pack('>B', len(name)) + name + struct.pack('>BH', 7, len(value)) + value
+
+def encode_event(payload, event_type='chunk', message_type='event'):
+    """Frame one event-stream message: prelude, prelude CRC, headers,
+    payload and message CRC."""
+    headers = (encode_header(':event-type', event_type) +
+               encode_header(':content-type', 'application/json') +
+               encode_header(':message-type', message_type))
+    total_length = 12 + len(headers) + len(payload) + 4
+    prelude = struct.pack('>II', total_length, len(headers))
+    message = prelude + struct.pack('>I', binascii.crc32(prelude) & 0xffffffff) + headers + payload
+    return message + struct.pack('>I', binascii.crc32(message) & 0xffffffff)
+
+def chunk_body(provider, text):
+    if isinstance(provider, providers.Titan):
+        return {"outputText": text, "index": 0, "totalOutputTextTokenCount": None,
+                "completionReason": None, "inputTextTokenCount": None}
+    if isinstance(provider, providers.Claude):
+        return {"completion": text, "stop_reason": None, "stop": None}
+    if isinstance(provider, providers.Cohere):
+        return {"generations": [{"text": text, "index": 0}], "is_finished": False}
+    if isinstance(provider, providers.Llama2):
+        return {"generation": text, "prompt_token_count": None,
+                "generation_token_count": 1, "stop_reason": None}
+    return {}
+
+def result_body(provider, text):
+    if isinstance(provider, providers.Titan):
+        return {"inputTextTokenCount": 0,
+                "results": [{"tokenCount": 0, "outputText": text, "completionReason": "FINISH"}]}
+    if isinstance(provider, providers.Claude):
+        return {"completion": text, "stop_reason": "stop_sequence", "stop": "\n\nHuman:"}
+    if isinstance(provider, providers.Cohere):
+        return {"generations": [{"text": text, "id": str(uuid.uuid4())}], "prompt": ""}
+    if isinstance(provider, providers.Llama2):
+        return {"generation": text, "prompt_token_count": 0,
+                "generation_token_count": 0, "stop_reason": "stop"}
+    return {"id": 1, "completions": [{"data": {"text": text}, "finishReason": {"reason": "endoftext"}}]}
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = None
+    quota = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('x-amzn-RequestId', str(uuid.uuid4()))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, error_type, message):
+        self.send_json(status, {"message": message}, {'x-amzn-ErrorType': error_type + ':'})
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/foundation-models':
+            self.send_error_json(404, 'ResourceNotFoundException', 'Unknown path')
+            return
+
+        self.send_json(200, {"modelSummaries": [{
+            "modelArn": "arn:aws:bedrock:us-east-1::foundation-model/" + modelId,
+            "modelId": modelId,
+            "modelName": modelName,
+            "providerName": modelId.split('.')[0],
+            "inputModalities": ["TEXT"],
+            "outputModalities": ["TEXT"],
+            "responseStreamingSupported": streaming,
+            "customizationsSupported": [],
+            "inferenceTypesSupported": ["ON_DEMAND"],
+        } for modelId, modelName, streaming in MODELS]})
+
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        parts = self.path.split('?')[0].split('/')
+        if len(parts) != 4 or parts[1] != 'model':
+            self.send_error_json(404, 'ResourceNotFoundException', 'Unknown path')
+            return
+
+        modelId = unquote(parts[2])
+        try:
+            provider = providers.get_provider(modelId)
+        except ValueError as err:
+            self.send_error_json(400, 'ValidationException', str(err))
+            return
+
+        settings = self.settings
+        if random.random() < settings.throttle_rate or (self.quota and not self.quota.take()):
+            self.send_error_json(429, 'ThrottlingException', 'Too many requests, please wait before trying again.')
+            return
+
+        input_tokens = max(1, len(request) // 4)
+        words = [random.choice(WORDS) for _ in range(settings.chunks * settings.words_per_chunk)]
+        pieces = [' ' + ' '.join(words[i:i + settings.words_per_chunk])
+                  for i in range(0, len(words), settings.words_per_chunk)]
+
+        started = time.time()
+        time.sleep(settings.ttft)
+
+        if parts[3] == 'invoke':
+            time.sleep(settings.chunk_delay * len(pieces))
+            self.send_json(200, result_body(provider, ''.join(pieces)), {
+                'X-Amzn-Bedrock-Input-Token-Count': str(input_tokens),
+                'X-Amzn-Bedrock-Output-Token-Count': str(len(words)),
+                'X-Amzn-Bedrock-Invocation-Latency': str(int((time.time() - started) * 1000)),
+            })
+            return
+
+        if parts[3] != 'invoke-with-response-stream':
+            self.send_error_json(404, 'ResourceNotFoundException', 'Unknown path')
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.amazon.eventstream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('x-amzn-RequestId', str(uuid.uuid4()))
+        self.send_header('X-Amzn-Bedrock-Content-Type', 'application/json')
+        self.end_headers()
+
+        first_chunk = None
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(settings.chunk_delay)
+            else:
+                first_chunk = time.time()
+            body = chunk_body(provider, piece)
+            if i == len(pieces) - 1:
+                # Like the real service, the last chunk carries the metrics
+                body["amazon-bedrock-invocationMetrics"] = {
+                    "inputTokenCount": input_tokens,
+                    "outputTokenCount": len(words),
+                    "invocationLatency": int((time.time() - started) * 1000),
+                    "firstByteLatency": int((first_chunk - started) * 1000),
+                }
+            event = encode_event(json.dumps({
+                "bytes": base64.b64encode(json.dumps(body).encode('utf-8')).decode('ascii')
+            }).encode('utf-8'))
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(event), event))
+            self.wfile.flush()
+
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+def serve(settings):
+    handler = type('Handler', (StandinHandler,), {
+        'settings': settings,
+        'quota': Quota(settings.quota) if settings.quota else None,
+    })
+    return StandinServer((settings.host, settings.port), handler)
+
+def main():
+    settings = parser.parse_args()
+    server = serve(settings)
+    print("Bedrock stand-in listening on http://{}:{}".format(*server.server_address[:2]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == "__main__":
+    main()
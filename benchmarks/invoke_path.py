@@ -0,0 +1,241 @@
+"""Overhead of the evaluator's own invoke/stream path, without the model.
+
+Drives softr.py's construct_payload, ai_request and ai_response against a
+stub Bedrock client that answers instantly from a recorded event stream,
+for every model family and partner inputs of 1 KB to 1 MB. The Streamlit
+apps' response handling (decoder, renderer and terminal echo) is measured
+with a no-op placeholder. Results are saved as JSON; pass --compare with
+an earlier result file to see the change run over run. Run from the
+repository root:
+
+    python -m benchmarks.invoke_path
+"""
+import io
+import os
+import json
+import time
+import platform
+import argparse
+import statistics
+import tracemalloc
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from termcolor import cprint
+
+import bedrock_standin
+import providers
+import softr
+import stream_decoder
+import stream_render
+import throttling
+
+REGION = "bench-1"
+CONTROL = "SEC-001"
+SIZES = [1024, 10 * 1024, 100 * 1024, 1024 * 1024]
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+class RecordedStream:
+    """Replays recorded stream events, noting when the first two are
+    requested: the second request marks the first chunk as handled."""
+
+    def __init__(self, events):
+        self.events = events
+        self.pulled = []
+
+    def __iter__(self):
+        pulled = self.pulled
+        for event in self.events:
+            if len(pulled) < 2:
+                pulled.append(time.perf_counter())
+            yield event
+
+class StubClient:
+    """Stands in for a bedrock-runtime client; answers from memory."""
+
+    def __init__(self, events, result):
+        self.meta = SimpleNamespace(region_name=REGION)
+        self.events = events
+        self.result = result
+        self.stream = None
+
+    def invoke_model(self, body, modelId, accept, contentType):
+        return {'body': io.BytesIO(self.result), 'contentType': contentType}
+
+    def invoke_model_with_response_stream(self, body, modelId, accept, contentType):
+        self.stream = RecordedStream(self.events)
+        return {'body': self.stream, 'contentType': contentType}
+
+def partner_text(size):
+    words = bedrock_standin.WORDS
+    text = []
+    length = 0
+    i = 0
+    while length < size:
+        word = words[i % len(words)]
+        text.append(word)
+        length += len(word) + 1
+        i += 1
+    return " ".join(text)[:size]
+
+def recorded_response(modelId, chunks, words_per_chunk):
+    provider = providers.get_provider(modelId)
+    words = bedrock_standin.WORDS
+    texts = [
+        " " + " ".join(words[(i * words_per_chunk + j) % len(words)] for j in range(words_per_chunk))
+        for i in range(chunks)
+    ]
+    events = []
+    for i, text in enumerate(texts):
+        body = bedrock_standin.chunk_body(provider, text)
+        if i == chunks - 1:
+            body[stream_decoder.METRICS_KEY] = {
+                "inputTokenCount": 0, "outputTokenCount": chunks * words_per_chunk,
+                "invocationLatency": 0, "firstByteLatency": 0}
+        events.append({'chunk': {'bytes': json.dumps(body).encode('utf-8')}})
+    result = json.dumps(bedrock_standin.result_body(provider, "".join(texts))).encode('utf-8')
+    return events, result
+
+def cli_path(client, modelId, body, streaming):
+    response = softr.ai_request(client, modelId, body, streaming)
+    return softr.ai_response(modelId, response, streaming, echo=False)
+
+def streamlit_path(client, modelId, body, streaming):
+    # Same steps as ai_response in the Streamlit apps
+    placeholder = lambda text: None
+    response = softr.ai_request(client, modelId, body, streaming)
+    provider = providers.get_provider(modelId)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        if streaming:
+            decoder = stream_decoder.StreamDecoder(modelId)
+            renderer = stream_render.StreamRenderer(placeholder)
+            for chunk in decoder.texts(response['body']):
+                if not renderer.count:
+                    chunk = chunk.lstrip()
+                renderer.feed(chunk)
+            return renderer.close()
+
+        result = provider.result_text(json.loads(response.get('body').read())).lstrip()
+        cprint(result, "black", "on_yellow")
+        placeholder(result)
+        return result
+
+def refill():
+    # The rate limiter runs as usual, but never makes the benchmark wait
+    for bucket in throttling._buckets.values():
+        bucket.tokens = 1.0
+
+def timed(function, repeat, *args):
+    times = []
+    for _ in range(repeat):
+        refill()
+        started = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+def peak_allocated(function, *args):
+    refill()
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def measure(modelId, streaming, size, args):
+    events, result = recorded_response(modelId, args.chunks, args.words_per_chunk)
+    client = StubClient(events, result)
+    partner = partner_text(size)
+    body = softr.construct_payload(modelId, CONTROL, partner)
+
+    payload = timed(softr.construct_payload, args.repeat, modelId, CONTROL, partner)
+    e2e = timed(cli_path, args.repeat, client, modelId, body, streaming)
+    streamlit_e2e = timed(streamlit_path, args.repeat, client, modelId, body, streaming)
+
+    row = {
+        "model": modelId,
+        "family": providers.get_provider(modelId).family,
+        "streaming": streaming,
+        "input_bytes": size,
+        "payload_bytes": len(body),
+        "payload_ms": payload * 1000,
+        "e2e_ms": e2e * 1000,
+        "streamlit_e2e_ms": streamlit_e2e * 1000,
+        "ttfc_ms": None,
+        "chunks_per_s": None,
+        "peak_alloc_kb": peak_allocated(
+            lambda: cli_path(client, modelId, softr.construct_payload(modelId, CONTROL, partner), streaming)) / 1024,
+    }
+
+    if streaming:
+        refill()
+        started = time.perf_counter()
+        cli_path(client, modelId, body, streaming)
+        ended = time.perf_counter()
+        first_pulled, first_handled = client.stream.pulled
+        row["ttfc_ms"] = (first_handled - started) * 1000
+        row["chunks_per_s"] = args.chunks / (ended - first_pulled)
+    return row
+
+def compare(results, previous):
+    before = {(r["model"], r["input_bytes"]): r for r in previous["results"]}
+    print()
+    print("Change against {}:".format(previous.get("created")))
+    print("{:<32} {:>9} {:>10} {:>10}".format("model", "input", "payload", "e2e"))
+    for row in results:
+        old = before.get((row["model"], row["input_bytes"]))
+        if old is None:
+            continue
+        print("{:<32} {:>9} {:>+9.1f}% {:>+9.1f}%".format(
+            row["model"], row["input_bytes"],
+            (row["payload_ms"] / old["payload_ms"] - 1) * 100,
+            (row["e2e_ms"] / old["e2e_ms"] - 1) * 100))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=300, help='Chunks per streamed response')
+    parser.add_argument('--words-per-chunk', type=int, default=3, help='Words in each chunk')
+    parser.add_argument('--repeat', type=int, default=15, help='Runs per measurement (the median is kept)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='Partner input sizes in bytes')
+    parser.add_argument('--output', type=str, required=False,
+                        help='Result file (default: a timestamped file in benchmarks/results)')
+    parser.add_argument('--compare', type=str, required=False, help='Earlier result file to compare with')
+    args = parser.parse_args()
+
+    results = []
+    print("{:<32} {:>9} {:>11} {:>9} {:>11} {:>9} {:>13} {:>11}".format(
+        "model", "input", "payload ms", "ttfc ms", "chunks/s", "e2e ms", "streamlit ms", "peak KB"))
+    for modelId, name, streaming in bedrock_standin.MODELS:
+        for size in args.sizes:
+            row = measure(modelId, streaming, size, args)
+            results.append(row)
+            print("{:<32} {:>9} {:>11.3f} {:>9} {:>11} {:>9.3f} {:>13.3f} {:>11.0f}".format(
+                modelId, size, row["payload_ms"],
+                "-" if row["ttfc_ms"] is None else "{:.3f}".format(row["ttfc_ms"]),
+                "-" if row["chunks_per_s"] is None else "{:.0f}".format(row["chunks_per_s"]),
+                row["e2e_ms"], row["streamlit_e2e_ms"], row["peak_alloc_kb"]))
+
+    created = time.strftime("%Y-%m-%dT%H:%M:%S")
+    report = {
+        "created": created,
+        "python": platform.python_version(),
+        "json_backend": stream_decoder.JSON_BACKEND,
+        "chunks": args.chunks,
+        "words_per_chunk": args.words_per_chunk,
+        "results": results,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, "invoke_path-{}.json".format(created.replace(":", "")))
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print("Results saved to {}".format(output))
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(results, json.load(previous_file))
+
+if __name__ == "__main__":
+    main()
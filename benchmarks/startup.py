@@ -0,0 +1,78 @@
+"""Startup time of the command line apps, checked against a budget.
+
+Runs each command with python -X importtime, adds up the time spent
+importing modules, and fails (exit status 1) when that exceeds the
+command's budget or when a module that should only be imported on demand
+(boto3, the terminal menu, readline, ...) is imported anyway. The wall
+time of each command is reported too. Run from the repository root:
+
+    python -m benchmarks.startup
+"""
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from termcolor import cprint
+
+# (command line, import time budget in milliseconds)
+COMMANDS = [
+    (["softr.py", "-h"], 120),
+    (["softr.py", "--control", "NOT-A-CONTROL"], 120),
+    (["improver.py", "-h"], 80),
+    (["batch.py", "-h"], 150),
+]
+
+# Imported only once they are needed: AWS calls, interactive prompts, the
+# metrics endpoint and talking to the evaluator daemon
+LAZY_MODULES = ["boto3", "botocore", "simple_term_menu", "gnureadline", "http.server", "http.client", "socket"]
+
+def measure(command):
+    """Import time (ms) of every top-level import, the modules imported, and
+    the wall time (ms) of one run."""
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime"] + command,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = (time.perf_counter() - started) * 1000
+
+    total = 0
+    modules = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        # Nested imports are indented, and already in their parent's total
+        if not name[1:].startswith(" "):
+            total += int(cumulative_us)
+    return total / 1000, modules, wall
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per command (the median is kept)')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiply every budget, e.g. on a slower machine')
+    args = parser.parse_args()
+
+    failed = False
+    print("{:<40} {:>10} {:>10} {:>10}".format("Command", "Import ms", "Budget ms", "Wall ms"))
+    for command, budget in COMMANDS:
+        runs = [measure(command) for _ in range(max(1, args.repeat))]
+        imports = statistics.median(run[0] for run in runs)
+        wall = statistics.median(run[2] for run in runs)
+        budget *= args.scale
+        eager = [module for module in LAZY_MODULES if module in runs[0][1]]
+
+        line = "{:<40} {:>10.1f} {:>10.0f} {:>10.1f}".format(" ".join(command), imports, budget, wall)
+        if imports > budget or eager:
+            failed = True
+            cprint(line, "black", "on_red")
+        else:
+            print(line)
+        if eager:
+            cprint("  imported at startup: {}".format(", ".join(eager)), "black", "on_red")
+
+    exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
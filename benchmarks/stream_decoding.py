@@ -0,0 +1,85 @@
+"""Per-chunk cost of decoding streamed responses, for each model family.
+
+Compares the original per-event path (json.loads plus a chain of modelId
+checks) with stream_decoder.StreamDecoder on synthetic streams shaped like
+Bedrock's. Run from the repository root:
+
+    python -m benchmarks.stream_decoding
+"""
+import json
+import time
+import argparse
+
+import bedrock_standin
+import providers
+import stream_decoder
+
+def legacy_chunk_text(modelId, response_chunk):
+    chunk = ''
+    if "amazon.titan" in modelId:
+        chunk = response_chunk['outputText']
+
+    if "anthropic.claude" in modelId:
+        chunk = response_chunk['completion']
+
+    if "cohere.command" in modelId:
+        chunk = response_chunk['generations'][0]['text']
+
+    if "meta.llama2" in modelId:
+        chunk = response_chunk['generation']
+
+    return chunk
+
+def legacy_decode(modelId, events):
+    return [legacy_chunk_text(modelId, json.loads(event['chunk'].get('bytes'))) for event in events]
+
+def decoder_decode(modelId, events):
+    decoder = stream_decoder.StreamDecoder(modelId)
+    texts = list(decoder.texts(events))
+    assert decoder.metrics is not None
+    return texts
+
+def make_events(modelId, chunks, words_per_chunk):
+    provider = providers.get_provider(modelId)
+    words = bedrock_standin.WORDS
+    events = []
+    for i in range(chunks):
+        text = " " + " ".join(words[(i * words_per_chunk + j) % len(words)] for j in range(words_per_chunk))
+        body = bedrock_standin.chunk_body(provider, text)
+        if i == chunks - 1:
+            body[stream_decoder.METRICS_KEY] = {
+                "inputTokenCount": 1000, "outputTokenCount": chunks * words_per_chunk,
+                "invocationLatency": 2000, "firstByteLatency": 200}
+        events.append({'chunk': {'bytes': json.dumps(body).encode('utf-8')}})
+    return events
+
+def per_chunk(decode, modelId, events, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        decode(modelId, events)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(events) * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=2000, help='Chunks per stream')
+    parser.add_argument('--words-per-chunk', type=int, default=3, help='Words in each chunk')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per measurement (best is kept)')
+    args = parser.parse_args()
+
+    print("JSON backend: {}".format(stream_decoder.JSON_BACKEND))
+    print("{:<32} {:>14} {:>14} {:>8}".format("model", "legacy ns/chunk", "decoder ns/chunk", "speedup"))
+    for modelId, name, streaming in bedrock_standin.MODELS:
+        if not streaming:
+            continue
+        events = make_events(modelId, args.chunks, args.words_per_chunk)
+        assert legacy_decode(modelId, events) == decoder_decode(modelId, events)
+
+        legacy = per_chunk(legacy_decode, modelId, events, args.repeat)
+        decoder = per_chunk(decoder_decode, modelId, events, args.repeat)
+        print("{:<32} {:>14.0f} {:>14.0f} {:>7.2f}x".format(modelId, legacy, decoder, legacy / decoder))
+
+if __name__ == "__main__":
+    main()
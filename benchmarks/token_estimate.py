@@ -0,0 +1,55 @@
+"""Accuracy of the offline token estimate, against the exact tokenizers.
+
+For every model family with an exact tokenizer available (see "Token
+counting" in the README), counts the control prompts and any text files
+given with both the exact tokenizer and the estimate, and reports the
+error of the estimate and the characters per token that would remove it,
+for CHARS_PER_TOKEN in token_counter.py. Run from the repository root:
+
+    python -m benchmarks.token_estimate [FILE ...]
+"""
+import argparse
+from termcolor import cprint
+
+import control_catalog
+import token_counter
+
+def corpus(paths):
+    catalog = control_catalog.get_catalog()
+    texts = [catalog.render(control_id, "") for control_id in catalog.ids()]
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            texts.append(f.read())
+    return texts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*', help='More text to measure, e.g. partner responses')
+    args = parser.parse_args()
+
+    texts = corpus(args.files)
+    measured = False
+    print("{:<20} {:>10} {:>10} {:>8} {:>12} {:>12}".format(
+        "Family", "Exact", "Estimate", "Error", "Chars/token", "Fitted"))
+    for family, chars_per_token in token_counter.CHARS_PER_TOKEN.items():
+        tokenizer = token_counter.get_tokenizer(family)
+        if not tokenizer.exact:
+            continue
+        measured = True
+        estimator = token_counter.EstimatingTokenizer(chars_per_token)
+        exact = sum(tokenizer.count(text) for text in texts)
+        estimate = sum(estimator.count(text) for text in texts)
+        ascii_chars = sum(len(text.encode("ascii", "ignore")) for text in texts)
+        other_tokens = sum(len(text) - len(text.encode("ascii", "ignore")) for text in texts) * \
+            token_counter.NON_ASCII_TOKENS_PER_CHAR
+        fitted = ascii_chars / max(1.0, exact - other_tokens)
+        print("{:<20} {:>10} {:>10} {:>+7.1f}% {:>12.2f} {:>12.2f}".format(
+            family, exact, estimate, (estimate - exact) / exact * 100, chars_per_token, fitted))
+
+    if not measured:
+        cprint("No exact tokenizer found in {}; nothing to compare with.".format(token_counter.TOKENIZERS_DIR),
+               "black", "on_red")
+        exit(1)
+
+if __name__ == "__main__":
+    main()
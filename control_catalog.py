@@ -0,0 +1,117 @@
+import os
+import re
+import time
+import threading
+from string import Template
+from collections import namedtuple
+
+CONTROLS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "controls")
+PROMPT_SUFFIX = ".prompt"
+# How often (in seconds) the folder is checked for new or changed templates
+RELOAD_INTERVAL = 2.0
+
+# Only files named after a control id (e.g. SEC-002.prompt) are controls;
+# variants such as DEF-001-original.prompt are left out
+CONTROL_ID = re.compile(r'^[A-Z]+-\d+$')
+# Checklist order of the control sections, any others are listed after them
+SECTION_ORDER = ["DEF", "PROJ", "TECH", "RISK", "SEC", "SAAS", "CUS"]
+
+Control = namedtuple('Control', ['id', 'title', 'label', 'placeholders', 'template', 'mtime'])
+
+def control_title(control_id, text):
+    prefix = control_id + " - "
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith(prefix):
+            return line[len(prefix):].rstrip('.')
+    return control_id
+
+def template_placeholders(template):
+    placeholders = []
+    for match in Template.pattern.finditer(template.template):
+        name = match.group('named') or match.group('braced')
+        if name and name not in placeholders:
+            placeholders.append(name)
+    return placeholders
+
+def sort_key(control_id):
+    section = control_id.split('-')[0]
+    if section in SECTION_ORDER:
+        return SECTION_ORDER.index(section), control_id
+    return len(SECTION_ORDER), control_id
+
+def load_control(control_id, path, mtime):
+    with open(path, "r") as prompt_file:
+        text = prompt_file.read()
+
+    template = Template(text)
+    title = control_title(control_id, text)
+    return Control(
+        id=control_id,
+        title=title,
+        label="{:<8} - {}".format(control_id, title),
+        placeholders=template_placeholders(template),
+        template=template,
+        mtime=mtime)
+
+class ControlCatalog:
+    """In-memory index of the control prompt templates in a folder.
+
+    Templates are read and compiled once; the folder is rescanned at most
+    every reload_interval seconds, and only files that are new or whose
+    mtime changed are read again."""
+
+    def __init__(self, path=CONTROLS_PATH, reload_interval=RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.controls = {}
+        self.scanned = None
+        self.lock = threading.Lock()
+
+    def refresh(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.scanned is not None and now - self.scanned < self.reload_interval:
+                return
+            self.scanned = now
+
+            controls = {}
+            for entry in os.scandir(self.path):
+                control_id, suffix = os.path.splitext(entry.name)
+                if suffix != PROMPT_SUFFIX or not CONTROL_ID.match(control_id) or not entry.is_file():
+                    continue
+
+                mtime = entry.stat().st_mtime
+                control = self.controls.get(control_id)
+                if control is None or control.mtime != mtime:
+                    control = load_control(control_id, entry.path, mtime)
+                controls[control_id] = control
+
+            self.controls = dict(sorted(controls.items(), key=lambda item: sort_key(item[0])))
+
+    def all(self):
+        """All controls, in checklist order."""
+        self.refresh()
+        return list(self.controls.values())
+
+    def get(self, control_id):
+        self.refresh()
+        return self.controls[control_id]
+
+    def ids(self):
+        return [control.id for control in self.all()]
+
+    def requirements(self):
+        """{label: control id} of every control, e.g. for a selection menu."""
+        return {control.label: control.id for control in self.all()}
+
+    def render(self, control_id, partner):
+        return self.get(control_id).template.substitute(partner=partner)
+
+_catalog = None
+
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        _catalog = ControlCatalog()
+    return _catalog
@@ -0,0 +1,106 @@
+import threading
+
+RECENT_TURNS = 6
+TOKEN_BUDGET = 2048
+SUMMARY_PREFIX = "Summary of the conversation so far: "
+SUMMARY_PROMPT = """Summarize the conversation below between User and Assistant in a few sentences. Keep the names, facts, preferences and decisions needed to continue the conversation.
+
+<previous-summary>
+{summary}
+</previous-summary>
+
+<conversation>
+{conversation}
+</conversation>"""
+
+def estimate_tokens(text):
+    return int(len(text)/4)
+
+def format_message(message):
+    return message["role"] + ": " + message["content"] + "\n"
+
+class ConversationMemory:
+    """Chat history whose prompt stays within a token budget.
+
+    The most recent turns are kept verbatim; older turns are folded into a
+    running summary by a model call made on a background thread, so
+    building the prompt costs the same however long the conversation is."""
+
+    def __init__(self, token_budget=TOKEN_BUDGET, recent_turns=RECENT_TURNS, count_tokens=estimate_tokens):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.count_tokens = count_tokens
+        self.messages = []
+        self.summary = ""
+        # messages[:summarized] are covered by the summary
+        self.summarized = 0
+        self.summarizing = None
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def append(self, role, content):
+        message = {"role": role, "content": content}
+        message["tokens"] = self.count_tokens(format_message(message))
+        with self.lock:
+            self.messages.append(message)
+        return message
+
+    def prompt(self):
+        """The summary plus as many of the latest turns as fit the budget."""
+        with self.lock:
+            summary = self.summary
+            unsummarized = self.messages[self.summarized:]
+
+        header = SUMMARY_PREFIX + summary + "\n" if summary else ""
+        budget = self.token_budget - self.count_tokens(header)
+        lines = []
+        for message in reversed(unsummarized):
+            budget -= message["tokens"]
+            # Always keep the latest message, even when it alone is over budget
+            if budget < 0 and lines:
+                break
+            lines.append(format_message(message))
+
+        return header + "".join(reversed(lines))
+
+    def size(self):
+        return self.count_tokens(self.prompt())
+
+    def summarize(self, summarizer):
+        """Fold the turns older than the recent window into the summary, on
+        a background thread. summarizer(summary, conversation) returns the
+        new summary text. Does nothing while a summary is being made."""
+        with self.lock:
+            if self.summarizing is not None and self.summarizing.is_alive():
+                return
+            end = len(self.messages) - self.recent_turns
+            if end <= self.summarized:
+                return
+            start = self.summarized
+            generation = self.generation
+            summary = self.summary
+            conversation = "".join(format_message(m) for m in self.messages[start:end])
+
+        def run():
+            try:
+                new_summary = summarizer(summary, conversation)
+            except Exception as err:
+                # The turns stay unsummarized and are retried after the next turn
+                print("Summarizing the conversation failed: {}".format(err))
+                return
+
+            with self.lock:
+                # The conversation may have been reset while summarizing
+                if self.generation == generation and self.summarized == start:
+                    self.summary = new_summary
+                    self.summarized = end
+
+        self.summarizing = threading.Thread(target=run, daemon=True)
+        self.summarizing.start()
+
+    def clear(self):
+        with self.lock:
+            self.messages.clear()
+            self.summary = ""
+            self.summarized = 0
+            self.generation += 1
@@ -0,0 +1,135 @@
+import os
+import json
+
+import bedrock_clients
+
+# Where the command line apps look for a running evaluator_daemon.py:
+# "unix:/path/to/socket" or "http://host:port"; by default the daemon's
+# own Unix socket
+DAEMON_ADDRESS = os.environ.get("SOFTR_DAEMON")
+CONNECT_TIMEOUT = 0.5
+
+def socket_path():
+    # A daemon for another endpoint (e.g. the stand-in) gets its own socket
+    return bedrock_clients.cache_dir("daemon" + bedrock_clients.endpoint_suffix() + ".sock")
+
+def token_path():
+    # The key to a daemon listening on TCP, readable by this user only
+    return bedrock_clients.cache_dir("daemon" + bedrock_clients.endpoint_suffix() + ".token")
+
+def read_token():
+    try:
+        with open(token_path()) as token_file:
+            return token_file.read().strip()
+    except OSError:
+        return None
+
+def default_address():
+    return DAEMON_ADDRESS or "unix:" + socket_path()
+
+class DaemonError(Exception):
+    pass
+
+class DaemonClient:
+    """Requests to evaluator_daemon.py over HTTP, on TCP or a Unix socket."""
+
+    def __init__(self, address):
+        self.address = address
+
+    def open_socket(self, timeout):
+        # socket and http.client are only imported once a daemon may be
+        # there, which keeps them out of the apps' startup
+        import socket
+        if self.address.startswith("unix:"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            try:
+                sock.connect(self.address[len("unix:"):])
+            except OSError:
+                sock.close()
+                raise
+            return sock
+        host, port = self.address.split("://", 1)[-1].rstrip("/").rsplit(":", 1)
+        return socket.create_connection((host, int(port)), timeout)
+
+    def request(self, method, path, payload=None, timeout=None):
+        import http.client
+        connection = http.client.HTTPConnection("localhost", timeout=timeout)
+        connection.sock = self.open_socket(CONNECT_TIMEOUT)
+        connection.sock.settimeout(timeout)
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {"Connection": "close"}
+        if not self.address.startswith("unix:"):
+            token = read_token()
+            if token:
+                headers["Authorization"] = "Bearer " + token
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+        except http.client.HTTPException as err:
+            raise DaemonError("Bad answer from the daemon: {!r}".format(err))
+        if response.status != 200:
+            try:
+                message = json.loads(response.read()).get("error")
+            except ValueError:
+                message = None
+            raise DaemonError(message or "{} {}".format(response.status, response.reason))
+        return response
+
+    def get(self, path, timeout=CONNECT_TIMEOUT):
+        return json.loads(self.request("GET", path, timeout=timeout).read())
+
+    def health(self):
+        return self.get("/health")
+
+    def models(self, region):
+        """{modelName: modelId} and the streaming model ids of a region, from
+        the daemon's catalog."""
+        models = self.get("/models?region=" + region, timeout=None)
+        return models["models"], models["streaming_models"]
+
+    def events(self, path, payload):
+        """POST payload and yield the (event, data) pairs of the Server-Sent
+        Events answer as they arrive."""
+        response = self.request("POST", path, payload)
+        event = None
+        data = []
+        try:
+            for line in response:
+                line = line.decode('utf-8').rstrip("\r\n")
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data.append(line[len("data:"):].strip())
+                elif not line and data:
+                    yield event, json.loads("\n".join(data))
+                    event = None
+                    data = []
+        finally:
+            response.close()
+
+    def evaluate(self, **request):
+        return self.events("/evaluate", request)
+
+    def improve(self, **request):
+        return self.events("/improve", request)
+
+def connect():
+    """A client of the running daemon, or None when no daemon is running or
+    it calls another Bedrock endpoint, or with other AWS credentials, than
+    this process would."""
+    address = default_address()
+    if address.startswith("unix:") and not os.path.exists(address[len("unix:"):]):
+        return None
+    client = DaemonClient(address)
+    try:
+        health = client.health()
+    except (OSError, ValueError, DaemonError):
+        return None
+    if health.get("endpoint_url") != bedrock_clients.ENDPOINT_URL:
+        return None
+    if health.get("identity") != bedrock_clients.identity():
+        return None
+    return client
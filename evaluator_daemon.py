@@ -0,0 +1,364 @@
+import os
+import sys
+import hmac
+import json
+import signal
+import socket
+import secrets
+import argparse
+import ipaddress
+import socketserver
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from termcolor import colored, cprint
+
+import bedrock_clients
+import control_catalog
+import daemon_client
+import grades
+import history
+import improver
+import metrics
+import model_catalog
+import providers
+import softr
+import stream_decoder
+
+parser = argparse.ArgumentParser(
+    description="Keep Bedrock clients, the model catalog and the control templates warm, "
+                "and evaluate for softr.py and improver.py over a local HTTP API.")
+
+parser.add_argument(
+    '--socket',
+    type=str,
+    required=False,
+    help='Unix socket to listen on (default: {})'.format(daemon_client.socket_path()))
+
+parser.add_argument(
+    '--port',
+    type=int,
+    required=False,
+    help='Listen on this TCP port instead of a Unix socket')
+
+parser.add_argument(
+    '--host',
+    type=str,
+    default='127.0.0.1',
+    help='Loopback address to listen on with --port (default: 127.0.0.1)')
+
+parser.add_argument(
+    '--region',
+    type=str,
+    nargs='+',
+    default=list(softr.regions.values()),
+    choices=list(softr.regions.values()),
+    help='Regions to warm up at start (default: all)')
+
+def answer_events(modelId, response, streaming):
+    """Yield a chunk event per streamed chunk, then return the whole answer.
+    The stream is closed also when the caller stops listening mid-answer."""
+    if not streaming:
+        return providers.get_provider(modelId).result_text(json.loads(response['body'].read())).lstrip()
+
+    text = []
+    try:
+        for chunk in stream_decoder.StreamDecoder(modelId).texts(response['body']):
+            if not text:
+                chunk = chunk.lstrip()
+            text.append(chunk)
+            yield "chunk", {"text": chunk}
+    finally:
+        close = getattr(response['body'], 'close', None)
+        if close is not None:
+            close()
+    return ''.join(text)
+
+def check_model(region, modelId):
+    if region not in softr.regions.values():
+        raise ValueError("Unknown region: {}".format(region))
+    models, streaming_models = model_catalog.get_models(region)
+    if modelId not in models.values():
+        raise ValueError("{} is not available in {}".format(modelId, region))
+    return modelId in streaming_models
+
+def evaluate(request):
+    """Check an /evaluate request, then return the generator of its events:
+    start (single control), chunk (streamed single control), a result per
+    control and done."""
+    controls = request.get("controls") or [request.get("control")]
+    # The catalog rather than softr.requirements, which is only read at start:
+    # control files added since are picked up, as they are by softr.py
+    catalog = control_catalog.get_catalog()
+    ids = catalog.ids()
+    if any(control not in ids for control in controls):
+        catalog.refresh(force=True)
+        ids = catalog.ids()
+    unknown = [control for control in controls if control not in ids]
+    if unknown:
+        raise ValueError("Unknown control: {}".format(", ".join(map(str, unknown))))
+    region = request.get("region")
+    modelId = request.get("model_id")
+    streaming = check_model(region, modelId)
+    prompt_input = request.get("body")
+    if not isinstance(prompt_input, str):
+        raise ValueError("body must be the partner input")
+    temperature = request.get("temperature")
+    if temperature is not None and (not isinstance(temperature, (int, float)) or not 0 <= temperature <= 1):
+        raise ValueError("temperature must be between 0 and 1")
+    # Keep the results in checklist order, like softr.py
+    controls = [control for control in ids if control in controls]
+    return evaluation_events(request, controls, region, modelId, streaming, prompt_input)
+
+def evaluation_events(request, controls, region, modelId, streaming, prompt_input):
+    partner = request.get("partner")
+    use_cache = bool(request.get("cache"))
+    force_cache = bool(request.get("force_cache"))
+    hedge_regions = list(softr.regions.values()) if request.get("hedge") else None
+    temperature = request.get("temperature")
+    max_workers = max(1, min(int(request.get("max_workers") or softr.MAX_WORKERS), len(controls)))
+    client = bedrock_clients.get_client(region, max_pool_connections=max_workers)
+
+    if len(controls) > 1:
+        fallback = []
+        if request.get("packed"):
+            report, fallback = softr.evaluate_controls_packed(
+                client, controls, modelId, prompt_input, streaming, max_workers,
+                max(1, int(request.get("pack_size") or softr.MAX_WORKERS)), use_cache, force_cache, hedge_regions,
+                temperature)
+        else:
+            report = softr.evaluate_controls(client, controls, modelId, prompt_input, streaming, max_workers,
+                                             use_cache, force_cache, hedge_regions, temperature)
+        evaluations = []
+        for control, result, err in report:
+            mode = "packed" if request.get("packed") and control not in fallback else "single"
+            if err is None:
+                evaluations.append({
+                    "partner": partner, "control": control, "model_id": modelId, "region": region,
+                    "input": prompt_input, "grade": grades.parse_grade(result), "result": result, "mode": mode})
+            yield "result", {"control": control, "result": result, "error": None if err is None else str(err),
+                             "mode": mode}
+        history.record_many(evaluations)
+        yield "done", {}
+        return
+
+    control = controls[0]
+    body = softr.construct_payload(modelId, control, prompt_input, temperature)
+    try:
+        with metrics.labels(control=control):
+            response = softr.ai_request(client, modelId, body, streaming, use_cache, force_cache, hedge_regions)
+    except Exception as err:
+        yield "result", {"control": control, "result": None, "error": str(err)}
+        yield "done", {}
+        return
+
+    answered_from = response.get('region', region)
+    yield "start", {"region": answered_from, "cached": bool(response.get('cached')), "streaming": streaming}
+    result = yield from answer_events(modelId, response, streaming)
+    history.record(partner, control, modelId, answered_from, prompt_input, result, "single",
+                   grade=grades.parse_grade(result), details={"cached": bool(response.get('cached'))})
+    yield "result", {"control": control, "result": result, "error": None}
+    yield "done", {}
+
+def improve(request):
+    """Check an /improve request, then return the generator of its events."""
+    region = request.get("region")
+    modelId = request.get("model_id")
+    streaming = check_model(region, modelId)
+    text = request.get("body")
+    if not isinstance(text, str):
+        raise ValueError("body must be the text to improve")
+    return improvement_events(region, modelId, streaming, text)
+
+def improvement_events(region, modelId, streaming, text):
+    body = providers.get_provider(modelId).payload(improver.construct_prompt(text), improver.MAX_TOKENS_COUNT)
+    try:
+        response = softr.ai_request(bedrock_clients.get_client(region), modelId, body, streaming)
+    except Exception as err:
+        yield "result", {"result": None, "error": str(err)}
+        yield "done", {}
+        return
+
+    yield "start", {"region": region, "cached": False, "streaming": streaming}
+    result = yield from answer_events(modelId, response, streaming)
+    yield "result", {"result": result, "error": None}
+    yield "done", {}
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def authorized(self):
+        """Whether the request carries the daemon's token, when it has one.
+        A request without it is answered with 401."""
+        token = self.server.token
+        given = self.headers.get('Authorization', '')
+        if token is None or hmac.compare_digest(given.encode('utf-8'), ("Bearer " + token).encode('utf-8')):
+            return True
+        self.send_json(401, {"error": "Missing or wrong token (see {})".format(daemon_client.token_path())})
+        return False
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        url = urlsplit(self.path)
+        if url.path == '/health':
+            self.send_json(200, {"pid": os.getpid(), "endpoint_url": bedrock_clients.ENDPOINT_URL,
+                                 "identity": bedrock_clients.identity()})
+        elif url.path == '/models':
+            region = parse_qs(url.query).get("region", [None])[0]
+            if region not in softr.regions.values():
+                self.send_json(400, {"error": "Unknown region: {}".format(region)})
+                return
+            try:
+                models, streaming_models = model_catalog.get_models(region)
+            except Exception as err:
+                self.send_json(502, {"error": str(err)})
+                return
+            self.send_json(200, {"models": models, "streaming_models": streaming_models})
+        else:
+            self.send_json(404, {"error": "Unknown path"})
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        routes = {'/evaluate': evaluate, '/improve': improve}
+        route = routes.get(urlsplit(self.path).path)
+        if route is None:
+            self.send_json(404, {"error": "Unknown path"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            events = route(request)
+        except (ValueError, TypeError, AttributeError) as err:
+            self.send_json(400, {"error": "Bad request: {}".format(err)})
+            return
+        except Exception as err:
+            self.send_json(502, {"error": str(err)})
+            return
+        self.send_events(events)
+
+    def send_events(self, events):
+        """Send the events as Server-Sent Events, each as soon as it is ready."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        # The end of the answer is marked by closing the connection
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for event, data in events:
+                self.wfile.write("event: {}\ndata: {}\n\n".format(event, json.dumps(data)).encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The caller went away; closing the events closes the model's stream
+            pass
+        except Exception as err:
+            self.wfile.write("event: error\ndata: {}\n\n".format(json.dumps({"error": str(err)})).encode('utf-8'))
+        finally:
+            events.close()
+
+class TCPDaemonServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    token = None
+
+class UnixDaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    # The socket's permissions keep other users out
+    token = None
+
+def is_loopback(host):
+    try:
+        addresses = socket.getaddrinfo(host, None)
+    except OSError:
+        return False
+    return all(ipaddress.ip_address(address[4][0]).is_loopback for address in addresses)
+
+def write_token():
+    """A new random token, in a file only this user can read."""
+    token = secrets.token_urlsafe(32)
+    path = daemon_client.token_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = "{}.{}.partial".format(path, os.getpid())
+    with os.fdopen(os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as token_file:
+        token_file.write(token)
+    os.replace(partial, path)
+    return token
+
+def warm_up(regions):
+    """Create the clients and load the model catalogs before the first request."""
+    for region in regions:
+        try:
+            bedrock_clients.get_client(region)
+            model_catalog.get_models(region)
+        except Exception as err:
+            cprint("Warming up {} failed: {}".format(region, err), "black", "on_red")
+
+def main():
+    args = parser.parse_args()
+    # Whoever can reach the daemon runs models on its AWS credentials, so it
+    # only listens on this machine, and on TCP only answers requests
+    # carrying the token it writes for this user's apps
+    if args.port is not None and not is_loopback(args.host):
+        parser.error("--host must be a loopback address, such as 127.0.0.1")
+    path = None
+    if args.port is None:
+        path = args.socket or daemon_client.socket_path()
+        try:
+            daemon_client.DaemonClient("unix:" + path).health()
+            cprint("A daemon is already listening on {}".format(path), "black", "on_red")
+            exit(1)
+        except (OSError, ValueError, daemon_client.DaemonError):
+            pass
+
+    warm_up(args.region)
+    print("Controls loaded: {}".format(len(control_catalog.get_catalog().ids())))
+
+    if path is None:
+        server = TCPDaemonServer((args.host, args.port), DaemonHandler)
+        server.token = write_token()
+        address = "http://{}:{}".format(*server.server_address[:2])
+        print("Point the apps at the daemon with: export SOFTR_DAEMON={}".format(address))
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            # Nobody answered on it: left over by a daemon that did not shut down cleanly
+            os.remove(path)
+        # Only this user may ask for evaluations: the socket is created
+        # without access for others, rather than closed to them afterwards
+        umask = os.umask(0o177)
+        try:
+            server = UnixDaemonServer(path, DaemonHandler)
+        finally:
+            os.umask(umask)
+        address = "unix:" + path
+        if os.path.abspath(path) != daemon_client.socket_path():
+            print("Point the apps at the daemon with: export SOFTR_DAEMON={}".format(address))
+
+    print("Evaluator daemon listening on ", end="")
+    cprint(address, "black", "on_green", flush=True)
+    # Stopped with kill as well as Ctrl-C, the daemon still removes its socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
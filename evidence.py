@@ -0,0 +1,221 @@
+import io
+import os
+import re
+import hashlib
+import unicodedata
+from collections import namedtuple
+from html.parser import HTMLParser
+
+import bedrock_clients
+
+# Partner evidence (PDF, DOCX, HTML or text files) is turned into plain text
+# once: the text is kept on disk under the SHA-256 of the file's contents,
+# so the same document submitted again, for another control or model, is
+# not extracted again
+CACHE_DIR = bedrock_clients.cache_dir("evidence")
+# Part of the cache key: bump when extraction or normalization changes
+EXTRACTION_VERSION = 1
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+BLOCK_SIZE = 1024 * 1024
+
+KINDS = {
+    ".pdf": "pdf",
+    ".docx": "docx",
+    ".html": "html",
+    ".htm": "html",
+    ".txt": "text",
+    ".md": "text",
+    ".csv": "text",
+}
+# Heading of each document in the text of several
+HEADER = "=== {} ===\n\n"
+
+Evidence = namedtuple('Evidence', ['name', 'content_hash', 'path', 'size', 'cached'])
+
+class EvidenceError(Exception):
+    pass
+
+def kind_of(name):
+    kind = KINDS.get(os.path.splitext(name)[1].lower())
+    if kind is None:
+        raise EvidenceError("{}: not a supported evidence file ({})".format(
+            name, ", ".join(sorted(KINDS))))
+    return kind
+
+def content_hash(data):
+    """SHA-256 of a file's contents, from bytes or read from a path a block
+    at a time."""
+    digest = hashlib.sha256()
+    if isinstance(data, bytes):
+        digest.update(data)
+    else:
+        with open(data, "rb") as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def cache_path(key):
+    return os.path.join(CACHE_DIR, "{}-v{}.txt".format(key, EXTRACTION_VERSION))
+
+class HTMLText(HTMLParser):
+    """The visible text of an HTML page, a line per block element."""
+    SKIP = {"script", "style", "noscript", "template", "head"}
+    BLOCKS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article",
+              "header", "footer", "table", "ul", "ol", "pre", "blockquote", "title"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+        elif tag in ("td", "th"):
+            self.parts.append("\t")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+def decode(data):
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return data.decode("utf-8", errors="replace")
+
+def extract_pdf(data):
+    try:
+        import pypdf
+    except ImportError:
+        raise EvidenceError("Reading PDF files requires pypdf: pip install pypdf")
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    text = "\n\n".join(page.extract_text() or "" for page in reader.pages)
+    # Words hyphenated at the end of a line of the page are joined again
+    return re.sub(r"(\w)-\n(\w)", r"\1\2", text)
+
+def extract_docx(data):
+    try:
+        import docx
+    except ImportError:
+        raise EvidenceError("Reading DOCX files requires python-docx: pip install python-docx")
+    document = docx.Document(io.BytesIO(data))
+    paragraphs = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            paragraphs.append("\t".join(cell.text for cell in row.cells))
+    return "\n".join(paragraphs)
+
+def extract_html(data):
+    parser = HTMLText()
+    parser.feed(decode(data))
+    parser.close()
+    return "".join(parser.parts)
+
+EXTRACTORS = {
+    "pdf": extract_pdf,
+    "docx": extract_docx,
+    "html": extract_html,
+    "text": decode,
+}
+
+def normalize(text):
+    """Plain text the way the models read it best: compatibility forms of
+    characters folded, control characters dropped, runs of spaces collapsed
+    and at most one blank line in a row."""
+    text = unicodedata.normalize("NFKC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r"[^\S\n\t]+", " ", text)
+    text = re.sub(r"[\x00-\x08\x0b-\x1f\x7f]", "", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", text).strip() + "\n"
+
+def extract(name, source, key):
+    """Extract and normalize the text of one file (a path or its bytes) and
+    store it in the cache. Runs in a worker process."""
+    if not isinstance(source, bytes):
+        with open(source, "rb") as f:
+            source = f.read()
+    text = normalize(EXTRACTORS[kind_of(name)](source))
+    if not text.strip():
+        raise EvidenceError("{}: no text found in it (is it a scanned document?)".format(name))
+    path = cache_path(key)
+    # Written under another name first, so a reader never sees half a file
+    partial = "{}.{}.partial".format(path, os.getpid())
+    with open(partial, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(partial, path)
+    return os.path.getsize(path)
+
+def ingest(files, max_workers=MAX_WORKERS):
+    """Text of evidence files, given as paths or (name, bytes) pairs, e.g.
+    uploads. Files not in the cache are extracted concurrently in worker
+    processes. Returns an Evidence per file, in order."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    documents = []
+    for source in files:
+        name, source = (os.path.basename(source), source) if isinstance(source, str) else source
+        kind_of(name)
+        key = content_hash(source)
+        documents.append((name, source, key))
+
+    evidence = {}
+    todo = {}
+    for name, source, key in documents:
+        path = cache_path(key)
+        if os.path.exists(path):
+            evidence[key] = Evidence(name, key, path, os.path.getsize(path), True)
+        else:
+            todo.setdefault(key, (name, source))
+
+    if todo:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn rather than fork: the apps may be running threads
+        with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(todo))),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {key: executor.submit(extract, name, source, key) for key, (name, source) in todo.items()}
+            for key, future in futures.items():
+                name = todo[key][0]
+                try:
+                    size = future.result()
+                except EvidenceError:
+                    raise
+                except Exception as err:
+                    raise EvidenceError("{}: could not extract its text: {}".format(name, err))
+                evidence[key] = Evidence(name, key, cache_path(key), size, False)
+
+    return [evidence[key]._replace(name=name) for name, source, key in documents]
+
+def combine(evidence):
+    """Path of one text file with the text of all the evidence, each document
+    under its name; the text file itself when there is only one."""
+    if len(evidence) == 1:
+        return evidence[0].path
+    key = hashlib.sha256(" ".join("{}:{}".format(e.name, e.content_hash) for e in evidence).encode("utf-8")).hexdigest()
+    path = cache_path("combined-" + key)
+    if not os.path.exists(path):
+        partial = "{}.{}.partial".format(path, os.getpid())
+        with open(partial, "w", encoding="utf-8") as out:
+            for number, e in enumerate(evidence):
+                out.write("" if number == 0 else "\n")
+                out.write(HEADER.format(e.name))
+                with open(e.path, encoding="utf-8") as f:
+                    for block in iter(lambda: f.read(BLOCK_SIZE), ""):
+                        out.write(block)
+        os.replace(partial, path)
+    return path
+
+def read_text(evidence):
+    """The text of all the evidence as one string."""
+    with open(combine(evidence), encoding="utf-8") as f:
+        return f.read()
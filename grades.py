@@ -0,0 +1,229 @@
+import re
+import json
+import math
+import time
+import threading
+import statistics
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+
+import providers
+import response_cache
+import stream_decoder
+
+# Grades further apart than this (on the 1-100 scale) do not agree
+TOLERANCE = 10
+
+# Self-consistency sampling: up to SAMPLES answers are drawn, CONCURRENCY at
+# a time, until the 95% confidence interval of the mean grade is at most
+# CI_WIDTH points wide (judged from at least MIN_SAMPLES grades)
+SAMPLES = 9
+CONCURRENCY = 3
+MIN_SAMPLES = 3
+CI_WIDTH = 10.0
+# Student's t for a 95% two-sided interval, by degrees of freedom
+T_95 = {1: 12.71, 2: 4.30, 3: 3.18, 4: 2.78, 5: 2.57, 6: 2.45, 7: 2.36, 8: 2.31, 9: 2.26,
+        10: 2.23, 12: 2.18, 15: 2.13, 20: 2.09, 30: 2.04}
+
+# Where the grade is looked for, most explicit first: "85/100" or "85 out of
+# 100", "Grade: 85", "a score of 85", "I would give it 85" or "rate it 85",
+# then a number opening the answer. A number is only a grade when it does
+# not start a range ("a scale of 1 to 100") or count out of anything but
+# 100 ("4 out of 5 steps"), and a number opening a numbered list ("1. The
+# offering ...", "2. ...") or numbering a question is not one
+NOT_RANGE = r'(?!\s*(?:-|–|to)\s*\d)(?!\s*(?:/|out of)\s*(?!100\b)\d)'
+MARKER = re.compile(r'[.)]\s+[A-Za-z]')
+GRADE_PATTERNS = [
+    re.compile(r'\b(\d{1,3})\s*(?:/|out of)\s*100\b', re.I),
+    re.compile(r'\b(?:grade|grading|score|rating)\b\D{0,20}?\b(\d{1,3})\b' + NOT_RANGE, re.I),
+    re.compile(r"\b(?:give|rate|grade|score) (?:it|this|them|the (?:partner'?s? )?response)\s+(?:an? |at )?"
+               r"(\d{1,3})\b" + NOT_RANGE, re.I),
+    # A bare number opening the answer, or the answer to the echoed question
+    # ("1. What grading would you give ...?")
+    re.compile(r'^(?:\W*\d{1,3}[.)]\s+[^\n]*\?\s*)?\W*(?:\d{1,3}[.)]\s+(?=\d))?(\d{1,3})\b' + NOT_RANGE),
+]
+UNABLE = re.compile(r'\bunable to grade\b|\bcannot grade\b|\bcan\'t grade\b', re.I)
+
+ModelGrade = namedtuple('ModelGrade', ['modelId', 'grade', 'result', 'error', 'seconds'])
+Consensus = namedtuple('Consensus', ['median', 'spread', 'agreeing', 'reached', 'grades'])
+SampledGrade = namedtuple('SampledGrade', ['grade', 'mean', 'interval', 'calls', 'stopped_early',
+                                           'explanation', 'samples'])
+
+def parse_grade(text):
+    """The 1-100 grade given in an answer, or None if there is none."""
+    if not text or UNABLE.search(text[:200]):
+        return None
+    for pattern in GRADE_PATTERNS:
+        for match in pattern.finditer(text):
+            grade = int(match.group(1))
+            if 1 <= grade <= 100 and not is_list_marker(text, match):
+                return grade
+    return None
+
+def is_list_marker(text, match):
+    """Whether the number matched is "1." of a numbered list, followed by
+    "2." at the start of a later line, or numbers a question ("1. What
+    grading would you give ...?")."""
+    if not MARKER.match(text, match.end(1)):
+        return False
+    line_end = text.find("\n", match.end(1))
+    if text[match.end(1):line_end if line_end >= 0 else len(text)].rstrip().endswith("?"):
+        return True
+    following = r'^\W*{}[.)]\s'.format(int(match.group(1)) + 1)
+    return re.search(following, text[match.end(1):], re.M) is not None
+
+def agreeing(grades, quorum, tolerance=TOLERANCE):
+    """The largest set of grades within tolerance of each other, if it has
+    at least quorum of them, else None."""
+    grades = sorted(grades)
+    best = []
+    start = 0
+    for end in range(len(grades)):
+        while grades[end] - grades[start] > tolerance:
+            start += 1
+        if end + 1 - start > len(best):
+            best = grades[start:end + 1]
+    return best if len(best) >= quorum else None
+
+def consensus(model_grades, quorum, tolerance=TOLERANCE):
+    grades = [g.grade for g in model_grades if g.grade is not None]
+    if not grades:
+        return Consensus(None, None, 0, False, model_grades)
+    agreed = agreeing(grades, quorum, tolerance)
+    return Consensus(
+        median=statistics.median(grades),
+        spread=max(grades) - min(grades),
+        agreeing=len(agreed) if agreed else 0,
+        reached=agreed is not None,
+        grades=model_grades)
+
+def complete(client, modelId, body, streaming, cancelled, use_cache=False, force_cache=False,
+             hedge_regions=None):
+    """The answer of one model, or None when cancelled while it streamed."""
+    response = response_cache.invoke(client, modelId, body, streaming, use_cache=use_cache,
+                                     force=force_cache, hedge_regions=hedge_regions)
+    if not streaming:
+        return providers.get_provider(modelId).result_text(json.loads(response['body'].read())).strip()
+
+    stream = response['body']
+    chunks = []
+    try:
+        for text in stream_decoder.StreamDecoder(modelId).texts(stream):
+            if cancelled.is_set():
+                return None
+            chunks.append(text)
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+    return ''.join(chunks).strip()
+
+def evaluate_consensus(client, bodies, streaming_models, quorum=None, tolerance=TOLERANCE,
+                       use_cache=False, force_cache=False, hedge_regions=None):
+    """Evaluate the same prompt on several models at once.
+
+    bodies is {modelId: request body}. Returns a Consensus as soon as quorum
+    (default: a majority) of the models have given grades within tolerance
+    of each other; the models still answering are then cancelled and left
+    out. Models that failed or did not grade are reported with grade None."""
+    if quorum is None:
+        quorum = len(bodies) // 2 + 1
+    cancelled = threading.Event()
+    started = time.monotonic()
+    model_grades = []
+
+    def evaluate(modelId, body):
+        try:
+            result = complete(client, modelId, body, modelId in streaming_models, cancelled,
+                              use_cache, force_cache, hedge_regions)
+        except Exception as err:
+            return ModelGrade(modelId, None, None, err, time.monotonic() - started)
+        return ModelGrade(modelId, parse_grade(result), result, None, time.monotonic() - started)
+
+    executor = ThreadPoolExecutor(max_workers=len(bodies))
+    try:
+        futures = [executor.submit(evaluate, modelId, body) for modelId, body in bodies.items()]
+        for future in as_completed(futures):
+            model_grade = future.result()
+            model_grades.append(model_grade)
+            if model_grade.grade is not None and agreeing(
+                    [g.grade for g in model_grades if g.grade is not None], quorum, tolerance):
+                break
+    finally:
+        # The slower models stop at their next chunk
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return consensus(model_grades, quorum, tolerance)
+
+def t_95(degrees):
+    if degrees > 30:
+        return 1.96
+    # Between table entries, the smaller (more conservative) one is used
+    return T_95[max(known for known in T_95 if known <= degrees)]
+
+def interval(grades):
+    """Half width of the 95% confidence interval of the mean grade."""
+    if len(grades) < 2:
+        return math.inf
+    return t_95(len(grades) - 1) * statistics.stdev(grades) / math.sqrt(len(grades))
+
+def evaluate_samples(client, modelId, body, streaming, samples=SAMPLES, width=CI_WIDTH,
+                     concurrency=CONCURRENCY, hedge_regions=None):
+    """Grade one prompt from several sampled answers of the same model.
+
+    Samples are drawn concurrency at a time, and no more are started once
+    the confidence interval of the mean grade is narrower than width;
+    answers still streaming are then cancelled. The grade is the median,
+    and the explanation the answer whose grade is closest to it."""
+    cancelled = threading.Event()
+    started = time.monotonic()
+    results = []
+    calls = 0
+    stopped_early = False
+
+    def sample():
+        try:
+            # Never from the cache: every sample must be a fresh one
+            result = complete(client, modelId, body, streaming, cancelled, hedge_regions=hedge_regions)
+        except Exception as err:
+            return ModelGrade(modelId, None, None, err, time.monotonic() - started)
+        return ModelGrade(modelId, parse_grade(result), result, None, time.monotonic() - started)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = set()
+    try:
+        while True:
+            # The first samples go out together; more are only started once
+            # MIN_SAMPLES have come back and the interval is still too wide
+            may_start = calls < concurrency or len(results) >= MIN_SAMPLES
+            while calls < samples and len(pending) < concurrency and may_start:
+                pending.add(executor.submit(sample))
+                calls += 1
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            results.extend(future.result() for future in done)
+            graded = [r.grade for r in results if r.grade is not None]
+            if len(graded) >= MIN_SAMPLES and 2 * interval(graded) <= width:
+                stopped_early = calls < samples or bool(pending)
+                break
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    graded = [r for r in results if r.grade is not None]
+    if not graded:
+        return SampledGrade(None, None, None, calls, stopped_early, None, results)
+
+    grades = [r.grade for r in graded]
+    median = statistics.median(grades)
+    representative = min(graded, key=lambda r: abs(r.grade - median))
+    return SampledGrade(
+        grade=median,
+        mean=statistics.mean(grades),
+        interval=interval(grades),
+        calls=calls,
+        stopped_early=stopped_early,
+        explanation=representative.result,
+        samples=results)
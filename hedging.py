@@ -0,0 +1,244 @@
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import bedrock_clients
+import model_catalog
+import throttling
+
+# A single hedged request goes out when the first chunk is later than the
+# p95 TTFT seen for the region and model (DEFAULT_HEDGE_DELAY until
+# MIN_SAMPLES first chunks have been timed), but never sooner than
+# MIN_HEDGE_DELAY. For InvokeModel, whose first chunk is the whole
+# completion, the p95 of the whole call is used, and there is no hedge
+# until MIN_SAMPLES calls have been timed.
+TTFT_SAMPLES = 200
+MIN_SAMPLES = 20
+DEFAULT_HEDGE_DELAY = 2.0
+MIN_HEDGE_DELAY = 0.2
+
+# A region failing FAILURE_THRESHOLD times in a row is skipped for
+# OPEN_SECONDS, after which a single trial request may go to it again
+FAILURE_THRESHOLD = 3
+OPEN_SECONDS = 30.0
+
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+class LatencyTracker:
+    """Recent time-to-first-chunk (or, for InvokeModel, whole call) samples
+    of one region and model."""
+
+    def __init__(self, default_delay, size=TTFT_SAMPLES):
+        self.default_delay = default_delay
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, ttft):
+        with self.lock:
+            self.samples.append(ttft)
+
+    def p95(self):
+        with self.lock:
+            if len(self.samples) < MIN_SAMPLES:
+                return None
+            samples = sorted(self.samples)
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None not to hedge."""
+        p95 = self.p95()
+        if p95 is None:
+            return self.default_delay
+        return max(MIN_HEDGE_DELAY, p95)
+
+class CircuitBreaker:
+    def __init__(self):
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Whether a request may go to the region now."""
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time.monotonic() - self.opened < OPEN_SECONDS or self.trial:
+                return False
+            # Half open: let one request through to probe the region
+            self.trial = True
+            return True
+
+    def is_open(self):
+        with self.lock:
+            return self.opened is not None and time.monotonic() - self.opened < OPEN_SECONDS
+
+    def on_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def on_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= FAILURE_THRESHOLD or self.opened is not None:
+                self.opened = time.monotonic()
+
+_trackers = {}
+_breakers = {}
+_lock = threading.Lock()
+
+def get_tracker(region, modelId, streaming=True):
+    with _lock:
+        tracker = _trackers.get((region, modelId, streaming))
+        if tracker is None:
+            tracker = _trackers[(region, modelId, streaming)] = LatencyTracker(
+                DEFAULT_HEDGE_DELAY if streaming else None)
+        return tracker
+
+def get_breaker(region):
+    with _lock:
+        breaker = _breakers.get(region)
+        if breaker is None:
+            breaker = _breakers[region] = CircuitBreaker()
+        return breaker
+
+def serves(region, modelId):
+    # Only the stored catalog is looked at: listing the models of a region
+    # is not worth doing on every invocation. A region whose catalog was
+    # never fetched is not hedged to.
+    return model_catalog.get_known_models(region, [modelId]) is not None
+
+def candidate_regions(primary, regions, modelId, streaming):
+    """The primary region followed by the other regions, fastest (by p95
+    latency) first; regions whose circuit is open go last."""
+    def p95(region):
+        return get_tracker(region, modelId, streaming).p95()
+
+    others = sorted((region for region in regions if region != primary),
+                    key=lambda region: (p95(region) is None, p95(region) or 0))
+    return sorted([primary] + others, key=lambda region: get_breaker(region).is_open())
+
+class Attempt:
+    """One request to one region, run on the hedging pool until its first
+    chunk (or, for InvokeModel, its response) has arrived."""
+
+    def __init__(self, region, modelId, body, streaming):
+        self.region = region
+        self.modelId = modelId
+        self.cancelled = False
+        self.response = None
+        self.stream = None
+        self.first = None
+        # Runs in the caller's context, so metrics labels carry over
+        self.future = _executor.submit(contextvars.copy_context().run, self.run, body, streaming)
+
+    def run(self, body, streaming):
+        started = time.monotonic()
+        client = bedrock_clients.get_client(self.region)
+        response = throttling.invoke_model(client, self.modelId, body, streaming)
+        if streaming:
+            self.stream = iter(response['body'])
+            self.first = next(self.stream, None)
+        get_tracker(self.region, self.modelId, streaming).add(time.monotonic() - started)
+        self.response = response
+        if self.cancelled:
+            self.close()
+        return self
+
+    def close(self):
+        close = getattr(self.response['body'], 'close', None)
+        if close is not None:
+            close()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future.done() and self.future.exception() is None:
+            self.close()
+
+def resume(attempt):
+    """The response of a winning streamed attempt, its first event included."""
+    def events():
+        try:
+            if attempt.first is not None:
+                yield attempt.first
+                yield from attempt.stream
+        finally:
+            attempt.close()
+
+    response = dict(attempt.response)
+    response['body'] = events()
+    return response
+
+def start_next(candidates, primary, modelId, body, streaming):
+    """Send the request to the first of candidates that is available."""
+    while candidates:
+        region = candidates.pop(0)
+        if region != primary and not serves(region, modelId):
+            continue
+        if get_breaker(region).allow():
+            return Attempt(region, modelId, body, streaming)
+    return None
+
+def invoke_model(region, modelId, body, streaming, regions):
+    """Invoke the model in region, hedging with the next best of regions.
+
+    If the first chunk is later than the learned p95 latency, the same
+    request goes to the next region serving the model, once; the response
+    that starts first is returned and the other one is closed. When every
+    pending request has failed, the next region is tried. The response has
+    the region that answered under 'region'."""
+    candidates = candidate_regions(region, regions, modelId, streaming)
+    attempt = start_next(candidates, region, modelId, body, streaming)
+    if attempt is None:
+        # Every circuit is open; trying the chosen region beats giving up
+        attempt = Attempt(region, modelId, body, streaming)
+    pending = [attempt]
+    hedged = False
+    last_error = None
+
+    while pending:
+        timeout = None
+        if candidates and not hedged:
+            timeout = get_tracker(pending[-1].region, modelId, streaming).hedge_delay()
+        wait([attempt.future for attempt in pending], timeout=timeout, return_when=FIRST_COMPLETED)
+
+        finished = [attempt for attempt in pending if attempt.future.done()]
+        if not finished:
+            # No first chunk in time: hedge with the next region
+            hedged = True
+            hedge = start_next(candidates, region, modelId, body, streaming)
+            if hedge is not None:
+                pending.append(hedge)
+            continue
+
+        for attempt in finished:
+            pending.remove(attempt)
+            err = attempt.future.exception()
+            if err is None:
+                get_breaker(attempt.region).on_success()
+                for loser in pending:
+                    loser.cancel()
+                response = resume(attempt) if streaming else dict(attempt.response)
+                response['region'] = attempt.region
+                return response
+
+            last_error = err
+            if isinstance(err, throttling.InvocationError) and err.error is not None \
+                    and not throttling.is_transient(err.error):
+                # The request itself is at fault; another region won't help
+                for loser in pending:
+                    loser.cancel()
+                raise err
+            get_breaker(attempt.region).on_failure()
+
+        if not pending:
+            failover = start_next(candidates, region, modelId, body, streaming)
+            if failover is not None:
+                pending.append(failover)
+
+    raise last_error
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from collections import namedtuple
+from contextlib import contextmanager
+
+import bedrock_clients
+
+PAGE_SIZE = 50
+
+Evaluation = namedtuple('Evaluation', [
+    'id', 'created', 'partner', 'control', 'model_id', 'region', 'input_hash', 'grade', 'result',
+    'mode', 'details'])
+
+COLUMNS = "id, created, partner, control, model_id, region, input_hash, grade, result, mode, details"
+
+def history_path():
+    return bedrock_clients.cache_dir("history" + bedrock_clients.endpoint_suffix() + ".sqlite3")
+
+def input_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EvaluationHistory:
+    """Append-only SQLite store of every evaluation result.
+
+    Partner inputs are stored once per distinct text, keyed by their hash.
+    Every column results are looked up by is indexed together with the id,
+    so filtered pages and trends are index range scans however many
+    evaluations have been stored."""
+
+    def __init__(self, path=None):
+        self.path = path or history_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as db:
+            # Readers (e.g. the history view) never block the evaluators
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS inputs (
+                input_hash TEXT PRIMARY KEY,
+                body TEXT NOT NULL)""")
+            db.execute("""CREATE TABLE IF NOT EXISTS evaluations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created REAL NOT NULL,
+                partner TEXT,
+                control TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                region TEXT,
+                input_hash TEXT NOT NULL,
+                grade REAL,
+                result TEXT,
+                mode TEXT NOT NULL,
+                details TEXT)""")
+            for column in ("partner", "control", "model_id", "input_hash", "created"):
+                db.execute("CREATE INDEX IF NOT EXISTS evaluations_{0} ON evaluations ({0}, id)".format(column))
+            db.execute("CREATE INDEX IF NOT EXISTS evaluations_partner_control ON evaluations "
+                       "(partner, control, created)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def record(self, evaluations):
+        """Append evaluations, given as dicts with partner, control, model_id,
+        region, input, grade, result, mode and (optional) details. With an
+        input_hash as well, input is only stored as a reference to the input
+        (e.g. the file a long input was read from)."""
+        now = time.time()
+        inputs = {}
+        rows = []
+        for evaluation in evaluations:
+            hashed = evaluation.get('input_hash') or input_hash(evaluation['input'])
+            inputs[hashed] = evaluation['input']
+            details = evaluation.get('details')
+            rows.append((
+                evaluation.get('created', now), evaluation.get('partner'), evaluation['control'],
+                evaluation['model_id'], evaluation.get('region'), hashed, evaluation.get('grade'),
+                evaluation.get('result'), evaluation['mode'],
+                json.dumps(details) if details is not None else None))
+
+        with self._connect() as db:
+            db.executemany("INSERT OR IGNORE INTO inputs VALUES (?, ?)", inputs.items())
+            db.executemany(
+                "INSERT INTO evaluations (created, partner, control, model_id, region, input_hash, grade, "
+                "result, mode, details) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _where(self, partner=None, control=None, modelId=None, input_hash=None, since=None, until=None):
+        clauses = []
+        values = []
+        for column, value in (("partner", partner), ("control", control), ("model_id", modelId),
+                              ("input_hash", input_hash)):
+            if value is not None:
+                clauses.append(column + " = ?")
+                values.append(value)
+        if since is not None:
+            clauses.append("created >= ?")
+            values.append(since)
+        if until is not None:
+            clauses.append("created < ?")
+            values.append(until)
+        return clauses, values
+
+    def query(self, before_id=None, limit=PAGE_SIZE, **filters):
+        """One page of evaluations matching the filters (partner, control,
+        modelId, input_hash, since, until), newest first. Pass the id of the
+        last evaluation of a page as before_id for the next one."""
+        clauses, values = self._where(**filters)
+        if before_id is not None:
+            clauses.append("id < ?")
+            values.append(before_id)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT {} FROM evaluations{} ORDER BY id DESC LIMIT ?".format(COLUMNS, where),
+                values + [limit]).fetchall()
+        return [Evaluation(*row[:-1], json.loads(row[-1]) if row[-1] else None) for row in rows]
+
+    def count(self, **filters):
+        clauses, values = self._where(**filters)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM evaluations" + where, values).fetchone()[0]
+
+    def trend(self, partner, control, modelId=None):
+        """(created, grade) of the graded evaluations of a partner's control, oldest first."""
+        clauses, values = self._where(partner=partner, control=control, modelId=modelId)
+        with self._connect() as db:
+            return db.execute(
+                "SELECT created, grade FROM evaluations WHERE {} AND grade IS NOT NULL "
+                "ORDER BY created".format(" AND ".join(clauses)), values).fetchall()
+
+    def input(self, hashed):
+        with self._connect() as db:
+            row = db.execute("SELECT body FROM inputs WHERE input_hash = ?", (hashed,)).fetchone()
+        return row[0] if row else None
+
+    def distinct(self, column):
+        """Every value of partner, control or model_id, for filter menus."""
+        if column not in ("partner", "control", "model_id"):
+            raise ValueError("Unknown column: {}".format(column))
+        with self._connect() as db:
+            # Served from the column's index
+            return [row[0] for row in db.execute(
+                "SELECT DISTINCT {0} FROM evaluations WHERE {0} IS NOT NULL ORDER BY {0}".format(column))]
+
+_history = None
+
+def get_history():
+    global _history
+    if _history is None:
+        _history = EvaluationHistory()
+    return _history
+
+def record(partner, control, modelId, region, prompt_input, result, mode, grade=None, details=None):
+    """Append one evaluation. History is best effort: a failure to store it
+    is reported, not raised."""
+    record_many([{
+        "partner": partner, "control": control, "model_id": modelId, "region": region,
+        "input": prompt_input, "grade": grade, "result": result, "mode": mode, "details": details,
+    }])
+
+def record_many(evaluations):
+    try:
+        get_history().record(evaluations)
+    except sqlite3.Error as err:
+        print("Saving the evaluation history failed: {}".format(err))
+
+def record_consensus(partner, control, region, prompt_input, result):
+    """Append a grades.Consensus as a row per model that answered, with its
+    own grade and answer, so that model filters find them. Every row has
+    the consensus of all the models under "consensus" in its details."""
+    consensus = {"median": result.median, "reached": result.reached, "spread": result.spread,
+                 "agreeing": result.agreeing, "grades": {g.modelId: g.grade for g in result.grades}}
+    record_many([{
+        "partner": partner, "control": control, "model_id": g.modelId, "region": region,
+        "input": prompt_input, "grade": g.grade, "result": g.result, "mode": "consensus",
+        "details": {"consensus": consensus},
+    } for g in result.grades if g.error is None])
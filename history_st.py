@@ -0,0 +1,63 @@
+import time
+import streamlit as st
+
+import history
+
+APP_TITLE = "Evaluation History 📚"
+ANY = "(any)"
+
+st.title(APP_TITLE)
+
+store = history.get_history()
+
+def choose(label, column):
+    choice = st.sidebar.selectbox(label, [ANY] + store.distinct(column))
+    return None if choice == ANY else choice
+
+partner = choose("Partner:", "partner")
+control = choose("Control:", "control")
+modelId = choose("Model:", "model_id")
+input_hash = st.sidebar.text_input("Input hash:", placeholder="SHA-256 of the partner input").strip() or None
+page_size = st.sidebar.select_slider("Page size", options=[20, 50, 100, 200], value=history.PAGE_SIZE)
+
+filters = {"partner": partner, "control": control, "modelId": modelId, "input_hash": input_hash}
+
+# Pages are only read when asked for: the first one now, the next ones on
+# "Load more", each continuing from the id the previous page ended at
+if st.session_state.get("history_filters") != (filters, page_size):
+    st.session_state.history_filters = (filters, page_size)
+    st.session_state.history_rows = store.query(limit=page_size, **filters)
+    st.session_state.history_done = len(st.session_state.history_rows) < page_size
+
+if partner is not None and control is not None:
+    trend = store.trend(partner, control, modelId)
+    if trend:
+        st.subheader("Grade trend")
+        st.line_chart({"Grade": [grade for created, grade in trend]})
+        st.caption("{} graded evaluations, from {} to {}".format(
+            len(trend), time.strftime("%Y-%m-%d", time.localtime(trend[0][0])),
+            time.strftime("%Y-%m-%d", time.localtime(trend[-1][0]))))
+
+rows = st.session_state.history_rows
+st.subheader("Evaluations")
+st.caption("{} of {} matching evaluations".format(len(rows), store.count(**filters)))
+
+for evaluation in rows:
+    grade = "no grade" if evaluation.grade is None else "{:g}".format(evaluation.grade)
+    label = "{}  {}  {}  {}  ({})".format(
+        time.strftime("%Y-%m-%d %H:%M", time.localtime(evaluation.created)),
+        evaluation.partner or "-", evaluation.control, grade, evaluation.model_id)
+    with st.expander(label):
+        st.caption("Mode: {}, region: {}, input: {}".format(
+            evaluation.mode, evaluation.region or "-", evaluation.input_hash))
+        st.write(evaluation.result or "")
+        if evaluation.details:
+            st.json(evaluation.details)
+        if st.checkbox("Show partner input", key="input-{}".format(evaluation.id)):
+            st.text(store.input(evaluation.input_hash))
+
+if not st.session_state.history_done and st.button("Load more"):
+    page = store.query(before_id=rows[-1].id, limit=page_size, **filters)
+    st.session_state.history_rows = rows + page
+    st.session_state.history_done = len(page) < page_size
+    st.rerun()
@@ -1,13 +1,18 @@
 import os
 import sys
-import boto3
 import json
 import argparse
-import gnureadline # this requirement is needed to lift the input character limit
 from string import Template
-from simple_term_menu import TerminalMenu
 from termcolor import colored, cprint
 
+import bedrock_clients
+import daemon_client
+import model_catalog
+import providers
+import stream_decoder
+import stream_render
+import throttling
+
 PROMPT_TEMPLATE = "Improve upon the following text in a critical but helpful way:\n$input"
 MAX_TOKENS_COUNT = 2048
 
@@ -34,199 +39,171 @@ parser.add_argument(
     required=False,
     help='The foundation model identifier')
 
+parser.add_argument(
+    '--refresh-models',
+    action='store_true',
+    help='Refresh the cached list of foundation models')
+
+parser.add_argument(
+    '--no-daemon',
+    action='store_true',
+    help='Invoke the model from this process even when the evaluator daemon is running')
+
 parser.add_argument(
     '--body', 
     type=str,
     required=False,
     help='(blob) Text to improve')
 
-args = parser.parse_args()
+# The terminal menu and readline are imported only when an interactive
+# prompt is actually shown, so that runs given all their arguments (and
+# --help) start quickly
 
 def select_region():
+    from simple_term_menu import TerminalMenu
     terminal_menu = TerminalMenu(regions, 
                                  menu_highlight_style=("bg_green", "fg_black"),
                                  title="Select a region:")
     terminal_menu.show()
     return regions[terminal_menu.chosen_menu_entry]
 
-region = args.region
-if region is None or region not in regions.values():
-    region = select_region()
-
-print("In region: ", end="")
-cprint(region, "black", "on_green")
-
-try:
-    client = boto3.client('bedrock-runtime', region_name=region)
-except Exception as e:
-    print("Error: ", e)
-    exit(1)
-
-streaming_models = []
-model_client = boto3.client('bedrock', region_name=region)
-model_data = model_client.list_foundation_models()
-models = {}
-for model in model_data['modelSummaries']:
-    if ":" in model['modelId']:
-        continue
-    if "TEXT" in model['inputModalities'] and "TEXT" in model['outputModalities']:
-        models[model['modelName']] = model['modelId']
-        if model['responseStreamingSupported']:
-            streaming_models.append(model['modelId'])
-
 def select_model(models):
+    from simple_term_menu import TerminalMenu
     terminal_menu = TerminalMenu(models, 
                                  menu_highlight_style=("bg_green", "fg_black"),
                                  title="Select a model:")
     terminal_menu.show()
     return models[terminal_menu.chosen_menu_entry]
 
-modelId = args.model_id
-if modelId is None or modelId not in models.values():
-    modelId = select_model(models)
-
-print("Using model: ", end="")
-cprint(modelId, "black", "on_green")
-
-prompt_input = args.body
-if prompt_input is None:
+def read_input():
+    import gnureadline # this requirement is needed to lift the input character limit
     print("Enter text to improve: (Hit Ctrl-D on a blank new line to end) ", flush=True)
-    prompt_input = sys.stdin.read()
-
-accept = 'application/json'
-contentType = 'application/json'
+    return sys.stdin.read()
 
 def construct_prompt(body):
     t = Template(PROMPT_TEMPLATE)
     return t.substitute(input=body)
 
-if "cohere.command" in modelId:
-    body = json.dumps({
-        "prompt": construct_prompt(prompt_input),
-        "max_tokens": MAX_TOKENS_COUNT,
-        "temperature": 0.9,
-        "p": 0.9
-    })
-
-if "meta.llama2" in modelId:
-    body = json.dumps({
-        "prompt": construct_prompt(prompt_input),
-        "max_gen_len": MAX_TOKENS_COUNT,
-        "temperature": 0.9,
-        "top_p": 0.9
-    })
-
-if "amazon.titan" in modelId:
-    body = json.dumps({
-        "inputText": construct_prompt(prompt_input),
-        "textGenerationConfig": {
-            "maxTokenCount": MAX_TOKENS_COUNT,
-            "stopSequences": [],
-            "temperature": 0.9,
-            "topP": 0.9
-        }
-    })
-
-if "anthropic.claude" in modelId:
-    body = json.dumps({
-        "prompt": '\n\nHuman: {}\n\nAssistant:'.format(construct_prompt(prompt_input)),
-        "max_tokens_to_sample": MAX_TOKENS_COUNT,
-        "temperature": 0.75,
-        "top_k": 250,
-        "top_p": 1,
-        "stop_sequences": [ "Human:" ]
-    })
-
-if "ai21.j2" in modelId:
-    body = json.dumps({
-        "prompt": construct_prompt(prompt_input),
-        "maxTokens": MAX_TOKENS_COUNT,
-        "temperature": 0.7,
-        "topP": 1,
-        "stopSequences": [],
-        "countPenalty": {
-            "scale": 0
-        },
-        "presencePenalty": {
-            "scale": 0
-        },
-        "frequencyPenalty": {
-            "scale": 0
-        }
-    })
-
-print("Evaluating input:")
-cprint(prompt_input, "black", "on_green")
-
-print("="*78)
-print(f"Invoking model ({modelId}) with this payload:")
-print("-"*78)
-cprint(json.dumps(json.loads(body), indent=2), "black", "on_cyan")
-
-try:
-    if modelId in streaming_models:
-        response = client.invoke_model_with_response_stream(
-            body=body, modelId=modelId, accept=accept,  contentType=contentType)
-    else:
-        response = client.invoke_model(
-            body=body, modelId=modelId, accept=accept,  contentType=contentType)
-except Exception as err:
-    print(err)
-    exit(-1)
-
-print("="*78)
-streamed = ""
-if modelId in streaming_models:
-    streamed = "streamed "
-
-print("Here's the {}result: ".format(streamed))
-
-print("-"*78)
-
-if modelId in streaming_models:
-    chunks = []
-    for event in response['body']:
-        chunk = ''
-        response_chunk = json.loads(event['chunk'].get('bytes'))
-        if "amazon.titan" in modelId:
-            chunk = response_chunk['outputText']
-
-        if "anthropic.claude" in modelId:
-            chunk = response_chunk['completion']
+def improve_in_daemon(daemon, region, modelId, prompt_input):
+    renderer = stream_render.StreamRenderer()
+    for event, data in daemon.improve(region=region, model_id=modelId, body=prompt_input):
+        if event == "start":
+            print("="*78)
+            print("Here's the {}result: ".format("streamed " if data["streaming"] else ""))
+            print("-"*78)
+        elif event == "chunk":
+            renderer.feed(data["text"])
+        elif event == "result" and data["error"] is None:
+            if renderer.count:
+                renderer.close()
+            else:
+                cprint(data["result"], "black", "on_yellow")
+            print("="*78)
+            return
+        elif event in ("result", "error"):
+            cprint(data["error"], "black", "on_red")
+            exit(1)
+
+    cprint("The evaluator daemon stopped before the result was complete", "black", "on_red")
+    exit(1)
 
-        if "cohere.command" in modelId:
-            chunk = response_chunk['generations'][0]['text']
+def main():
+    args = parser.parse_args()
+    # A running evaluator_daemon.py has warm clients and catalogs
+    daemon = None if args.no_daemon else daemon_client.connect()
+
+    region = args.region
+    if region is None or region not in regions.values():
+        region = select_region()
+
+    print("In region: ", end="")
+    cprint(region, "black", "on_green")
+
+    modelId = args.model_id
+    known = None
+    if modelId is not None and not args.refresh_models:
+        # A model seen before is looked up in the stored catalog, however
+        # old, instead of listing the foundation models again
+        known = model_catalog.get_known_models(region, [modelId])
+    if known is None and daemon is not None and not args.refresh_models:
+        try:
+            known = daemon.models(region)
+        except (OSError, daemon_client.DaemonError):
+            daemon = None
+    if known is not None:
+        models, streaming_models = known
+    else:
+        models, streaming_models = model_catalog.get_models(region, args.refresh_models)
+
+    if modelId is None or modelId not in models.values():
+        modelId = select_model(models)
+
+    print("Using model: ", end="")
+    cprint(modelId, "black", "on_green")
+
+    prompt_input = args.body
+    if prompt_input is None:
+        prompt_input = read_input()
+
+    provider = providers.get_provider(modelId)
+    body = provider.payload(construct_prompt(prompt_input), MAX_TOKENS_COUNT)
+
+    print("Evaluating input:")
+    cprint(prompt_input, "black", "on_green")
+
+    print("="*78)
+    print(f"Invoking model ({modelId}) with this payload:")
+    print("-"*78)
+    cprint(json.dumps(json.loads(body), indent=2), "black", "on_cyan")
+
+    if daemon is not None:
+        try:
+            improve_in_daemon(daemon, region, modelId, prompt_input)
+        except (OSError, daemon_client.DaemonError) as err:
+            cprint("Evaluator daemon: {}".format(err), "black", "on_red")
+            exit(1)
+        return
+
+    try:
+        client = bedrock_clients.get_client(region)
+    except Exception as e:
+        print("Error: ", e)
+        exit(1)
+
+    try:
+        response = throttling.invoke_model(client, modelId, body, modelId in streaming_models)
+    except throttling.InvocationError as err:
+        cprint(err, "black", "on_red")
+        exit(1)
+
+    print("="*78)
+    streamed = ""
+    if modelId in streaming_models:
+        streamed = "streamed "
 
-        if "meta.llama2" in modelId:
-            chunk = response_chunk['generation']
+    print("Here's the {}result: ".format(streamed))
 
-        if not chunks:
-            chunk = chunk.lstrip()
+    print("-"*78)
 
-        cprint(chunk, "black", "on_yellow", end="", flush=True)
-        chunks.append(chunk)
+    if modelId in streaming_models:
+        decoder = stream_decoder.StreamDecoder(modelId)
+        renderer = stream_render.StreamRenderer()
+        for chunk in decoder.texts(response['body']):
+            if not renderer.count:
+                chunk = chunk.lstrip()
 
-    print()
+            renderer.feed(chunk)
 
-else:
-    response_body = json.loads(response.get('body').read())
+        renderer.close()
 
-    result = ''
-    if "amazon.titan" in modelId:
-        result = response_body['results'][0]['outputText']
+    else:
+        response_body = json.loads(response.get('body').read())
 
-    if "anthropic.claude" in modelId:
-        result = response_body['completion']
+        result = provider.result_text(response_body)
 
-    if "ai21.j2" in modelId:
-        result = response_body['completions'][0]['data']['text']
-        
-    if "cohere.command" in modelId:
-        result = response_body['generations'][0]['text']
-        
-    if "meta.llama2" in modelId:
-        result = response_body['generation']
+        cprint(result.lstrip(), "black", "on_yellow")
 
-    cprint(result.lstrip(), "black", "on_yellow")
+    print("="*78)
 
-print("="*78)
+if __name__ == "__main__":
+    main()
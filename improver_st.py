@@ -1,14 +1,23 @@
-import boto3
 import json
 import streamlit as st
 from string import Template
 from termcolor import colored, cprint
 
+import bedrock_clients
+import providers
+import region_prober
+import response_cache
+import stream_decoder
+import stream_render
+import throttling
+
 APP_TITLE = "Text Improver 💡"
 PROMPT_TEMPLATE = "Improve upon the following text in a critical but helpful way:\n$INPUT"
 
 temperature = st.sidebar.slider("Temperature", 0.0, 1.0, 0.9)
 maxtokens = st.sidebar.slider("Max Tokens", 1, 2048, 1024)
+use_cache = st.sidebar.checkbox("Reuse cached responses", value=False)
+force_cache = st.sidebar.checkbox("Cache even when temperature > 0", value=False, disabled=not use_cache)
 
 # AWS Bedrock Regions (as of Dec 2023)
 regions = {
@@ -23,36 +32,12 @@ region = 'US East (N. Virginia)'
 region = st.sidebar.radio(
     label='Select a region:',
     index=0,
-    options=regions
+    options=list(regions) + [region_prober.AUTO_REGION_LABEL]
 )
-region = regions[region]
-
-print("In region: ", end="")
-cprint(region, "black", "on_green")
-
-try:
-    client = boto3.client('bedrock-runtime', region_name=region)
-except Exception as e:
-    print("Error: ", e)
-    exit(1)
-
-models = {}
-streaming_models = []
-
-def get_models(region):
-    model_client = boto3.client('bedrock', region_name=region)
-    model_data = model_client.list_foundation_models()
-    for model in model_data['modelSummaries']:
-        if ":" in model['modelId']:
-            continue
-        if "TEXT" in model['inputModalities'] and "TEXT" in model['outputModalities']:
-            models[model['modelName']] = model['modelId']
-            if model['responseStreamingSupported']:
-                streaming_models.append(model['modelId'])
-    
-    return models, streaming_models
+region = regions.get(region, region_prober.AUTO_REGION)
 
-models, streaming_models = get_models(region)
+refresh_models = st.sidebar.button("Refresh models", type='secondary')
+models, streaming_models = region_prober.get_models(region, regions.values(), refresh=refresh_models)
 
 modelId = 'Titan Text Large'
 
@@ -64,6 +49,23 @@ modelId = st.sidebar.radio(
 
 modelId = models[modelId]
 
+if region == region_prober.AUTO_REGION:
+    try:
+        region, models, streaming_models = region_prober.fastest_region(regions.values(), modelId)
+    except ValueError as err:
+        st.error(err)
+        st.stop()
+    st.sidebar.caption("Fastest region: {}".format(region))
+
+print("In region: ", end="")
+cprint(region, "black", "on_green")
+
+try:
+    client = bedrock_clients.get_client(region)
+except Exception as e:
+    print("Error: ", e)
+    exit(1)
+
 print("Using model: ", end="")
 cprint(modelId, "black", "on_green")
 
@@ -71,70 +73,13 @@ st.title(APP_TITLE)
 
 prompt_input = ''
 
-accept = 'application/json'
-contentType = 'application/json'
-
 def construct_prompt(body, template):
     t = Template(template)
     return t.substitute(INPUT=body)
 
 def construct_payload(prompt_input, template):
-    if "cohere.command" in modelId:
-        body = json.dumps({
-            "prompt": construct_prompt(prompt_input, template),
-            "max_tokens": maxtokens,
-            "temperature": temperature,
-            "p": 0.9
-        })
-
-    if "meta.llama2" in modelId:
-        body = json.dumps({
-            "prompt": construct_prompt(prompt_input, template),
-            "max_gen_len": maxtokens,
-            "temperature": temperature,
-            "top_p": 0.9
-        })
-
-    if "amazon.titan" in modelId:
-        body = json.dumps({
-            "inputText": construct_prompt(prompt_input, template),
-            "textGenerationConfig": {
-                "maxTokenCount": maxtokens,
-                "stopSequences": [],
-                "temperature": temperature,
-                "topP": 0.9
-            }
-        })
-
-    if "anthropic.claude" in modelId:
-        body = json.dumps({
-            "prompt": '\n\nHuman: {}\n\nAssistant:'.format(construct_prompt(prompt_input, template)),
-            "max_tokens_to_sample": maxtokens,
-            "temperature": temperature,
-            "top_k": 250,
-            "top_p": 1,
-            "stop_sequences": [ "Human:" ]
-        })
-
-    if "ai21.j2" in modelId:
-        body = json.dumps({
-            "prompt": construct_prompt(prompt_input, template),
-            "maxTokens": maxtokens,
-            "temperature": temperature,
-            "topP": 1,
-            "stopSequences": [],
-            "countPenalty": {
-                "scale": 0
-            },
-            "presencePenalty": {
-                "scale": 0
-            },
-            "frequencyPenalty": {
-                "scale": 0
-            }
-        })
-    
-    return body
+    provider = providers.get_provider(modelId)
+    return provider.payload(construct_prompt(prompt_input, template), maxtokens, temperature)
 
 def ai_request(body):
     print("Evaluating input:")
@@ -146,15 +91,12 @@ def ai_request(body):
     cprint(json.dumps(json.loads(body), indent=2), "black", "on_cyan")
 
     try:
-        if modelId in streaming_models:
-            response = client.invoke_model_with_response_stream(
-                body=body, modelId=modelId, accept=accept,  contentType=contentType)
-        else:
-            response = client.invoke_model(
-                body=body, modelId=modelId, accept=accept,  contentType=contentType)
-    except Exception as err:
-        print(err)
-        exit(-1)
+        response = response_cache.invoke(client, modelId, body, modelId in streaming_models,
+                                         use_cache=use_cache, force=force_cache)
+    except throttling.InvocationError as err:
+        cprint(err, "black", "on_red")
+        st.error(err)
+        st.stop()
 
     print("="*78)
 
@@ -164,59 +106,32 @@ def ai_response(response):
     c = st.empty()
 
     streamed = ""
-    if modelId in streaming_models:
+    if response.get('cached'):
+        streamed = "cached "
+    elif modelId in streaming_models:
         streamed = "streamed "
 
     print("Here's the {}result: ".format(streamed))
 
     print("-"*78)
+    provider = providers.get_provider(modelId)
     if modelId in streaming_models:
-        chunks = []
-        for event in response['body']:
-            chunk = ''
-            response_chunk = json.loads(event['chunk'].get('bytes'))
-            if "amazon.titan" in modelId:
-                chunk = response_chunk['outputText']
-
-            if "anthropic.claude" in modelId:
-                chunk = response_chunk['completion']
-
-            if "cohere.command" in modelId:
-                chunk = response_chunk['generations'][0]['text']
-
-            if "meta.llama2" in modelId:
-                chunk = response_chunk['generation']
-
-            if not chunks:
+        decoder = stream_decoder.StreamDecoder(modelId)
+        renderer = stream_render.StreamRenderer(c.write)
+        for chunk in decoder.texts(response['body']):
+            if not renderer.count:
                 chunk = chunk.lstrip()
 
-            cprint(chunk, "black", "on_yellow", end="", flush=True)
-            chunks.append(chunk)
-            c.write(''.join(chunks) + "▌")
+            renderer.feed(chunk)
 
-        print()
+        result = renderer.close()
         print("="*78)
-        c.write(''.join(chunks))
-        return ''.join(chunks)
+        return result
 
     else:
         response_body = json.loads(response.get('body').read())
 
-        result = ''
-        if "amazon.titan" in modelId:
-            result = response_body['results'][0]['outputText']
-
-        if "anthropic.claude" in modelId:
-            result = response_body['completion']
-
-        if "ai21.j2" in modelId:
-            result = response_body['completions'][0]['data']['text']
-            
-        if "cohere.command" in modelId:
-            result = response_body['generations'][0]['text']
-            
-        if "meta.llama2" in modelId:
-            result = response_body['generation']
+        result = provider.result_text(response_body)
 
         cprint(result.lstrip(), "black", "on_yellow")
         print("="*78)
@@ -1,4 +1,3 @@
-import boto3
 import json
 import streamlit as st
 from string import Template
@@ -6,6 +5,15 @@ from termcolor import colored, cprint
 import random
 import time
 
+import bedrock_clients
+import conversation_memory
+import providers
+import region_prober
+import stream_decoder
+import stream_render
+import throttling
+import token_counter
+
 PAGE_TITLE = "I Remember Everything"
 PAGE_ICON = ":mechanic:"
 APP_TITLE = ":blue[{}] {}".format(PAGE_TITLE, PAGE_ICON)
@@ -13,14 +21,15 @@ PROMPT_TEMPLATE = "You are a helpful and succinct assistant. Give a one-sentence
 ASSISTANT_PROMPT = "Hello there! How can I assist you today?"
 NEW_CONVERSATION_KEYWORD = "/new"
 USER_PROMPT = "What's up? To begin a new conversation, please type \"{}\" without the quotation marks.".format(NEW_CONVERSATION_KEYWORD)
+SUMMARY_MAX_TOKENS = 512
 
 st.set_page_config(page_title=PAGE_TITLE, page_icon=PAGE_ICON)
 st.header(APP_TITLE, divider=False)
 st.chat_message("Assistant").markdown(ASSISTANT_PROMPT)
 
 # Initialize chat history
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+if "memory" not in st.session_state:
+    st.session_state.memory = conversation_memory.ConversationMemory()
 
 if "chat_size" not in st.session_state:
     st.session_state.chat_size = 0
@@ -29,19 +38,27 @@ memory_size = st.sidebar.empty()
 prompt_template = st.sidebar.text_area(label="Prompt Template", value=PROMPT_TEMPLATE)
 temperature = st.sidebar.slider("Temperature", 0.0, 1.0, 0.5)
 maxtokens = st.sidebar.slider("Max Tokens", 1, 2048, 1024)
+memory_budget = st.sidebar.slider("Memory Budget (tokens)", 256, 8192, conversation_memory.TOKEN_BUDGET)
+recent_turns = st.sidebar.slider("Recent Turns Kept Verbatim", 2, 20, conversation_memory.RECENT_TURNS)
+
+memory = st.session_state.memory
+memory.token_budget = memory_budget
+memory.recent_turns = recent_turns
 
 def refresh_memory():
-    if st.session_state.chat_size > maxtokens:
-        token_size = ":red[{}]".format(st.session_state.chat_size)
-    elif st.session_state.chat_size > maxtokens*0.8:
-        token_size = ":orange[{}]".format(st.session_state.chat_size)
+    # Estimated counts are shown as such
+    size = "{}{}".format("" if st.session_state.get("tokens_exact") else "~", st.session_state.chat_size)
+    if st.session_state.chat_size > memory_budget:
+        token_size = ":red[{}]".format(size)
+    elif st.session_state.chat_size > memory_budget*0.8:
+        token_size = ":orange[{}]".format(size)
     else:
-        token_size = ":green[{}]".format(st.session_state.chat_size)
+        token_size = ":green[{}]".format(size)
 
-    memory_size.markdown(body="<small>Est. Tokens in Conversation: {}</small>".format(token_size), unsafe_allow_html=True)
+    memory_size.markdown(body="<small>Tokens in Memory: {}</small>".format(token_size), unsafe_allow_html=True)
 
 def initialize_session_state():
-    st.session_state.messages = []
+    memory.clear()
     st.session_state.chat_size = 0
     refresh_memory()
 
@@ -60,36 +77,12 @@ region = 'US East (N. Virginia)'
 region = st.sidebar.radio(
     label='Select a region:',
     index=0,
-    options=regions
+    options=list(regions) + [region_prober.AUTO_REGION_LABEL]
 )
-region = regions[region]
-
-print("In region: ", end="")
-cprint(region, "black", "on_green")
+region = regions.get(region, region_prober.AUTO_REGION)
 
-try:
-    client = boto3.client('bedrock-runtime', region_name=region)
-except Exception as e:
-    print("Error: ", e)
-    exit(1)
-
-models = {}
-streaming_models = []
-
-def get_models(region):
-    model_client = boto3.client('bedrock', region_name=region)
-    model_data = model_client.list_foundation_models()
-    for model in model_data['modelSummaries']:
-        if ":" in model['modelId']:
-            continue
-        if "TEXT" in model['inputModalities'] and "TEXT" in model['outputModalities']:
-            models[model['modelName']] = model['modelId']
-            if model['responseStreamingSupported']:
-                streaming_models.append(model['modelId'])
-    
-    return models, streaming_models
-
-models, streaming_models = get_models(region)
+refresh_models = st.sidebar.button("Refresh models", type='secondary')
+models, streaming_models = region_prober.get_models(region, regions.values(), refresh=refresh_models)
 
 modelId = 'Titan Text Large'
 
@@ -101,6 +94,23 @@ modelId = st.sidebar.radio(
 
 modelId = models[modelId]
 
+if region == region_prober.AUTO_REGION:
+    try:
+        region, models, streaming_models = region_prober.fastest_region(regions.values(), modelId)
+    except ValueError as err:
+        st.error(err)
+        st.stop()
+    st.sidebar.caption("Fastest region: {}".format(region))
+
+print("In region: ", end="")
+cprint(region, "black", "on_green")
+
+try:
+    client = bedrock_clients.get_client(region)
+except Exception as e:
+    print("Error: ", e)
+    exit(1)
+
 print("Using model: ", end="")
 cprint(modelId, "black", "on_green")
 if "model" not in st.session_state:
@@ -110,72 +120,19 @@ else:
         initialize_session_state()
         st.session_state["model"] = modelId
 
-prompt_input = ''
+# Count tokens with the selected model's tokenizer; counts are cached per message
+memory.count_tokens = token_counter.get_counter(modelId).count
+st.session_state.tokens_exact = token_counter.get_counter(modelId).exact
 
-accept = 'application/json'
-contentType = 'application/json'
+prompt_input = ''
 
 def construct_prompt(body, prompt_template):
     t = Template(prompt_template)
     return t.substitute(INPUT=body)
 
 def construct_payload(prompt_input, prompt_template):
-    if "cohere.command" in modelId:
-        body = json.dumps({
-            "prompt": construct_prompt(prompt_input, prompt_template),
-            "max_tokens": maxtokens,
-            "temperature": temperature,
-            "p": 0.9
-        })
-
-    if "meta.llama2" in modelId:
-        body = json.dumps({
-            "prompt": construct_prompt(prompt_input, prompt_template),
-            "max_gen_len": maxtokens,
-            "temperature": temperature,
-            "top_p": 0.9
-        })
-
-    if "amazon.titan" in modelId:
-        body = json.dumps({
-            "inputText": construct_prompt(prompt_input, prompt_template),
-            "textGenerationConfig": {
-                "maxTokenCount": maxtokens,
-                "stopSequences": [ "User:"],
-                "temperature": temperature,
-                "topP": 0.9
-            }
-        })
-
-    if "anthropic.claude" in modelId:
-        body = json.dumps({
-            "prompt": '\n\nHuman: {}\n\nAssistant:'.format(construct_prompt(prompt_input, prompt_template)),
-            "max_tokens_to_sample": maxtokens,
-            "temperature": temperature,
-            "top_k": 250,
-            "top_p": 1,
-            "stop_sequences": [ "Human:", "User:" ]
-        })
-
-    if "ai21.j2" in modelId:
-        body = json.dumps({
-            "prompt": construct_prompt(prompt_input, prompt_template),
-            "maxTokens": maxtokens,
-            "temperature": temperature,
-            "topP": 1,
-            "stopSequences": [ "User:" ],
-            "countPenalty": {
-                "scale": 0
-            },
-            "presencePenalty": {
-                "scale": 0
-            },
-            "frequencyPenalty": {
-                "scale": 0
-            }
-        })
-    
-    return body
+    provider = providers.get_provider(modelId)
+    return provider.payload(construct_prompt(prompt_input, prompt_template), maxtokens, temperature, stop_sequences=[ "User:" ])
 
 def ai_request(body):
     print("Evaluating input:")
@@ -187,21 +144,24 @@ def ai_request(body):
     cprint(json.dumps(json.loads(body), indent=2), "black", "on_cyan")
 
     try:
-        if modelId in streaming_models:
-            response = client.invoke_model_with_response_stream(
-                body=body, modelId=modelId, accept=accept,  contentType=contentType)
-        else:
-            response = client.invoke_model(
-                body=body, modelId=modelId, accept=accept,  contentType=contentType)
-    except Exception as err:
+        response = throttling.invoke_model(client, modelId, body, modelId in streaming_models)
+    except throttling.InvocationError as err:
         cprint(err, "black", "on_red")
         st.error(err)
-        exit(-1)
+        st.stop()
 
     print("="*78)
 
     return response
 
+def summarize_conversation(client, modelId, summary, conversation):
+    provider = providers.get_provider(modelId)
+    body = provider.payload(
+        conversation_memory.SUMMARY_PROMPT.format(summary=summary, conversation=conversation),
+        SUMMARY_MAX_TOKENS, 0)
+    response = throttling.invoke_model(client, modelId, body, False)
+    return provider.result_text(json.loads(response['body'].read())).strip()
+
 def strip_prefix(result):
     prefix = "Assistant:"
     if result.startswith(prefix):
@@ -218,53 +178,24 @@ def ai_response(response, c):
     print("Here's the {}result: ".format(streamed))
 
     print("-"*78)
+    provider = providers.get_provider(modelId)
     if modelId in streaming_models:
-        chunks = []
-        for event in response['body']:
-            chunk = ''
-            response_chunk = json.loads(event['chunk'].get('bytes'))
-            if "amazon.titan" in modelId:
-                chunk = response_chunk['outputText']
-
-            if "anthropic.claude" in modelId:
-                chunk = response_chunk['completion']
-
-            if "cohere.command" in modelId:
-                chunk = response_chunk['generations'][0]['text']
-
-            if "meta.llama2" in modelId:
-                chunk = response_chunk['generation']
-
-            if not chunks:
+        decoder = stream_decoder.StreamDecoder(modelId)
+        renderer = stream_render.StreamRenderer(c.markdown)
+        for chunk in decoder.texts(response['body']):
+            if not renderer.count:
                 chunk = strip_prefix(chunk)
 
-            cprint(chunk, "black", "on_yellow", end="", flush=True)
-            chunks.append(chunk)
-            c.markdown(''.join(chunks) + "▌")
+            renderer.feed(chunk)
 
-        print()
+        result = renderer.close()
         print("="*78)
-        c.markdown(''.join(chunks))
-        return strip_prefix(''.join(chunks))
+        return strip_prefix(result)
 
     else:
         response_body = json.loads(response.get('body').read())
 
-        result = ''
-        if "amazon.titan" in modelId:
-            result = response_body['results'][0]['outputText']
-
-        if "anthropic.claude" in modelId:
-            result = response_body['completion']
-
-        if "ai21.j2" in modelId:
-            result = response_body['completions'][0]['data']['text']
-            
-        if "cohere.command" in modelId:
-            result = response_body['generations'][0]['text']
-            
-        if "meta.llama2" in modelId:
-            result = response_body['generation']
+        result = provider.result_text(response_body)
 
         result = strip_prefix(result)
         cprint(result.lstrip(), "black", "on_yellow")
@@ -274,7 +205,7 @@ def ai_response(response, c):
         return result.lstrip()
 
 # Display chat messages from history on app rerun
-for message in st.session_state.messages:
+for message in memory.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
@@ -286,25 +217,25 @@ if prompt := st.chat_input(USER_PROMPT):
         exit(0)
 
     # Add user message to chat history
-    st.session_state.messages.append({"role": "User", "content": prompt})
+    memory.append("User", prompt)
 
     # Display user message in chat message container
     st.chat_message("User").markdown(prompt)
 
     # Display assistant response in chat message container
-    full_request = ""
     with st.chat_message("Assistant"):
         message_placeholder = st.empty()
 
-        for m in st.session_state.messages:
-            full_request += m["role"] + ": " + m["content"] + "\n"
-                             
+        # The latest turns verbatim, plus a summary of the older ones
+        full_request = memory.prompt()
         payload = construct_payload(full_request, prompt_template)
         response = ai_request(payload)
         answer = strip_prefix(ai_response(response, message_placeholder))
 
     # Add assistant response to chat history
-    st.session_state.messages.append({"role": "Assistant", "content": answer})
-    full_request += "Assistant: " + answer + "\n"
-    st.session_state.chat_size = int(len(full_request)/4)
+    memory.append("Assistant", answer)
+
+    # Fold the turns that left the recent window into the summary, in the background
+    memory.summarize(lambda summary, conversation: summarize_conversation(client, modelId, summary, conversation))
+    st.session_state.chat_size = memory.size()
     refresh_memory()
@@ -0,0 +1,241 @@
+import io
+import hashlib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import control_catalog
+import grades
+import metrics
+import providers
+import token_counter
+
+# Partner input too long for the model's context window is assessed in
+# chunks of at most the tokens left over by the control's prompt and the
+# completion (map), and the findings of the chunks are then combined into
+# one grade (reduce). Consecutive chunks share up to OVERLAP_TOKENS, so
+# evidence cut in two at a chunk boundary is still seen whole once.
+OVERLAP_TOKENS = 200
+# Part of the context window kept free, as the token counts may be estimates
+CONTEXT_MARGIN = 0.1
+MAP_MAX_TOKENS = 600
+# Characters read from the partner input file at a time
+BLOCK_SIZE = 64 * 1024
+
+MAP_NOTE = """The partner response is too long to assess at once, so it is assessed in excerpts. The partner response below is excerpt {number} of it. Assess only what this excerpt contains: name the evidence it gives for each requirement, and which requirements it does not address, as other excerpts may cover them.
+
+"""
+REDUCE_NOTE = """The partner response was too long to assess at once, so each of its excerpts was assessed on its own. In place of the partner response, the findings of every excerpt are given below. Evidence found in any excerpt counts for the whole response, so a requirement is only missing if no excerpt addresses it. Combine the findings into one assessment of the whole partner response.
+
+"""
+FINDING = '<excerpt-findings excerpts="{}">\n{}\n</excerpt-findings>'
+
+LongResult = namedtuple('LongResult', ['result', 'grade', 'chunks', 'findings', 'input_hash'])
+Finding = namedtuple('Finding', ['excerpts', 'result', 'grade'])
+
+class HashingReader:
+    """A text file object that hashes what is read from it, so that the
+    SHA-256 of the whole input (as history.input_hash gives for the text) is
+    known once it has been read, without keeping it."""
+
+    def __init__(self, text_file):
+        self.text_file = text_file
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        text = self.text_file.read(size)
+        self.digest.update(text.encode('utf-8'))
+        return text
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+def construct_map_prompt(control, excerpt, number):
+    return MAP_NOTE.format(number=number) + control_catalog.get_catalog().render(control, excerpt)
+
+def construct_reduce_prompt(control, findings):
+    return REDUCE_NOTE + control_catalog.get_catalog().render(
+        control, "\n\n".join(FINDING.format(finding.excerpts, finding.result) for finding in findings))
+
+def context_budget(modelId, max_tokens):
+    """Tokens a whole prompt may take next to a max_tokens completion."""
+    context_window = providers.get_provider(modelId).context_window
+    return int(context_window * (1 - CONTEXT_MARGIN)) - max_tokens
+
+def chunk_budget(modelId, control, max_tokens=MAP_MAX_TOKENS):
+    """Tokens of partner input that fit in one map prompt."""
+    overhead = token_counter.count_tokens(modelId, construct_map_prompt(control, "", 0))
+    return context_budget(modelId, max_tokens) - overhead
+
+def fits(modelId, control, prompt_input, max_tokens):
+    """Whether the partner input can be evaluated in a single prompt."""
+    prompt = control_catalog.get_catalog().render(control, prompt_input)
+    return token_counter.count_tokens(modelId, prompt) <= context_budget(modelId, max_tokens)
+
+def pieces(text_file, block_size=BLOCK_SIZE):
+    """Yield the text of a file in pieces ending at line breaks, reading
+    block_size characters at a time. Lines longer than a block are cut at
+    the last space."""
+    rest = ""
+    while True:
+        block = text_file.read(block_size)
+        if not block:
+            break
+        text = rest + block
+        cut = text.rfind("\n") + 1 or text.rfind(" ") + 1 or len(text)
+        rest = text[cut:]
+        yield from text[:cut].splitlines(keepends=True)
+    if rest:
+        yield rest
+
+def chunks(text_file, modelId, chunk_tokens, overlap_tokens=OVERLAP_TOKENS):
+    """Yield chunks of the text of a file of at most chunk_tokens tokens,
+    each starting with the last (up to overlap_tokens) tokens of the one
+    before, as far as they fit. Only the chunk being filled is held in
+    memory."""
+    tokenizer = token_counter.get_counter(modelId).tokenizer
+    overlap_tokens = min(overlap_tokens, chunk_tokens // 4)
+    current = []
+    size = 0
+    fresh = False
+
+    # Parts of long lines leave room for the overlap before them
+    part_tokens_max = chunk_tokens - overlap_tokens
+
+    def split(piece, tokens):
+        # A line too long for a chunk is cut into parts that are counted to
+        # fit: between words where it has spaces, else anywhere (CJK text,
+        # base64, text extracted from PDFs)
+        chars_per_token = len(piece) / tokens
+        while piece:
+            size = max(1, int(part_tokens_max * chars_per_token))
+            while True:
+                part = piece[:size]
+                if len(part) < len(piece):
+                    space = part.rfind(" ") + 1
+                    if space > size // 2:
+                        part = part[:space]
+                part_tokens = tokenizer.count(part)
+                if part_tokens <= part_tokens_max or size == 1:
+                    break
+                size = max(1, min(size - 1, int(size * part_tokens_max / part_tokens * 0.95)))
+            yield part, part_tokens
+            piece = piece[len(part):]
+
+    for piece in pieces(text_file):
+        tokens = tokenizer.count(piece)
+        parts = [(piece, tokens)] if tokens <= part_tokens_max else split(piece, tokens)
+        for part, tokens in parts:
+            if size + tokens > chunk_tokens and fresh:
+                yield "".join(text for text, _ in current)
+                kept = []
+                kept_size = 0
+                for text, n in reversed(current):
+                    if kept_size + n > overlap_tokens:
+                        break
+                    kept.insert(0, (text, n))
+                    kept_size += n
+                # Overlap that would push the next part past the chunk size
+                # is left out
+                while kept and kept_size + tokens > chunk_tokens:
+                    kept_size -= kept.pop(0)[1]
+                current, size, fresh = kept, kept_size, False
+            current.append((part, tokens))
+            size += tokens
+            fresh = True
+    if fresh:
+        yield "".join(text for text, _ in current)
+
+def evaluate_long(client, control, modelId, input_file, streaming, max_tokens, max_workers,
+                  chunk_tokens=None, overlap_tokens=OVERLAP_TOKENS, use_cache=False, force_cache=False,
+                  hedge_regions=None, temperature=None):
+    """Evaluate a control on partner input read from a text file object,
+    however long it is.
+
+    Input that fits in one prompt is evaluated as usual. Longer input is
+    read a chunk at a time; up to max_workers chunks are assessed at once
+    (map), and their findings are then combined, in as many rounds as the
+    context window requires, into one assessment (reduce)."""
+    provider = providers.get_provider(modelId)
+    chunk_tokens = chunk_tokens or chunk_budget(modelId, control)
+    cancelled = threading.Event()
+
+    def complete(prompt, tokens):
+        with metrics.labels(control=control):
+            return grades.complete(client, modelId, provider.payload(prompt, tokens, temperature), streaming, cancelled,
+                                   use_cache, force_cache, hedge_regions)
+
+    def assess(number, excerpt):
+        result = complete(construct_map_prompt(control, excerpt, number), MAP_MAX_TOKENS)
+        return Finding(str(number), result, grades.parse_grade(result))
+
+    input_file = HashingReader(input_file)
+    parts = chunks(input_file, modelId, chunk_tokens, overlap_tokens)
+    first = next(parts, "")
+    second = next(parts, None)
+    if second is None and fits(modelId, control, first, max_tokens):
+        result = complete(control_catalog.get_catalog().render(control, first), max_tokens)
+        return LongResult(result, grades.parse_grade(result), 1, [], input_file.hexdigest())
+
+    findings = {}
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        def drain(block_until):
+            while len(pending) > block_until:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    findings[pending.pop(future)] = future.result()
+
+        excerpts = [first] + ([second] if second is not None else [])
+        for number, excerpt in enumerate(excerpts, 1):
+            pending[executor.submit(assess, number, excerpt)] = number
+        for number, excerpt in enumerate(parts, len(excerpts) + 1):
+            # Only a bounded number of chunks is read ahead of the model
+            drain(max_workers * 2 - 1)
+            pending[executor.submit(assess, number, excerpt)] = number
+        drain(0)
+    except BaseException:
+        # On a failed chunk, the others stop at their next streamed chunk
+        cancelled.set()
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    findings = [findings[number] for number in sorted(findings)]
+
+    result = reduce_findings(control, modelId, findings, max_tokens, max_workers, complete)
+    return LongResult(result, grades.parse_grade(result), len(findings), findings, input_file.hexdigest())
+
+def reduce_findings(control, modelId, findings, max_tokens, max_workers, complete):
+    """Combine findings into one assessment. When they do not all fit in one
+    prompt, groups of them are combined first."""
+    budget = context_budget(modelId, max_tokens)
+    while True:
+        prompt = construct_reduce_prompt(control, findings)
+        if len(findings) == 1 or token_counter.count_tokens(modelId, prompt) <= budget:
+            return complete(prompt, max_tokens)
+
+        groups = [[]]
+        for finding in findings:
+            if groups[-1] and token_counter.count_tokens(
+                    modelId, construct_reduce_prompt(control, groups[-1] + [finding])) > budget:
+                groups.append([])
+            groups[-1].append(finding)
+        if len(groups) == len(findings):
+            # Not even two findings fit together: combine what fits of them
+            groups = [findings[i:i + 2] for i in range(0, len(findings), 2)]
+
+        def combine(group):
+            excerpts = "{}-{}".format(group[0].excerpts.split("-")[0], group[-1].excerpts.split("-")[-1])
+            result = complete(construct_reduce_prompt(control, group), max_tokens)
+            return Finding(excerpts, result, grades.parse_grade(result))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            findings = list(executor.map(combine, groups))
+
+def open_input(path=None, text=None):
+    """The partner input as a text file object: the file at path, read as
+    it is evaluated, or a string."""
+    if path is not None:
+        return open(path, "r", encoding="utf-8", errors="replace")
+    return io.StringIO(text)
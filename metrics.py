@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import stream_decoder
+
+# Invocation metrics are always aggregated in memory; set any of these to
+# export them:
+#   SOFTR_METRICS_LOG   JSONL file with one record per invocation
+#   SOFTR_METRICS_FILE  Prometheus text file (e.g. for node_exporter's
+#                       textfile collector), rewritten every WRITE_INTERVAL
+#   SOFTR_METRICS_PORT  port serving the Prometheus text at /metrics
+METRICS_LOG = os.environ.get("SOFTR_METRICS_LOG")
+METRICS_FILE = os.environ.get("SOFTR_METRICS_FILE")
+METRICS_PORT = os.environ.get("SOFTR_METRICS_PORT")
+WRITE_INTERVAL = 10.0
+
+INPUT_TOKENS_HEADER = "x-amzn-bedrock-input-token-count"
+OUTPUT_TOKENS_HEADER = "x-amzn-bedrock-output-token-count"
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+TOKENS_PER_SECOND_BUCKETS = (5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Labels of the invocations made in this context, e.g. the control
+_labels = contextvars.ContextVar("labels", default={})
+
+@contextmanager
+def labels(**values):
+    """Attach labels (such as control=...) to the invocations made inside."""
+    token = _labels.set(dict(_labels.get(), **values))
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+METRICS = {
+    # name: (type, help, histogram buckets)
+    "softr_invocations_total": ("counter", "Model invocations by outcome", None),
+    "softr_throttles_total": ("counter", "Requests throttled by Bedrock, including retried ones", None),
+    "softr_input_tokens_total": ("counter", "Input tokens reported by Bedrock", None),
+    "softr_output_tokens_total": ("counter", "Output tokens reported by Bedrock", None),
+    "softr_time_to_first_token_seconds": ("histogram", "Time until the first streamed chunk", SECONDS_BUCKETS),
+    "softr_invocation_duration_seconds": ("histogram", "Time until the whole response was received", SECONDS_BUCKETS),
+    "softr_output_tokens_per_second": ("histogram", "Output tokens per second of the response", TOKENS_PER_SECOND_BUCKETS),
+    "softr_payload_bytes": ("histogram", "Size of the request body", BYTES_BUCKETS),
+}
+
+class Registry:
+    """In-process counters and histograms, keyed by metric and labels."""
+
+    def __init__(self):
+        self.values = {name: {} for name in METRICS}
+        self.lock = threading.Lock()
+
+    def inc(self, name, labels, amount=1):
+        with self.lock:
+            series = self.values[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            series = self.values[name]
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(METRICS[name][2])
+            histogram.observe(value)
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, (kind, description, buckets) in METRICS.items():
+                lines.append("# HELP {} {}".format(name, description))
+                lines.append("# TYPE {} {}".format(name, kind))
+                for labels, value in sorted(self.values[name].items()):
+                    if kind == "counter":
+                        lines.append("{}{} {}".format(name, format_labels(labels), value))
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + ("+Inf",), value.counts):
+                        cumulative += count
+                        lines.append("{}_bucket{} {}".format(
+                            name, format_labels(labels + (("le", str(bound)),)), cumulative))
+                    lines.append("{}_sum{} {}".format(name, format_labels(labels), value.sum))
+                    lines.append("{}_count{} {}".format(name, format_labels(labels), value.count))
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels) + "}"
+
+class Exporter:
+    def __init__(self, registry, log_path=None, file_path=None, port=None):
+        self.registry = registry
+        self.log_path = log_path
+        self.file_path = file_path
+        self.log = None
+        self.written = 0.0
+        self.lock = threading.Lock()
+
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            self.log = open(log_path, "a", buffering=1)
+        if file_path:
+            atexit.register(self.write_file)
+        if port:
+            self.serve(int(port))
+
+    def record(self, record):
+        if self.log is not None:
+            line = json.dumps(record) + "\n"
+            with self.lock:
+                self.log.write(line)
+        if self.file_path and time.monotonic() - self.written >= WRITE_INTERVAL:
+            self.write_file()
+
+    def write_file(self):
+        self.written = time.monotonic()
+        temporary = self.file_path + ".tmp"
+        with open(temporary, "w") as metrics_file:
+            metrics_file.write(self.registry.prometheus())
+        os.replace(temporary, self.file_path)
+
+    def serve(self, port):
+        # Only imported when the endpoint is asked for; it is slow to import
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                data = registry.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        try:
+            server = ThreadingHTTPServer(("", port), MetricsHandler)
+        except OSError as err:
+            # Another process (e.g. a second Streamlit app) may serve the port
+            print("Metrics endpoint not started on port {}: {}".format(port, err))
+            return
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+_registry = Registry()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def get_registry():
+    return _registry
+
+def get_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = Exporter(_registry, METRICS_LOG, METRICS_FILE, METRICS_PORT)
+        return _exporter
+
+def header_tokens(response, header):
+    value = response.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get(header)
+    return int(value) if value else None
+
+def record(region, modelId, payload_bytes, started, status, ttft=None, input_tokens=None,
+           output_tokens=None, error=None, context=None):
+    """Aggregate one invocation and hand it to the exporters. context holds
+    the labels of the invocation (by default, those currently set)."""
+    duration = time.monotonic() - started
+    if context is None:
+        context = _labels.get()
+    series = (("model", modelId), ("region", region))
+
+    _registry.inc("softr_invocations_total", series + (("status", status),))
+    _registry.observe("softr_payload_bytes", series, payload_bytes)
+    tokens_per_second = None
+    if status == "ok":
+        _registry.observe("softr_invocation_duration_seconds", series, duration)
+        if ttft is not None:
+            _registry.observe("softr_time_to_first_token_seconds", series, ttft)
+        if input_tokens is not None:
+            _registry.inc("softr_input_tokens_total", series, input_tokens)
+        if output_tokens is not None:
+            _registry.inc("softr_output_tokens_total", series, output_tokens)
+            # Generation speed, after the first token (when known) arrived
+            generating = duration - (ttft or 0)
+            if generating > 0:
+                tokens_per_second = output_tokens / generating
+                _registry.observe("softr_output_tokens_per_second", series, tokens_per_second)
+
+    get_exporter().record({
+        "time": time.time(),
+        "model": modelId,
+        "region": region,
+        "control": context.get("control"),
+        "status": status,
+        "error": error,
+        "payload_bytes": payload_bytes,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "ttft_s": ttft,
+        "duration_s": duration,
+        "output_tokens_per_s": tokens_per_second,
+    })
+
+def record_throttle(region, modelId):
+    _registry.inc("softr_throttles_total", (("model", modelId), ("region", region)))
+
+def record_failure(region, modelId, body, started, error):
+    record(region, modelId, len(body), started, "error", error=str(error))
+
+def instrument(response, region, modelId, body, streaming, started):
+    """Record a successful InvokeModel response, or wrap the event stream of
+    a streamed one so it is recorded when the stream has been read. The
+    token counts are those the StreamDecoder reading the stream found in
+    the invocation metrics of the last event; nothing is decoded here."""
+    payload_bytes = len(body)
+    if not streaming:
+        record(region, modelId, payload_bytes, started, "ok",
+               input_tokens=header_tokens(response, INPUT_TOKENS_HEADER),
+               output_tokens=header_tokens(response, OUTPUT_TOKENS_HEADER))
+        return response
+
+    stream = response['body']
+    # The stream is read (and recorded) after the labels() block has ended
+    context = _labels.get()
+
+    def events():
+        first = None
+        last = None
+        status = "incomplete"
+        try:
+            for event in stream:
+                if first is None:
+                    first = time.monotonic()
+                last = event
+                yield event
+            status = "ok"
+        finally:
+            if status != "ok" and hasattr(stream, 'close'):
+                # Abandoned early: release the connection instead of leaving
+                # the rest of the stream to arrive
+                stream.close()
+            # By now the last event has been decoded by the reader
+            invocation_metrics = (last or {}).get(stream_decoder.EVENT_METRICS) or {}
+            record(region, modelId, payload_bytes, started, status,
+                   ttft=first - started if first is not None else None,
+                   input_tokens=invocation_metrics.get("inputTokenCount"),
+                   output_tokens=invocation_metrics.get("outputTokenCount"), context=context)
+
+    response = dict(response)
+    response['body'] = events()
+    return response
@@ -0,0 +1,108 @@
+import os
+import json
+import math
+import time
+import threading
+
+import bedrock_clients
+
+CATALOG_TTL = 24 * 60 * 60
+
+_catalogs = {}
+_lock = threading.Lock()
+
+def catalog_path(region):
+    return bedrock_clients.cache_dir("models-{}{}.json".format(region, bedrock_clients.endpoint_suffix()))
+
+def fetch_catalog(region):
+    model_client = bedrock_clients.get_client(region, service='bedrock')
+    model_data = model_client.list_foundation_models()
+    catalog = []
+    for model in model_data['modelSummaries']:
+        catalog.append({
+            "modelId": model['modelId'],
+            "modelName": model['modelName'],
+            "inputModalities": model['inputModalities'],
+            "outputModalities": model['outputModalities'],
+            "responseStreamingSupported": model.get('responseStreamingSupported', False),
+        })
+
+    return catalog
+
+def read_catalog(region, ttl):
+    path = catalog_path(region)
+    try:
+        with open(path, "r") as catalog_file:
+            data = json.load(catalog_file)
+    except (OSError, ValueError):
+        return None
+
+    if time.time() - data.get("fetched", 0) > ttl:
+        return None
+    return data["fetched"], data["models"]
+
+def write_catalog(region, fetched, catalog):
+    os.makedirs(bedrock_clients.cache_dir(), exist_ok=True)
+    path = catalog_path(region)
+    # Write then rename, so another process never reads a half written file
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as catalog_file:
+        json.dump({"region": region, "fetched": fetched, "models": catalog}, catalog_file)
+    os.replace(tmp_path, path)
+
+def get_catalog(region, refresh=False, ttl=CATALOG_TTL):
+    """Return the foundation model summaries for a region.
+
+    Served from memory when possible, then from the on-disk copy if it is
+    younger than ttl seconds, and only then from list_foundation_models."""
+    with _lock:
+        cached = _catalogs.get(region)
+        if not refresh and cached is not None and time.time() - cached[0] <= ttl:
+            return cached[1]
+
+        cached = None if refresh else read_catalog(region, ttl)
+        if cached is None:
+            cached = (time.time(), fetch_catalog(region))
+            write_catalog(region, *cached)
+
+        _catalogs[region] = cached
+        return cached[1]
+
+def text_models(catalog):
+    models = {}
+    streaming_models = []
+    for model in catalog:
+        if ":" in model['modelId']:
+            continue
+        if "TEXT" in model['inputModalities'] and "TEXT" in model['outputModalities']:
+            models[model['modelName']] = model['modelId']
+            if model['responseStreamingSupported']:
+                streaming_models.append(model['modelId'])
+
+    return models, streaming_models
+
+def get_models(region, refresh=False):
+    """Return the text models of a region as a {modelName: modelId} dict,
+    plus the list of model ids that support response streaming."""
+    return text_models(get_catalog(region, refresh))
+
+def get_known_models(region, modelIds):
+    """Like get_models, limited to modelIds, but only from a catalog already
+    in memory or on disk, however old: a run for models seen before never
+    has to list the foundation models (or even create a client). None when
+    any of them is not in that catalog."""
+    with _lock:
+        cached = _catalogs.get(region)
+    if cached is None:
+        cached = read_catalog(region, math.inf)
+        if cached is None:
+            return None
+        with _lock:
+            # Kept in memory for the next lookup; get_catalog still fetches
+            # the catalog again once it is older than its ttl
+            cached = _catalogs.setdefault(region, cached)
+
+    models, streaming_models = text_models(m for m in cached[1] if m['modelId'] in modelIds)
+    if set(models.values()) != set(modelIds):
+        return None
+    return models, streaming_models
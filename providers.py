@@ -0,0 +1,153 @@
+import json
+from functools import lru_cache
+
+class Provider:
+    """Request and response format of one family of Bedrock models."""
+
+    family = None
+    # Sampling temperature used when the caller does not pick one
+    default_temperature = 0.9
+    # Stop sequences always sent with the request
+    stop_sequences = []
+    # Largest completion the family accepts, and its context window (tokens)
+    max_output_tokens = 2048
+    context_window = 4096
+
+    def build_request(self, prompt, max_tokens, temperature, stop_sequences):
+        raise NotImplementedError
+
+    def payload(self, prompt, max_tokens, temperature=None, stop_sequences=None):
+        """Return the JSON request body for a prompt.
+
+        stop_sequences are added to the family's own ones, and ignored by
+        families whose request format has no stop sequences."""
+        if temperature is None:
+            temperature = self.default_temperature
+        return json.dumps(self.build_request(
+            prompt, max_tokens, temperature, self.stop_sequences + (stop_sequences or [])))
+
+    def chunk_text(self, response_chunk):
+        """Text of one decoded chunk of a streamed response."""
+        return ''
+
+    def result_text(self, response_body):
+        """Text of a decoded InvokeModel response body."""
+        return ''
+
+class Cohere(Provider):
+    family = "cohere.command"
+    max_output_tokens = 4000
+
+    def build_request(self, prompt, max_tokens, temperature, stop_sequences):
+        return {
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "p": 0.9
+        }
+
+    def chunk_text(self, response_chunk):
+        return response_chunk['generations'][0]['text']
+
+    def result_text(self, response_body):
+        return response_body['generations'][0]['text']
+
+class Llama2(Provider):
+    family = "meta.llama2"
+
+    def build_request(self, prompt, max_tokens, temperature, stop_sequences):
+        return {
+            "prompt": prompt,
+            "max_gen_len": max_tokens,
+            "temperature": temperature,
+            "top_p": 0.9
+        }
+
+    def chunk_text(self, response_chunk):
+        return response_chunk['generation']
+
+    def result_text(self, response_body):
+        return response_body['generation']
+
+class Titan(Provider):
+    family = "amazon.titan"
+    max_output_tokens = 8000
+    context_window = 8000
+
+    def build_request(self, prompt, max_tokens, temperature, stop_sequences):
+        return {
+            "inputText": prompt,
+            "textGenerationConfig": {
+                "maxTokenCount": max_tokens,
+                "stopSequences": stop_sequences,
+                "temperature": temperature,
+                "topP": 0.9
+            }
+        }
+
+    def chunk_text(self, response_chunk):
+        return response_chunk['outputText']
+
+    def result_text(self, response_body):
+        return response_body['results'][0]['outputText']
+
+class Claude(Provider):
+    family = "anthropic.claude"
+    default_temperature = 0.75
+    stop_sequences = [ "Human:" ]
+    max_output_tokens = 8191
+    context_window = 100000
+
+    def build_request(self, prompt, max_tokens, temperature, stop_sequences):
+        return {
+            "prompt": '\n\nHuman: {}\n\nAssistant:'.format(prompt),
+            "max_tokens_to_sample": max_tokens,
+            "temperature": temperature,
+            "top_k": 250,
+            "top_p": 1,
+            "stop_sequences": stop_sequences
+        }
+
+    def chunk_text(self, response_chunk):
+        return response_chunk['completion']
+
+    def result_text(self, response_body):
+        return response_body['completion']
+
+class AI21(Provider):
+    family = "ai21.j2"
+    default_temperature = 0.7
+    max_output_tokens = 8191
+    context_window = 8191
+
+    def build_request(self, prompt, max_tokens, temperature, stop_sequences):
+        return {
+            "prompt": prompt,
+            "maxTokens": max_tokens,
+            "temperature": temperature,
+            "topP": 1,
+            "stopSequences": stop_sequences,
+            "countPenalty": {
+                "scale": 0
+            },
+            "presencePenalty": {
+                "scale": 0
+            },
+            "frequencyPenalty": {
+                "scale": 0
+            }
+        }
+
+    def result_text(self, response_body):
+        return response_body['completions'][0]['data']['text']
+
+PROVIDERS = [Cohere(), Llama2(), Titan(), Claude(), AI21()]
+
+@lru_cache(maxsize=None)
+def get_provider(modelId):
+    """Return the provider adapter for a model id, resolved once per id."""
+    for provider in PROVIDERS:
+        if provider.family in modelId:
+            return provider
+
+    raise ValueError("Unsupported model: {}".format(modelId))
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bedrock_clients
+import model_catalog
+import providers
+import throttling
+
+AUTO_REGION = "auto"
+AUTO_REGION_LABEL = "Auto (fastest region)"
+# Weight of the newest probe in the moving average
+EWMA_ALPHA = 0.3
+# How often the background prober measures every region, and when (in
+# seconds) the stored measurements are too old to choose a region by
+PROBE_INTERVAL = 300.0
+STALE_AFTER = 2 * PROBE_INTERVAL
+# Models not asked for in this long are no longer probed in the background
+WATCH_TTL = 60 * 60.0
+# Latency counted for a probe that failed, so failing regions sort last
+FAILURE_PENALTY = 30.0
+
+def latency_path():
+    return bedrock_clients.cache_dir("region-latency" + bedrock_clients.endpoint_suffix() + ".json")
+
+class RegionProber:
+    """Latency of each region, as exponentially weighted moving averages.
+
+    A probe times a control-plane call (listing the foundation models) and,
+    for a model, a one-token InvokeModel request. The averages are kept in
+    a small JSON file, so short-lived CLI runs start from what earlier runs
+    measured instead of probing every region again."""
+
+    def __init__(self, regions, path=None, interval=PROBE_INTERVAL):
+        self.regions = list(regions)
+        self.path = path or latency_path()
+        self.interval = interval
+        # "control-plane" / "invoke" -> {key: {"ewma": seconds, "updated": epoch}}
+        self.latency = {"control-plane": {}, "invoke": {}}
+        # modelId -> when it was last asked for (epoch)
+        self.watched = {}
+        self.thread = None
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as latency_file:
+                latency = json.load(latency_file)
+        except (OSError, ValueError):
+            return
+        for kind in self.latency:
+            self.latency[kind].update(latency.get(kind, {}))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            data = json.dumps(self.latency)
+        temporary = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(temporary, "w") as latency_file:
+            latency_file.write(data)
+        os.replace(temporary, self.path)
+
+    def observe(self, kind, key, seconds):
+        with self.lock:
+            entry = self.latency[kind].get(key)
+            if entry is None:
+                entry = self.latency[kind][key] = {"ewma": seconds, "updated": 0}
+            else:
+                entry["ewma"] += EWMA_ALPHA * (seconds - entry["ewma"])
+            entry["updated"] = time.time()
+
+    def estimate(self, kind, key):
+        """The current average, or None when unknown or stale."""
+        with self.lock:
+            entry = self.latency[kind].get(key)
+        if entry is None or time.time() - entry["updated"] > STALE_AFTER:
+            return None
+        return entry["ewma"]
+
+    def probe(self, region, modelId=None):
+        started = time.monotonic()
+        try:
+            bedrock_clients.get_client(region, service='bedrock').list_foundation_models(byOutputModality='TEXT')
+            seconds = time.monotonic() - started
+        except Exception:
+            seconds = FAILURE_PENALTY
+        self.observe("control-plane", region, seconds)
+
+        if modelId is None or not self.serves(region, modelId):
+            return
+
+        body = providers.get_provider(modelId).payload("Hi", 1, temperature=0)
+        started = time.monotonic()
+        try:
+            response = throttling.invoke_model(bedrock_clients.get_client(region), modelId, body, False,
+                                               deadline=FAILURE_PENALTY)
+            response['body'].read()
+            seconds = time.monotonic() - started
+        except Exception:
+            seconds = FAILURE_PENALTY
+        self.observe("invoke", region + "/" + modelId, seconds)
+
+    def probe_all(self, modelId=None):
+        """Probe every region at once, then store the averages."""
+        with ThreadPoolExecutor(max_workers=len(self.regions)) as executor:
+            list(executor.map(lambda region: self.probe(region, modelId), self.regions))
+        self.save()
+
+    def serves(self, region, modelId):
+        try:
+            models, streaming_models = model_catalog.get_models(region)
+        except Exception:
+            return False
+        return modelId in models.values()
+
+    def fastest(self, modelId):
+        """The region listing the model with the lowest invoke latency,
+        probing first when some of the measurements are missing or stale."""
+        candidates = [region for region in self.regions if self.serves(region, modelId)]
+        if not candidates:
+            raise ValueError("No region lists the model {}".format(modelId))
+
+        if any(self.estimate("invoke", region + "/" + modelId) is None for region in candidates):
+            self.probe_all(modelId)
+
+        def latency(region):
+            invoke = self.estimate("invoke", region + "/" + modelId)
+            control_plane = self.estimate("control-plane", region)
+            return (invoke if invoke is not None else FAILURE_PENALTY,
+                    control_plane if control_plane is not None else FAILURE_PENALTY)
+
+        return min(candidates, key=latency)
+
+    def watch(self, modelId):
+        """Keep probing the regions for modelId in the background, every
+        interval seconds, until it has not been asked for in WATCH_TTL
+        seconds; asking again restarts the wait."""
+        with self.lock:
+            self.watched[modelId] = time.time()
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def prune(self):
+        """Stop watching the models not asked for lately. Returns the ones
+        still watched; once there are none, the background thread ends."""
+        with self.lock:
+            now = time.time()
+            for modelId, requested in list(self.watched.items()):
+                if now - requested > WATCH_TTL:
+                    del self.watched[modelId]
+            if not self.watched:
+                self.thread = None
+            return list(self.watched)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            watched = self.prune()
+            if not watched:
+                return
+            for modelId in watched:
+                try:
+                    self.probe_all(modelId)
+                except Exception as err:
+                    print("Probing the regions failed: {}".format(err))
+
+_probers = {}
+_lock = threading.Lock()
+
+def get_prober(regions):
+    key = tuple(regions)
+    with _lock:
+        prober = _probers.get(key)
+        if prober is None:
+            prober = _probers[key] = RegionProber(regions)
+        return prober
+
+def fastest_region(regions, modelId):
+    """The fastest of regions listing modelId, with its models, for the
+    apps' "auto" region. The regions are probed again in the background
+    while the model keeps being asked for. Raises ValueError when no region
+    lists the model."""
+    prober = get_prober(regions)
+    region = prober.fastest(modelId)
+    prober.watch(modelId)
+    models, streaming_models = model_catalog.get_models(region)
+    return region, models, streaming_models
+
+def get_models(region, regions, refresh=False):
+    """{modelName: modelId} and the streaming model ids to choose from in
+    region: those of every one of regions for the "auto" region."""
+    if region == AUTO_REGION:
+        # The model is picked from those of every region, then the region
+        # is the fastest one listing it
+        return all_models(regions, refresh)
+    return model_catalog.get_models(region, refresh=refresh)
+
+def all_models(regions, refresh=False):
+    """{modelName: modelId} and the streaming model ids of every region."""
+    models = {}
+    streaming_models = set()
+    for region in regions:
+        try:
+            region_models, region_streaming = model_catalog.get_models(region, refresh)
+        except Exception as err:
+            print("Listing the models of {} failed: {}".format(region, err))
+            continue
+        for name, modelId in region_models.items():
+            models.setdefault(name, modelId)
+        streaming_models.update(region_streaming)
+    return models, list(streaming_models)
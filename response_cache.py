@@ -0,0 +1,167 @@
+import io
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+
+import bedrock_clients
+import hedging
+import throttling
+
+CACHE_PATH = bedrock_clients.cache_dir("responses.sqlite3")
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+CACHE_TTL = 7 * 24 * 60 * 60
+
+class ResponseCache:
+    """On-disk store of raw Bedrock response bodies keyed by a hash of the
+    model id and request body, with a TTL and least-recently-used eviction
+    once the stored responses grow past max_bytes."""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_CACHE_BYTES, ttl=CACHE_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model_id TEXT NOT NULL,
+                streaming INTEGER NOT NULL,
+                chunks TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @contextmanager
+    def _connect(self):
+        # A connection per operation keeps the cache safe to share between
+        # Streamlit sessions and worker threads
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT streaming, chunks, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > self.ttl:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+
+        return bool(row[0]), [chunk.encode('utf-8') for chunk in json.loads(row[1])]
+
+    def put(self, key, modelId, streaming, chunks):
+        data = json.dumps([chunk.decode('utf-8') for chunk in chunks])
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, modelId, int(streaming), data, len(data), now, now))
+            self._evict(db, now)
+
+    def _evict(self, db, now):
+        db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evict = []
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        db.executemany("DELETE FROM responses WHERE key = ?", evict)
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM responses")
+
+_cache = None
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
+
+def cache_key(modelId, body):
+    key = modelId + "\0" + body
+    if bedrock_clients.ENDPOINT_URL:
+        key = bedrock_clients.ENDPOINT_URL + "\0" + key
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def payload_temperature(body):
+    payload = json.loads(body)
+    if "textGenerationConfig" in payload:
+        payload = payload["textGenerationConfig"]
+    return payload.get("temperature", 0)
+
+def replay(streaming, chunks):
+    """Rebuild a response shaped like the one boto3 returns, so the usual
+    response handling (including the streaming loop) renders it unchanged."""
+    if streaming:
+        return {'body': ({'chunk': {'bytes': chunk}} for chunk in chunks), 'cached': True}
+    return {'body': io.BytesIO(chunks[0]), 'cached': True}
+
+def record(cache, key, modelId, response):
+    stream = response['body']
+
+    def events():
+        chunks = []
+        complete = True
+        for event in stream:
+            if 'chunk' in event:
+                chunks.append(event['chunk'].get('bytes'))
+            else:
+                complete = False
+            yield event
+
+        # Only a stream that was read to the end without errors is stored
+        if complete:
+            cache.put(key, modelId, True, chunks)
+
+    response = dict(response)
+    response['body'] = events()
+    return response
+
+def invoke(client, modelId, body, streaming, use_cache=False, force=False, hedge_regions=None):
+    """Invoke the model, replaying a cached response when use_cache is set.
+
+    Sampled (temperature > 0) requests bypass the cache unless force is set,
+    since a fresh sample is presumably what was asked for. With
+    hedge_regions, slow or failing requests are hedged across those regions."""
+    use_cache = use_cache and (force or payload_temperature(body) <= 0)
+
+    if use_cache:
+        cache = get_cache()
+        key = cache_key(modelId, body)
+        cached = cache.get(key)
+        if cached is not None and cached[0] == streaming:
+            return replay(*cached)
+
+    if hedge_regions:
+        response = hedging.invoke_model(client.meta.region_name, modelId, body, streaming, hedge_regions)
+    else:
+        response = throttling.invoke_model(client, modelId, body, streaming)
+    if streaming:
+        if use_cache:
+            response = record(cache, key, modelId, response)
+    else:
+        if use_cache:
+            data = response['body'].read()
+            cache.put(key, modelId, False, [data])
+            response = dict(response)
+            response['body'] = io.BytesIO(data)
+
+    return response
@@ -1,26 +1,55 @@
 import os
+import re
 import sys
-import boto3
 import json
 import argparse
-import gnureadline # this requirement is needed to lift the input character limit
 from string import Template
-from simple_term_menu import TerminalMenu
+from concurrent.futures import ThreadPoolExecutor
 from termcolor import colored, cprint
 
-SOFTR_CONTROLS_PATH = "controls" + os.sep
-
-# Service Offering FTR requirements
-requirements = {
-    "DEF-001  - Clearly define the core of service offering (what, who, and how)": "DEF-001",
-    "PROJ-001 - Define a customer engagement project plan template": "PROJ-001",
-    "TECH-001 - Identify relevant AWS technical expertise for the service offering": "TECH-001",
-    "RISK-001 - Identify and Mitigate risks associated with the service offering": "RISK-001",
-    "SEC-001  - Secure AWS accounts governance": "SEC-001",
-    "SEC-002  - Secure access to customer-owned AWS accounts": "SEC-002",
-    "SAAS-001 - SaaS components pass a software AWS Foundational Technical Review": "SAAS-001",
-    "CUS-001  - Implement a process to collect customer feedback": "CUS-001"
-}
+import bedrock_clients
+import control_catalog
+import daemon_client
+import evidence
+import grades
+import history
+import long_input
+import metrics
+import model_catalog
+import providers
+import region_prober
+import response_cache
+import stream_decoder
+import stream_render
+import throttling
+import token_counter
+
+MAX_TOKENS_COUNT = 1500
+MAX_WORKERS = 8
+
+# Packed mode: several controls assessed in one request, with the partner
+# input sent once instead of once per control
+PACKED_PROMPT = """The partner response below is assessed against several controls.
+
+<partner-response>
+{partner}
+</partner-response>
+
+Assess the partner response above against each of the following controls, separately and independently. Each control section contains the assessment instructions for that control.
+
+{controls}
+
+Answer every control, in the order given, in its own section using exactly this format:
+
+<result id="{example}">
+The assessment for this control, as asked for in its instructions.
+</result>"""
+PACKED_PARTNER_REFERENCE = "(The partner response is given once, at the top of this prompt.)"
+PARTNER_BLOCK = re.compile(r'<([\w-]+)>\s*\$partner\s*</\1>')
+PACKED_RESULT = re.compile(r'<result id="([^"]+)">(.*?)</result>', re.S)
+
+# Service Offering FTR requirements, one per template in the controls folder
+requirements = control_catalog.get_catalog().requirements()
 
 # AWS Bedrock Regions (as of Dec 2023)
 regions = {
@@ -33,242 +62,754 @@ regions = {
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
-    '--control', 
+    '--control',
     type=str,
+    nargs='+',
     required=False,
     metavar="CONTROL",
-    choices=['DEF-001', 'PROJ-001', 'TECH-001', 'RISK-001', 'SEC-001', 'SEC-002', 'SAAS-001', 'CUS-001'],
-    help='SOFTR control')
+    choices=list(requirements.values()),
+    help='SOFTR control(s)')
+
+parser.add_argument(
+    '--all-controls',
+    action='store_true',
+    help='Evaluate every SOFTR control')
 
 parser.add_argument(
-    '--region', 
+    '--max-workers',
+    type=int,
+    default=MAX_WORKERS,
+    help='Maximum number of concurrent model invocations (default: {})'.format(MAX_WORKERS))
+
+parser.add_argument(
+    '--packed',
+    action='store_true',
+    help='Assess several controls per model request, sending the partner input once')
+
+parser.add_argument(
+    '--pack-size',
+    type=int,
+    default=MAX_WORKERS,
+    help='Maximum number of controls per packed request (default: {})'.format(MAX_WORKERS))
+
+parser.add_argument(
+    '--consensus',
     type=str,
+    nargs='+',
     required=False,
-    help='AWS Region')
+    metavar="MODEL_ID",
+    help='Grade on several models at once and report their consensus grade')
+
+parser.add_argument(
+    '--quorum',
+    type=int,
+    required=False,
+    help='Number of consensus models whose grades must agree (default: a majority)')
+
+parser.add_argument(
+    '--tolerance',
+    type=int,
+    default=grades.TOLERANCE,
+    help='Largest difference between agreeing grades (default: {})'.format(grades.TOLERANCE))
+
+parser.add_argument(
+    '--samples',
+    type=int,
+    required=False,
+    help='Grade from up to this many sampled answers, stopping once the grade is stable')
+
+parser.add_argument(
+    '--ci-width',
+    type=float,
+    default=grades.CI_WIDTH,
+    help='Width of the 95%% confidence interval of the grade at which sampling stops (default: {:g})'.format(
+        grades.CI_WIDTH))
+
+parser.add_argument(
+    '--hedge',
+    action='store_true',
+    help='Send the request to another region as well when the first chunk is late or the region fails')
 
 parser.add_argument(
-    '--model-id', 
+    '--temperature',
+    type=float,
+    required=False,
+    help="Sampling temperature (default: the model's, above 0); use 0 with --cache to replay answers")
+
+parser.add_argument(
+    '--cache',
+    action='store_true',
+    help='Replay identical earlier requests from the local response cache (only at temperature 0)')
+
+parser.add_argument(
+    '--force-cache',
+    action='store_true',
+    help='Use the response cache even though the sampling temperature is above 0')
+
+parser.add_argument(
+    '--no-daemon',
+    action='store_true',
+    help='Invoke the model from this process even when the evaluator daemon is running')
+
+parser.add_argument(
+    '--refresh-models',
+    action='store_true',
+    help='Refresh the cached list of foundation models')
+
+parser.add_argument(
+    '--region',
+    type=str,
+    required=False,
+    help='AWS Region, or "auto" for the fastest region listing the model')
+
+parser.add_argument(
+    '--model-id',
     type=str,
     required=False,
     help='The foundation model identifier')
 
 parser.add_argument(
-    '--body', 
+    '--partner',
+    type=str,
+    required=False,
+    help='Partner the input is from, recorded with the results in the evaluation history')
+
+parser.add_argument(
+    '--body',
     type=str,
     required=False,
     help='(blob) Partner input')
 
-args = parser.parse_args()
+parser.add_argument(
+    '--body-file',
+    type=str,
+    nargs='+',
+    required=False,
+    metavar="PATH",
+    help='Partner evidence files (PDF, DOCX, HTML or text) to evaluate, in chunks if they exceed the context window')
+
+parser.add_argument(
+    '--chunk-tokens',
+    type=int,
+    required=False,
+    help='Tokens of partner input per chunk of long input (default: what fits in the context window)')
+
+parser.add_argument(
+    '--overlap-tokens',
+    type=int,
+    default=long_input.OVERLAP_TOKENS,
+    help='Tokens repeated from the end of a chunk at the start of the next one (default: {})'.format(
+        long_input.OVERLAP_TOKENS))
+
+# The terminal menu and readline are imported only when an interactive
+# prompt is actually shown, so that runs given all their arguments (and
+# --help) start quickly
 
 def select_control():
-    terminal_menu = TerminalMenu(requirements, 
+    from simple_term_menu import TerminalMenu
+    terminal_menu = TerminalMenu(requirements,
                                  menu_highlight_style=("bg_green", "fg_black"),
                                  title="Select a control:")
     terminal_menu.show()
     return requirements[terminal_menu.chosen_menu_entry]
 
-control = args.control
-if control is None:
-    control = select_control()
-
-print("Evaluating control: ", end="")
-cprint(control, "black", "on_green")
-
 def select_region():
-    terminal_menu = TerminalMenu(regions, 
+    from simple_term_menu import TerminalMenu
+    options = dict(regions, **{region_prober.AUTO_REGION_LABEL: region_prober.AUTO_REGION})
+    terminal_menu = TerminalMenu(options,
                                  menu_highlight_style=("bg_green", "fg_black"),
                                  title="Select a region:")
     terminal_menu.show()
-    return regions[terminal_menu.chosen_menu_entry]
-
-region = args.region
-if region is None or region not in regions.values():
-    region = select_region()
-
-print("In region: ", end="")
-cprint(region, "black", "on_green")
-
-try:
-    client = boto3.client('bedrock-runtime', region_name=region)
-except Exception as e:
-    print("Error: ", e)
-    exit(1)
-
-streaming_models = []
-model_client = boto3.client('bedrock', region_name=region)
-model_data = model_client.list_foundation_models()
-models = {}
-for model in model_data['modelSummaries']:
-    if ":" in model['modelId']:
-        continue
-    if "TEXT" in model['inputModalities'] and "TEXT" in model['outputModalities']:
-        models[model['modelName']] = model['modelId']
-        if model['responseStreamingSupported']:
-            streaming_models.append(model['modelId'])
+    return options[terminal_menu.chosen_menu_entry]
 
 def select_model(models):
-    terminal_menu = TerminalMenu(models, 
+    from simple_term_menu import TerminalMenu
+    terminal_menu = TerminalMenu(models,
                                  menu_highlight_style=("bg_green", "fg_black"),
                                  title="Select a model:")
     terminal_menu.show()
     return models[terminal_menu.chosen_menu_entry]
 
-modelId = args.model_id
-if modelId is None or modelId not in models.values():
-    modelId = select_model(models)
-
-print("Using model: ", end="")
-cprint(modelId, "black", "on_green")
+def construct_prompt(control, body):
+    return control_catalog.get_catalog().render(control, body)
+
+def construct_payload(modelId, control, prompt_input, temperature=None):
+    provider = providers.get_provider(modelId)
+    return provider.payload(construct_prompt(control, prompt_input), MAX_TOKENS_COUNT, temperature)
+
+def check_context(modelId, control, prompt_input):
+    tokens, context_window, fits = token_counter.check_context(
+        modelId, construct_prompt(control, prompt_input), MAX_TOKENS_COUNT)
+    if not fits:
+        cprint("{}: the prompt ({} tokens) and a {} token completion exceed the {} token context window of {}".format(
+            control, token_counter.display(modelId, tokens), MAX_TOKENS_COUNT, context_window, modelId),
+            "black", "on_red")
+    return tokens
+
+def ai_request(client, modelId, body, streaming, use_cache=False, force_cache=False, hedge_regions=None):
+    return response_cache.invoke(client, modelId, body, streaming,
+                                 use_cache=use_cache, force=force_cache, hedge_regions=hedge_regions)
+
+def ai_response(modelId, response, streaming, echo=True):
+    provider = providers.get_provider(modelId)
+    if streaming:
+        decoder = stream_decoder.StreamDecoder(modelId)
+        renderer = stream_render.StreamRenderer(echo=echo)
+        for chunk in decoder.texts(response['body']):
+            if not renderer.count:
+                chunk = chunk.lstrip()
+            renderer.feed(chunk)
+
+        return renderer.close()
 
-prompt_input = args.body
-if prompt_input is None:
-    print("Enter partner input: (Hit Ctrl-D on a blank new line to end) ", flush=True)
-    prompt_input = sys.stdin.read()
-
-
-accept = 'application/json'
-contentType = 'application/json'
-
-def read_file(file_path):
-    if os.path.isfile(file_path):
-        text_file = open(file_path, "r")
-        data = text_file.read()
-        text_file.close()
-        return data
-
-prompt_template = read_file(SOFTR_CONTROLS_PATH+control+'.prompt')
-
-def construct_prompt(body):
-    t = Template(prompt_template)
-    return t.substitute(partner=body)
-
-if "cohere.command" in modelId:
-    body = json.dumps({
-        "prompt": construct_prompt(prompt_input),
-        "max_tokens": 1500,
-        "temperature": 0.9,
-        "p": 0.9
-    })
-
-if "meta.llama2" in modelId:
-    body = json.dumps({
-        "prompt": construct_prompt(prompt_input),
-        "max_gen_len": 1500,
-        "temperature": 0.9,
-        "top_p": 0.9
-    })
-
-if "amazon.titan" in modelId:
-    body = json.dumps({
-        "inputText": construct_prompt(prompt_input),
-        "textGenerationConfig": {
-            "maxTokenCount": 1500,
-            "stopSequences": [],
-            "temperature": 0.9,
-            "topP": 0.9
-        }
-    })
-
-if "anthropic.claude" in modelId:
-    body = json.dumps({
-        "prompt": '\n\nHuman: {}\n\nAssistant:'.format(construct_prompt(prompt_input)),
-        "max_tokens_to_sample": 1500,
-        "temperature": 0.75,
-        "top_k": 250,
-        "top_p": 1,
-        "stop_sequences": [ "Human:" ]
-    })
-
-if "ai21.j2" in modelId:
-    body = json.dumps({
-        "prompt": construct_prompt(prompt_input),
-        "maxTokens": 1500,
-        "temperature": 0.7,
-        "topP": 1,
-        "stopSequences": [],
-        "countPenalty": {
-            "scale": 0
-        },
-        "presencePenalty": {
-            "scale": 0
-        },
-        "frequencyPenalty": {
-            "scale": 0
+    else:
+        result = provider.result_text(json.loads(response.get('body').read())).lstrip()
+        if echo:
+            cprint(result, "black", "on_yellow")
+        return result
+
+def evaluate_control(client, control, modelId, prompt_input, streaming, use_cache=False, force_cache=False,
+                     hedge_regions=None, temperature=None):
+    body = construct_payload(modelId, control, prompt_input, temperature)
+    with metrics.labels(control=control):
+        response = ai_request(client, modelId, body, streaming, use_cache, force_cache, hedge_regions)
+    return ai_response(modelId, response, streaming, echo=False)
+
+def evaluate_controls(client, controls, modelId, prompt_input, streaming, max_workers=MAX_WORKERS,
+                      use_cache=False, force_cache=False, hedge_regions=None, temperature=None):
+    """Evaluate several controls concurrently and return (control, result, error)
+    tuples in the order the controls were given."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(evaluate_control, client, control, modelId, prompt_input, streaming,
+                            use_cache, force_cache, hedge_regions, temperature)
+            for control in controls
+        ]
+
+    report = []
+    for control, future in zip(controls, futures):
+        try:
+            report.append((control, future.result(), None))
+        except Exception as err:
+            report.append((control, None, err))
+
+    return report
+
+def construct_packed_prompt(controls, body):
+    sections = []
+    for control in controls:
+        template = control_catalog.get_catalog().get(control).template.template
+        criteria = Template(PARTNER_BLOCK.sub(PACKED_PARTNER_REFERENCE, template)).safe_substitute()
+        sections.append('<control id="{}">\n{}\n</control>'.format(control, criteria.strip()))
+
+    return PACKED_PROMPT.format(partner=body, controls="\n\n".join(sections), example=controls[0])
+
+def split_packed_result(result, controls):
+    """{control: assessment} of every requested control with a non-empty section."""
+    sections = {}
+    for control, text in PACKED_RESULT.findall(result):
+        text = text.strip()
+        if control in controls and text and control not in sections:
+            sections[control] = text
+    return sections
+
+def packed_max_tokens(modelId, controls):
+    return min(providers.get_provider(modelId).max_output_tokens, MAX_TOKENS_COUNT * len(controls))
+
+def packed_fits(modelId, controls, prompt_input):
+    """Whether the packed prompt and its completion fit the context window."""
+    prompt = construct_packed_prompt(controls, prompt_input)
+    return token_counter.count_tokens(modelId, prompt) <= long_input.context_budget(
+        modelId, packed_max_tokens(modelId, controls))
+
+def evaluate_packed(client, controls, modelId, prompt_input, streaming, use_cache=False, force_cache=False,
+                    hedge_regions=None, temperature=None):
+    provider = providers.get_provider(modelId)
+    max_tokens = packed_max_tokens(modelId, controls)
+    body = provider.payload(construct_packed_prompt(controls, prompt_input), max_tokens, temperature)
+    with metrics.labels(control=",".join(controls)):
+        response = ai_request(client, modelId, body, streaming, use_cache, force_cache, hedge_regions)
+    return split_packed_result(ai_response(modelId, response, streaming, echo=False), controls)
+
+def evaluate_controls_packed(client, controls, modelId, prompt_input, streaming, max_workers=MAX_WORKERS,
+                             pack_size=MAX_WORKERS, use_cache=False, force_cache=False, hedge_regions=None,
+                             temperature=None):
+    """Like evaluate_controls, but assessing up to pack_size controls per
+    request. Controls whose section is missing from the packed answer (or
+    whose packed request failed or would not fit the context window) are
+    evaluated individually. Returns the report and the list of controls that
+    needed an individual request."""
+    packs = [controls[i:i + pack_size] for i in range(0, len(controls), pack_size)]
+    # A pack too large for the context window is split in two, down to
+    # single controls, which are evaluated on their own
+    fitting = []
+    while packs:
+        pack = packs.pop(0)
+        if packed_fits(modelId, pack, prompt_input):
+            fitting.append(pack)
+        elif len(pack) > 1:
+            packs[:0] = [pack[:len(pack) // 2], pack[len(pack) // 2:]]
+    packs = fitting
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(evaluate_packed, client, pack, modelId, prompt_input, streaming,
+                            use_cache, force_cache, hedge_regions, temperature)
+            for pack in packs
+        ]
+        for future in futures:
+            try:
+                results.update(future.result())
+            except Exception as err:
+                cprint("Packed request failed: {}".format(err), "black", "on_red")
+
+        fallback = [control for control in controls if control not in results]
+        futures = {
+            control: executor.submit(evaluate_control, client, control, modelId, prompt_input, streaming,
+                                     use_cache, force_cache, hedge_regions, temperature)
+            for control in fallback
         }
-    })
 
-print("Evaluating partner input:")
-cprint(prompt_input, "black", "on_green")
-
-print("="*78)
-print(f"Invoking model ({modelId}) with this payload:")
-print("-"*78)
-cprint(json.dumps(json.loads(body), indent=2), "black", "on_cyan")
+    report = []
+    for control in controls:
+        if control in results:
+            report.append((control, results[control], None))
+            continue
+        try:
+            report.append((control, futures[control].result(), None))
+        except Exception as err:
+            report.append((control, None, err))
+
+    return report, fallback
+
+def evaluate_controls_long(client, controls, modelId, path, prompt_input, streaming, max_workers=MAX_WORKERS,
+                           chunk_tokens=None, overlap_tokens=long_input.OVERLAP_TOKENS, use_cache=False,
+                           force_cache=False, hedge_regions=None, temperature=None):
+    """Evaluate each control on partner input of any length, read from the
+    file at path (or given as prompt_input) once per control. Returns
+    (control, LongResult, error) tuples."""
+    report = []
+    for control in controls:
+        try:
+            with long_input.open_input(path, prompt_input) as input_file:
+                result = long_input.evaluate_long(
+                    client, control, modelId, input_file, streaming, MAX_TOKENS_COUNT, max_workers,
+                    chunk_tokens, overlap_tokens, use_cache, force_cache, hedge_regions, temperature)
+        except Exception as err:
+            report.append((control, None, err))
+            continue
+        if result.chunks > 1:
+            print("{}: assessed in {} chunks, grades {}".format(
+                control, result.chunks, " ".join("-" if f.grade is None else str(f.grade) for f in result.findings)))
+        report.append((control, result, None))
+    return report
+
+def print_report(report):
+    for control, result, err in report:
+        print("="*78)
+        print("Control: ", end="")
+        cprint(control, "black", "on_green")
+        print("-"*78)
+        if err is not None:
+            cprint(err, "black", "on_red")
+        else:
+            cprint(result, "black", "on_yellow")
+
+    print("="*78)
+
+def print_consensus(control, result, modelIds):
+    print("="*78)
+    print("Control: ", end="")
+    cprint(control, "black", "on_green")
+    print("-"*78)
+    answered = {g.modelId: g for g in result.grades}
+    for modelId in modelIds:
+        model_grade = answered.get(modelId)
+        if model_grade is None:
+            print("{:<40} not awaited".format(modelId))
+        elif model_grade.error is not None:
+            print("{:<40} ".format(modelId), end="")
+            cprint(model_grade.error, "black", "on_red")
+        else:
+            grade = "no grade" if model_grade.grade is None else model_grade.grade
+            print("{:<40} {:>8} ({:.1f}s)".format(modelId, grade, model_grade.seconds))
+
+    print("-"*78)
+    if result.median is None:
+        cprint("No model gave a grade", "black", "on_red")
+        return
+    summary = "Consensus grade: {:g} (spread {}, {} of {} models agree)".format(
+        result.median, result.spread, result.agreeing, len(modelIds))
+    cprint(summary, "black", "on_yellow" if result.reached else "on_red")
+
+def print_samples(control, result, samples):
+    print("="*78)
+    print("Control: ", end="")
+    cprint(control, "black", "on_green")
+    print("-"*78)
+    sampled = " ".join("-" if r.grade is None else str(r.grade) for r in result.samples)
+    print("Sampled grades: {} ({} of up to {} requests{})".format(
+        sampled, result.calls, samples, ", stopped early" if result.stopped_early else ""))
+    for r in result.samples:
+        if r.error is not None:
+            cprint(r.error, "black", "on_red")
+
+    if result.grade is None:
+        cprint("No sample gave a grade", "black", "on_red")
+        return
+    print("Grade: {:g} (mean {:.1f} +/- {:.1f})".format(result.grade, result.mean, result.interval))
+    print("-"*78)
+    cprint(result.explanation, "black", "on_yellow")
+
+def print_payload(modelId, body, input_tokens):
+    print("="*78)
+    print(f"Invoking model ({modelId}) with this payload:")
+    print("-"*78)
+    cprint(json.dumps(json.loads(body), indent=2), "black", "on_cyan")
+    print("Input tokens: {}".format(token_counter.display(modelId, input_tokens)))
+
+def evaluate_in_daemon(daemon, args, controls, region, modelId, prompt_input, input_tokens):
+    """The end of main() for single and several controls, with the model
+    invoked (and the result recorded) by the running evaluator daemon."""
+    events = daemon.evaluate(
+        controls=controls, region=region, model_id=modelId, body=prompt_input, partner=args.partner,
+        packed=args.packed, pack_size=args.pack_size, max_workers=args.max_workers,
+        cache=args.cache, force_cache=args.force_cache, hedge=args.hedge, temperature=args.temperature)
+
+    if len(controls) > 1:
+        print("="*78)
+        print(f"Invoking model ({modelId}) for {len(controls)} controls in the evaluator daemon")
+        results = [data for event, data in events if event == "result"]
+        fallback = [data["control"] for data in results if data["mode"] == "single"]
+        if args.packed and fallback:
+            print("Evaluated individually (too long to pack or missing from the packed answer): ", end="")
+            cprint(" ".join(fallback), "black", "on_yellow")
+        print_report([(data["control"], data["result"], data["error"]) for data in results])
+        return
+
+    print_payload(modelId, construct_payload(modelId, controls[0], prompt_input, args.temperature), input_tokens[0])
+    renderer = stream_render.StreamRenderer()
+    for event, data in events:
+        if event == "start":
+            print("="*78)
+            streamed = ""
+            if data["cached"]:
+                streamed = "cached "
+            elif data["streaming"]:
+                streamed = "streamed "
+            print("Here's the {}result: ".format(streamed))
+            if data["region"] != region:
+                print("Answered from region: ", end="")
+                cprint(data["region"], "black", "on_green")
+            print("-"*78)
+        elif event == "chunk":
+            renderer.feed(data["text"])
+        elif event == "result" and data["error"] is None:
+            if renderer.count:
+                renderer.close()
+            else:
+                cprint(data["result"], "black", "on_yellow")
+            print("="*78)
+            return
+        elif event in ("result", "error"):
+            cprint(data["error"], "black", "on_red")
+            exit(1)
+
+    cprint("The evaluator daemon stopped before the result was complete", "black", "on_red")
+    exit(1)
 
-try:
-    if modelId in streaming_models:
-        response = client.invoke_model_with_response_stream(
-            body=body, modelId=modelId, accept=accept,  contentType=contentType)
+def read_input():
+    import gnureadline # this requirement is needed to lift the input character limit
+    print("Enter partner input: (Hit Ctrl-D on a blank new line to end) ", flush=True)
+    return sys.stdin.read()
+
+def main():
+    args = parser.parse_args()
+    # Argument errors are reported before any AWS client is built
+    if args.samples and args.consensus:
+        parser.error("--samples and --consensus cannot be combined")
+    if args.packed and (args.samples or args.consensus):
+        parser.error("--packed cannot be combined with --samples or --consensus")
+    if args.samples is not None and args.samples < 1:
+        parser.error("--samples must be at least 1")
+    if args.quorum is not None and (args.quorum < 1 or args.quorum > len(args.consensus or [])):
+        parser.error("--quorum must be between 1 and the number of --consensus models")
+    if args.body_file is not None:
+        if args.body is not None:
+            parser.error("--body and --body-file cannot be combined")
+        if args.samples or args.consensus:
+            parser.error("--body-file cannot be combined with --samples or --consensus")
+        for path in args.body_file:
+            if not os.path.isfile(path):
+                parser.error("--body-file: no such file: {}".format(path))
+            try:
+                evidence.kind_of(path)
+            except evidence.EvidenceError as err:
+                parser.error("--body-file: {}".format(err))
+    if args.temperature is not None and not 0 <= args.temperature <= 1:
+        parser.error("--temperature must be between 0 and 1")
+    if args.samples and args.temperature == 0:
+        parser.error("--samples needs a --temperature above 0: every sample would be the same")
+    if args.chunk_tokens is not None and args.chunk_tokens < 100:
+        parser.error("--chunk-tokens must be at least 100")
+
+    # A running evaluator_daemon.py has warm clients and catalogs
+    daemon = None if args.no_daemon else daemon_client.connect()
+
+    controls = args.control
+    if args.all_controls:
+        controls = list(requirements.values())
+    elif controls is None:
+        controls = [select_control()]
     else:
-        response = client.invoke_model(
-            body=body, modelId=modelId, accept=accept,  contentType=contentType)
-except Exception as err:
-    print(err)
-    exit(-1)
-
-print("="*78)
-streamed = ""
-if modelId in streaming_models:
-    streamed = "streamed "
-
-print("Here's the {}result: ".format(streamed))
-
-print("-"*78)
-
-if modelId in streaming_models:
-    chunks = []
-    for event in response['body']:
-        chunk = ''
-        response_chunk = json.loads(event['chunk'].get('bytes'))
-        if "amazon.titan" in modelId:
-            chunk = response_chunk['outputText']
-
-        if "anthropic.claude" in modelId:
-            chunk = response_chunk['completion']
-
-        if "cohere.command" in modelId:
-            chunk = response_chunk['generations'][0]['text']
-
-        if "meta.llama2" in modelId:
-            chunk = response_chunk['generation']
-
-        if not chunks:
-            chunk = chunk.lstrip()
-
-        cprint(chunk, "black", "on_yellow", end="", flush=True)
-        chunks.append(chunk)
-
-    print()
-
-else:
-    response_body = json.loads(response.get('body').read())
-
-    result = ''
-    if "amazon.titan" in modelId:
-        result = response_body['results'][0]['outputText']
-
-    if "anthropic.claude" in modelId:
-        result = response_body['completion']
-
-    if "ai21.j2" in modelId:
-        result = response_body['completions'][0]['data']['text']
-        
-    if "cohere.command" in modelId:
-        result = response_body['generations'][0]['text']
-        
-    if "meta.llama2" in modelId:
-        result = response_body['generation']
-
-    cprint(result.lstrip(), "black", "on_yellow")
-
-print("="*78)
+        # Keep the report in checklist order, whatever order they were given in
+        controls = [c for c in requirements.values() if c in controls]
+
+    print("Evaluating control: ", end="")
+    cprint(" ".join(controls), "black", "on_green")
+
+    region = args.region
+    if region is None or (region not in regions.values() and region != region_prober.AUTO_REGION):
+        region = select_region()
+
+    modelId = args.model_id
+    if args.consensus:
+        modelId = args.consensus[0]
+    refresh_models = args.refresh_models
+    if region == region_prober.AUTO_REGION:
+        # The model is picked from those of every region, then the region
+        # is the fastest one listing it
+        models, streaming_models = region_prober.all_models(regions.values(), refresh_models)
+        refresh_models = False
+        if modelId is None or modelId not in models.values():
+            modelId = select_model(models)
+        try:
+            region = region_prober.get_prober(regions.values()).fastest(modelId)
+        except ValueError as err:
+            cprint(err, "black", "on_red")
+            exit(1)
+        print("Fastest region for {}: ".format(modelId), end="")
+    else:
+        print("In region: ", end="")
+    cprint(region, "black", "on_green")
+
+    known = None
+    if modelId is not None and not refresh_models:
+        # Models seen before are looked up in the stored catalog, however
+        # old, instead of listing the foundation models again
+        known = model_catalog.get_known_models(region, args.consensus or [modelId])
+    if known is None and daemon is not None and not refresh_models:
+        try:
+            known = daemon.models(region)
+        except (OSError, daemon_client.DaemonError):
+            daemon = None
+    if known is not None:
+        models, streaming_models = known
+    else:
+        models, streaming_models = model_catalog.get_models(region, refresh_models)
+
+    consensus_models = []
+    if args.consensus:
+        consensus_models = [m for m in args.consensus if m in models.values()]
+        for unknown in [m for m in args.consensus if m not in models.values()]:
+            cprint("{} is not available in {}, leaving it out".format(unknown, region), "black", "on_red")
+        if not consensus_models:
+            exit(1)
+        if args.quorum is not None and args.quorum > len(consensus_models):
+            cprint("--quorum {} is more than the {} --consensus models available in {}".format(
+                args.quorum, len(consensus_models), region), "black", "on_red")
+            exit(1)
+        modelId = consensus_models[0]
+
+    if modelId is None or modelId not in models.values():
+        modelId = select_model(models)
+
+    print("Using model: ", end="")
+    cprint(" ".join(consensus_models) or modelId, "black", "on_green")
+
+    if args.chunk_tokens is not None:
+        budget = min(long_input.chunk_budget(modelId, control) for control in controls)
+        if args.chunk_tokens > budget:
+            parser.error("--chunk-tokens: at most {} tokens of partner input fit in a prompt to {}".format(
+                budget, modelId))
+
+    prompt_input = args.body
+    body_file = None
+    if args.body_file is not None:
+        # The text of the files is extracted once and read from the evidence
+        # cache by later runs
+        try:
+            documents = evidence.ingest(args.body_file)
+        except (OSError, evidence.EvidenceError) as err:
+            cprint(str(err), "black", "on_red")
+            exit(1)
+        print("Evaluating partner evidence:")
+        for document in documents:
+            cprint("{} ({} bytes of text{})".format(
+                document.name, document.size, ", already extracted" if document.cached else ""), "black", "on_green")
+        body_file = evidence.combine(documents)
+    else:
+        if prompt_input is None:
+            prompt_input = read_input()
+        print("Evaluating partner input:")
+        cprint(prompt_input, "black", "on_green")
+
+    streaming = modelId in streaming_models
+    if args.cache and not args.force_cache:
+        # Sampled answers differ from run to run, so they are not replayed
+        sampled = [m for m in consensus_models or [modelId] if (
+            providers.get_provider(m).default_temperature if args.temperature is None else args.temperature) > 0]
+        if sampled:
+            cprint("--cache: {} sampled at a temperature above 0, so the cache is bypassed; "
+                   "add --temperature 0 to replay answers (or --force-cache)".format(", ".join(sampled)),
+                   "black", "on_yellow")
+    hedge_regions = list(regions.values()) if args.hedge else None
+    # Input too long for the context window is evaluated in chunks (except
+    # by --samples and --consensus, which only warn about it)
+    long = body_file is not None or (not args.samples and not consensus_models and not all(
+        long_input.fits(modelId, control, prompt_input, MAX_TOKENS_COUNT) for control in controls))
+    if not long:
+        input_tokens = [check_context(modelId, control, prompt_input) for control in controls]
+
+    if daemon is not None and not long and not args.samples and not consensus_models:
+        try:
+            evaluate_in_daemon(daemon, args, controls, region, modelId, prompt_input, input_tokens)
+        except (OSError, daemon_client.DaemonError) as err:
+            cprint("Evaluator daemon: {}".format(err), "black", "on_red")
+            exit(1)
+        return
+
+    max_workers = max(1, min(args.max_workers, len(controls)))
+    if consensus_models:
+        max_workers = max(max_workers, len(consensus_models))
+
+    try:
+        # One client is shared by every worker thread, so give it enough
+        # connections to keep them all in flight at once
+        client = bedrock_clients.get_client(region, max_pool_connections=max_workers)
+    except Exception as e:
+        print("Error: ", e)
+        exit(1)
+
+    if long:
+        print("="*78)
+        print(f"Invoking model ({modelId}) for {len(controls)} control(s), in chunks of partner input "
+              f"that fit its context window")
+        report = evaluate_controls_long(client, controls, modelId, body_file, prompt_input, streaming,
+                                        max_workers, args.chunk_tokens, args.overlap_tokens, args.cache,
+                                        args.force_cache, hedge_regions, args.temperature)
+        evaluations = []
+        for control, result, err in report:
+            if err is not None:
+                continue
+            details = {"chunks": result.chunks, "grades": [f.grade for f in result.findings]}
+            evaluation = {
+                "partner": args.partner, "control": control, "model_id": modelId, "region": region,
+                "input": prompt_input, "grade": result.grade, "result": result.result, "mode": "map-reduce",
+                "details": details}
+            if body_file is not None:
+                # A file is not copied into the history: its hash, taken as it
+                # was read, and where it was read from are recorded instead
+                details["input_files"] = [os.path.abspath(path) for path in args.body_file]
+                evaluation.update(input="Read from: " + ", ".join(details["input_files"]),
+                                  input_hash=result.input_hash)
+            evaluations.append(evaluation)
+        history.record_many(evaluations)
+
+        print_report([(control, result and result.result, err) for control, result, err in report])
+        return
+
+    if args.samples:
+        print("="*78)
+        print(f"Sampling {modelId} up to {args.samples} times per control, until the grade's 95% interval "
+              f"is within {args.ci_width:g} points")
+        for control in controls:
+            body = construct_payload(modelId, control, prompt_input, args.temperature)
+            with metrics.labels(control=control):
+                result = grades.evaluate_samples(client, modelId, body, streaming, args.samples, args.ci_width,
+                                                 hedge_regions=hedge_regions)
+            print_samples(control, result, args.samples)
+            history.record(args.partner, control, modelId, region, prompt_input, result.explanation, "samples",
+                           grade=result.grade, details={
+                               "grades": [r.grade for r in result.samples], "mean": result.mean,
+                               "interval": result.interval, "calls": result.calls})
+
+        print("="*78)
+        return
+
+    if consensus_models:
+        quorum = args.quorum or len(consensus_models) // 2 + 1
+        print("="*78)
+        print(f"Invoking {len(consensus_models)} models until {quorum} agree within {args.tolerance} points")
+        for control in controls:
+            bodies = {m: construct_payload(m, control, prompt_input, args.temperature) for m in consensus_models}
+            with metrics.labels(control=control):
+                result = grades.evaluate_consensus(
+                    client, bodies, streaming_models, quorum, args.tolerance,
+                    args.cache, args.force_cache, hedge_regions)
+            print_consensus(control, result, consensus_models)
+            history.record_consensus(args.partner, control, region, prompt_input, result)
+
+        print("="*78)
+        return
+
+    if len(controls) > 1:
+        print("="*78)
+        if args.packed:
+            pack_size = max(1, args.pack_size)
+            print(f"Invoking model ({modelId}) for {len(controls)} controls, up to {pack_size} per request")
+            report, fallback = evaluate_controls_packed(
+                client, controls, modelId, prompt_input, streaming, max_workers, pack_size,
+                args.cache, args.force_cache, hedge_regions, args.temperature)
+            if fallback:
+                print("Evaluated individually (too long to pack or missing from the packed answer): ", end="")
+                cprint(" ".join(fallback), "black", "on_yellow")
+        else:
+            print(f"Invoking model ({modelId}) for {len(controls)} controls with up to {max_workers} concurrent requests")
+            fallback = []
+            report = evaluate_controls(
+                client, controls, modelId, prompt_input, streaming, max_workers,
+                args.cache, args.force_cache, hedge_regions, args.temperature)
+
+        history.record_many([{
+            "partner": args.partner, "control": control, "model_id": modelId, "region": region,
+            "input": prompt_input, "grade": grades.parse_grade(result), "result": result,
+            "mode": "packed" if args.packed and control not in fallback else "single",
+        } for control, result, err in report if err is None])
+
+        print_report(report)
+        return
+
+    body = construct_payload(modelId, controls[0], prompt_input, args.temperature)
+    print_payload(modelId, body, input_tokens[0])
+
+    try:
+        with metrics.labels(control=controls[0]):
+            response = ai_request(client, modelId, body, streaming, args.cache, args.force_cache,
+                                  hedge_regions)
+    except throttling.InvocationError as err:
+        cprint(err, "black", "on_red")
+        exit(1)
+
+    print("="*78)
+    streamed = ""
+    if response.get('cached'):
+        streamed = "cached "
+    elif streaming:
+        streamed = "streamed "
+
+    print("Here's the {}result: ".format(streamed))
+    if response.get('region', region) != region:
+        print("Answered from region: ", end="")
+        cprint(response['region'], "black", "on_green")
+
+    print("-"*78)
+
+    result = ai_response(modelId, response, streaming)
+    history.record(args.partner, controls[0], modelId, response.get('region', region), prompt_input, result,
+                   "single", grade=grades.parse_grade(result), details={"cached": bool(response.get('cached'))})
+
+    print("="*78)
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,29 @@
-import os
-import boto3
 import json
 import streamlit as st
-from string import Template
 from termcolor import colored, cprint
 
-SOFTR_CONTROLS_PATH = "controls" + os.sep
+import bedrock_clients
+import control_catalog
+import evidence
+import grades
+import history
+import metrics
+import providers
+import region_prober
+import response_cache
+import stream_decoder
+import stream_render
+import throttling
+import token_counter
 
 temperature = st.sidebar.slider("Temperature", 0.0, 1.0, 0.9)
 maxtokens = st.sidebar.slider("Max Tokens", 1, 2048, 1024)
+use_cache = st.sidebar.checkbox("Reuse cached responses", value=False)
+force_cache = st.sidebar.checkbox("Cache even when temperature > 0", value=False, disabled=not use_cache)
+hedge = st.sidebar.checkbox("Hedge slow requests in other regions", value=False)
 
-# Service Offering FTR requirements
-requirements = {
-    "DEF-001  - Clearly define the core of service offering (what, who, and how)": "DEF-001",
-    "PROJ-001 - Define a customer engagement project plan template": "PROJ-001",
-    "TECH-001 - Identify relevant AWS technical expertise for the service offering": "TECH-001",
-    "RISK-001 - Identify and Mitigate risks associated with the service offering": "RISK-001",
-    "SEC-001  - Secure AWS accounts governance": "SEC-001",
-    "SEC-002  - Secure access to customer-owned AWS accounts": "SEC-002",
-    "SAAS-001 - SaaS components pass a software AWS Foundational Technical Review": "SAAS-001",
-    "CUS-001  - Implement a process to collect customer feedback": "CUS-001"
-}
+# Service Offering FTR requirements, one per template in the controls folder
+requirements = control_catalog.get_catalog().requirements()
 
 requirement = 'DEF-001  - Clearly define the core of service offering (what, who, and how)'
 requirement = st.sidebar.radio(
@@ -46,36 +49,12 @@ region = 'US East (N. Virginia)'
 region = st.sidebar.radio(
     label='Select a region:',
     index=0,
-    options=regions
+    options=list(regions) + [region_prober.AUTO_REGION_LABEL]
 )
-region = regions[region]
-
-print("In region: ", end="")
-cprint(region, "black", "on_green")
-
-try:
-    client = boto3.client('bedrock-runtime', region_name=region)
-except Exception as e:
-    print("Error: ", e)
-    exit(1)
-
-models = {}
-streaming_models = []
-
-def get_models(region):
-    model_client = boto3.client('bedrock', region_name=region)
-    model_data = model_client.list_foundation_models()
-    for model in model_data['modelSummaries']:
-        if ":" in model['modelId']:
-            continue
-        if "TEXT" in model['inputModalities'] and "TEXT" in model['outputModalities']:
-            models[model['modelName']] = model['modelId']
-            if model['responseStreamingSupported']:
-                streaming_models.append(model['modelId'])
-    
-    return models, streaming_models
+region = regions.get(region, region_prober.AUTO_REGION)
 
-models, streaming_models = get_models(region)
+refresh_models = st.sidebar.button("Refresh models", type='secondary')
+models, streaming_models = region_prober.get_models(region, regions.values(), refresh=refresh_models)
 
 modelId = 'Titan Text Large'
 
@@ -87,86 +66,47 @@ modelId = st.sidebar.radio(
 
 modelId = models[modelId]
 
-print("Using model: ", end="")
-cprint(modelId, "black", "on_green")
+if region == region_prober.AUTO_REGION:
+    try:
+        region, models, streaming_models = region_prober.fastest_region(regions.values(), modelId)
+    except ValueError as err:
+        st.error(err)
+        st.stop()
+    st.sidebar.caption("Fastest region: {}".format(region))
 
-st.title("SOFTR Evaluator 🧑‍💻")
+print("In region: ", end="")
+cprint(region, "black", "on_green")
 
-prompt_input = ''
+try:
+    client = bedrock_clients.get_client(region)
+except Exception as e:
+    print("Error: ", e)
+    exit(1)
 
-accept = 'application/json'
-contentType = 'application/json'
+consensus_models = st.sidebar.multiselect(
+    label="Also grade with (consensus):",
+    options=[name for name in models if models[name] != modelId]
+)
+consensus_models = [modelId] + [models[name] for name in consensus_models]
+tolerance = st.sidebar.slider("Consensus Tolerance (points)", 0, 50, grades.TOLERANCE,
+                              disabled=len(consensus_models) < 2)
 
-def read_file(file_path):
-    if os.path.isfile(file_path):
-        text_file = open(file_path, "r")
-        data = text_file.read()
-        text_file.close()
-        return data
+print("Using model: ", end="")
+cprint(" ".join(consensus_models), "black", "on_green")
+
+st.title("SOFTR Evaluator 🧑‍💻")
 
-prompt_template = read_file(SOFTR_CONTROLS_PATH+requirement+'.prompt')
+# Recorded with every result in the evaluation history (see history_st.py)
+partner = st.text_input("Partner:", placeholder="Partner name or ID (optional)") or None
+
+prompt_input = ''
 
 def construct_prompt(body):
-    t = Template(prompt_template)
-    return t.substitute(partner=body)
+    return control_catalog.get_catalog().render(requirement, body)
 
 def construct_payload(prompt_input):
-    if "cohere.command" in modelId:
-        body = json.dumps({
-            "prompt": construct_prompt(prompt_input),
-            "max_tokens": maxtokens,
-            "temperature": temperature,
-            "p": 0.9
-        })
-
-    if "meta.llama2" in modelId:
-        body = json.dumps({
-            "prompt": construct_prompt(prompt_input),
-            "max_gen_len": maxtokens,
-            "temperature": temperature,
-            "top_p": 0.9
-        })
-
-    if "amazon.titan" in modelId:
-        body = json.dumps({
-            "inputText": construct_prompt(prompt_input),
-            "textGenerationConfig": {
-                "maxTokenCount": maxtokens,
-                "stopSequences": [],
-                "temperature": temperature,
-                "topP": 0.9
-            }
-        })
-
-    if "anthropic.claude" in modelId:
-        body = json.dumps({
-            "prompt": '\n\nHuman: {}\n\nAssistant:'.format(construct_prompt(prompt_input)),
-            "max_tokens_to_sample": maxtokens,
-            "temperature": temperature,
-            "top_k": 250,
-            "top_p": 1,
-            "stop_sequences": [ "Human:" ]
-        })
-
-    if "ai21.j2" in modelId:
-        body = json.dumps({
-            "prompt": construct_prompt(prompt_input),
-            "maxTokens": maxtokens,
-            "temperature": temperature,
-            "topP": 1,
-            "stopSequences": [],
-            "countPenalty": {
-                "scale": 0
-            },
-            "presencePenalty": {
-                "scale": 0
-            },
-            "frequencyPenalty": {
-                "scale": 0
-            }
-        })
-    
-    return body
+    provider = providers.get_provider(modelId)
+    return provider.payload(construct_prompt(prompt_input), maxtokens, temperature)
 
 def ai_request(body):
     print("Evaluating partner input:")
@@ -178,15 +118,13 @@ def ai_request(body):
     cprint(json.dumps(json.loads(body), indent=2), "black", "on_cyan")
 
     try:
-        if modelId in streaming_models:
-            response = client.invoke_model_with_response_stream(
-                body=body, modelId=modelId, accept=accept,  contentType=contentType)
-        else:
-            response = client.invoke_model(
-                body=body, modelId=modelId, accept=accept,  contentType=contentType)
-    except Exception as err:
-        print(err)
-        exit(-1)
+        response = response_cache.invoke(client, modelId, body, modelId in streaming_models,
+                                         use_cache=use_cache, force=force_cache,
+                                         hedge_regions=list(regions.values()) if hedge else None)
+    except throttling.InvocationError as err:
+        cprint(err, "black", "on_red")
+        st.error(err)
+        st.stop()
 
     print("="*78)
     return response
@@ -195,59 +133,35 @@ def ai_response(response):
     c = st.empty()
 
     streamed = ""
-    if modelId in streaming_models:
+    if response.get('cached'):
+        streamed = "cached "
+    elif modelId in streaming_models:
         streamed = "streamed "
 
     print("Here's the {}result: ".format(streamed))
+    if response.get('region', region) != region:
+        print("Answered from region: {}".format(response['region']))
+        st.caption("Answered from {}".format(response['region']))
 
     print("-"*78)
+    provider = providers.get_provider(modelId)
     if modelId in streaming_models:
-        chunks = []
-        for event in response['body']:
-            chunk = ''
-            response_chunk = json.loads(event['chunk'].get('bytes'))
-            if "amazon.titan" in modelId:
-                chunk = response_chunk['outputText']
-
-            if "anthropic.claude" in modelId:
-                chunk = response_chunk['completion']
-
-            if "cohere.command" in modelId:
-                chunk = response_chunk['generations'][0]['text']
-
-            if "meta.llama2" in modelId:
-                chunk = response_chunk['generation']
-
-            if not chunks:
+        decoder = stream_decoder.StreamDecoder(modelId)
+        renderer = stream_render.StreamRenderer(c.write)
+        for chunk in decoder.texts(response['body']):
+            if not renderer.count:
                 chunk = chunk.lstrip()
 
-            cprint(chunk, "black", "on_yellow", end="", flush=True)
-            chunks.append(chunk)
-            c.write(''.join(chunks) + "▌")
+            renderer.feed(chunk)
 
-        print()
+        result = renderer.close()
         print("="*78)
-        c.write(''.join(chunks))
-        return ''.join(chunks)
+        return result
 
     else:
         response_body = json.loads(response.get('body').read())
 
-        result = ''
-        if "amazon.titan" in modelId:
-            result = response_body['results'][0]['outputText']
-
-        if "anthropic.claude" in modelId:
-            result = response_body['completion']
-
-        if "ai21.j2" in modelId:
-            result = response_body['completions'][0]['data']['text']
-            
-        if "cohere.command" in modelId:
-            result = response_body['generations'][0]['text']
-            
-        if "meta.llama2" in modelId:
-            result = response_body['generation']
+        result = provider.result_text(response_body)
 
         cprint(result.lstrip(), "black", "on_yellow")
         print("="*78)
@@ -255,10 +169,74 @@ def ai_response(response):
         c.write(result.lstrip())
         return result.lstrip()
 
+def evaluate_consensus(text):
+    bodies = {
+        m: providers.get_provider(m).payload(construct_prompt(text), maxtokens, temperature)
+        for m in consensus_models
+    }
+    print("Evaluating partner input on: {}".format(" ".join(consensus_models)))
+    with metrics.labels(control=requirement):
+        result = grades.evaluate_consensus(
+            client, bodies, streaming_models, tolerance=tolerance, use_cache=use_cache,
+            force_cache=force_cache, hedge_regions=list(regions.values()) if hedge else None)
+
+    answered = {g.modelId: g for g in result.grades}
+    rows = []
+    for m in consensus_models:
+        model_grade = answered.get(m)
+        if model_grade is None:
+            rows.append({"Model": m, "Grade": "not awaited", "Seconds": ""})
+        elif model_grade.error is not None:
+            rows.append({"Model": m, "Grade": "error: {}".format(model_grade.error), "Seconds": ""})
+        else:
+            rows.append({"Model": m, "Grade": "no grade" if model_grade.grade is None else str(model_grade.grade),
+                         "Seconds": "{:.1f}".format(model_grade.seconds)})
+    st.table(rows)
+
+    if result.median is None:
+        st.warning("No model gave a grade.")
+    else:
+        summary = "Consensus grade: {:g} (spread {}, {} of {} models agree)".format(
+            result.median, result.spread, result.agreeing, len(consensus_models))
+        print(summary)
+        if result.reached:
+            st.success(summary)
+        else:
+            st.warning(summary)
+
+    history.record_consensus(partner, requirement, region, text, result)
+
+    for model_grade in result.grades:
+        if model_grade.result:
+            with st.expander(model_grade.modelId):
+                st.write(model_grade.result)
+
 with st.form('my_form'):
     text = st.text_area(label='Enter partner input here:', label_visibility='collapsed',placeholder='Enter partner input here')
+    uploads = st.file_uploader("Or attach partner evidence", type=[kind.lstrip(".") for kind in evidence.KINDS],
+                               accept_multiple_files=True)
     submitted = st.form_submit_button('Submit')
+    if submitted and uploads:
+        # The text of a file seen before is read from the evidence cache
+        try:
+            documents = evidence.ingest([(upload.name, upload.getvalue()) for upload in uploads])
+        except evidence.EvidenceError as err:
+            st.error(str(err))
+            st.stop()
+        st.caption(", ".join("{} ({} bytes of text{})".format(
+            document.name, document.size, ", already extracted" if document.cached else "") for document in documents))
+        text = "\n\n".join(part for part in (text.strip(), evidence.read_text(documents)) if part)
     if submitted:
-        payload = construct_payload(text)
-        response = ai_request(payload)
-        answer = ai_response(response)
+        tokens, context_window, fits = token_counter.check_context(modelId, construct_prompt(text), maxtokens)
+        if not fits:
+            st.warning("The prompt ({} tokens) and up to {} tokens of response exceed the {} token context window of this model.".format(
+                token_counter.display(modelId, tokens), maxtokens, context_window))
+        if len(consensus_models) > 1:
+            evaluate_consensus(text)
+        else:
+            payload = construct_payload(text)
+            with metrics.labels(control=requirement):
+                response = ai_request(payload)
+            answer = ai_response(response)
+            history.record(partner, requirement, modelId, response.get('region', region), text, answer, "single",
+                           grade=grades.parse_grade(answer), details={"cached": bool(response.get('cached'))})
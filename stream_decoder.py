@@ -0,0 +1,51 @@
+import json
+
+import providers
+
+# orjson parses the small chunk documents several times faster than the
+# standard library; it is used when installed but not required
+try:
+    import orjson
+    loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    _decode = json.JSONDecoder().decode
+
+    def loads(data):
+        return _decode(data.decode('utf-8'))
+
+    JSON_BACKEND = "json"
+
+METRICS_KEY = "amazon-bedrock-invocationMetrics"
+# The decoded invocation metrics are also left on the event they came in,
+# under this key, for metrics.instrument to record without decoding the
+# chunk again
+EVENT_METRICS = "invocationMetrics"
+
+class StreamDecoder:
+    """Decoder for the events of one InvokeModelWithResponseStream response.
+
+    The provider's text extractor is resolved once, when the decoder is
+    made, rather than for every chunk. The invocation metrics Bedrock adds
+    to the last chunk (token counts and latencies) are kept in metrics, and
+    on the event as EVENT_METRICS."""
+
+    def __init__(self, modelId):
+        self.chunk_text = providers.get_provider(modelId).chunk_text
+        self.metrics = None
+
+    def decode(self, event):
+        """Text of one stream event."""
+        chunk = event.get('chunk')
+        if chunk is None:
+            return ''
+        response_chunk = loads(chunk['bytes'])
+        if METRICS_KEY in response_chunk:
+            self.metrics = event[EVENT_METRICS] = response_chunk[METRICS_KEY]
+        return self.chunk_text(response_chunk) or ''
+
+    def texts(self, stream):
+        """Yield the text of every event of a stream."""
+        decode = self.decode
+        for event in stream:
+            yield decode(event)
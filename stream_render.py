@@ -0,0 +1,56 @@
+import time
+from termcolor import cprint
+
+# A streamed answer is redrawn at most every FLUSH_INTERVAL seconds, or
+# sooner once FLUSH_CHARS new characters have arrived
+FLUSH_INTERVAL = 0.05
+FLUSH_CHARS = 200
+CURSOR = "▌"
+
+class StreamRenderer:
+    """Incremental output for a streamed completion.
+
+    Chunks are buffered and written out on a time/size cadence instead of
+    one by one: the terminal gets one cprint per flush, and the Streamlit
+    placeholder (render, e.g. st.empty().write) is redrawn once per flush
+    with the text so far and a cursor. close() does the final flush and
+    returns the whole text."""
+
+    def __init__(self, render=None, echo=True, interval=FLUSH_INTERVAL, max_chars=FLUSH_CHARS):
+        self.render = render
+        self.echo = echo
+        self.interval = interval
+        self.max_chars = max_chars
+        self.text = ""
+        self.pending = []
+        self.pending_chars = 0
+        self.count = 0
+        self.flushed = time.monotonic()
+
+    def feed(self, chunk):
+        self.count += 1
+        if not chunk:
+            return
+        self.pending.append(chunk)
+        self.pending_chars += len(chunk)
+        if self.pending_chars >= self.max_chars or time.monotonic() - self.flushed >= self.interval:
+            self.flush()
+
+    def flush(self, final=False):
+        if self.pending:
+            new_text = ''.join(self.pending)
+            self.pending.clear()
+            self.pending_chars = 0
+            self.text += new_text
+            if self.echo:
+                cprint(new_text, "black", "on_yellow", end="", flush=True)
+
+        if self.render is not None:
+            self.render(self.text if final else self.text + CURSOR)
+        self.flushed = time.monotonic()
+
+    def close(self):
+        self.flush(final=True)
+        if self.echo:
+            print()
+        return self.text
@@ -0,0 +1,29 @@
+import batch
+
+CONTROLS = {"SEC-001"}
+
+def read(tmp_path, text, input_format):
+    path = tmp_path / ("input." + input_format)
+    path.write_text(text)
+    return list(batch.read_rows(str(path), input_format))
+
+def test_csv_row_with_extra_column_and_missing_field(tmp_path):
+    [(number, row, error)] = read(tmp_path, "partner_id,control,body\n,SEC-001,x,extra\n", "csv")
+    assert error is None
+    assert batch.check_row(row, CONTROLS) == "missing partner_id"
+    assert batch.invalid_row_key("model", number, row) == batch.invalid_row_key("model", number, dict(row))
+
+def test_invalid_rows_are_keyed_by_line(tmp_path):
+    rows = read(tmp_path, '{"control": "SEC-001"}\n{"control": "SEC-001"}\n', "jsonl")
+    keys = {batch.invalid_row_key("model", number, row) for number, row, error in rows}
+    assert len(keys) == 2
+
+def test_jsonl_rows_that_are_not_objects(tmp_path):
+    rows = read(tmp_path, 'not json\n[1, 2]\n\n{"partner_id": "p", "control": "SEC-001", "body": "b"}\n', "jsonl")
+    assert [(number, error is None) for number, row, error in rows] == [(1, False), (2, False), (4, True)]
+    assert rows[1][1] == {"line": "[1, 2]"}
+    assert batch.check_row(rows[2][1], CONTROLS) is None
+
+def test_check_row(tmp_path):
+    assert batch.check_row({"partner_id": "p", "control": "SEC-001", "body": 3}, CONTROLS) == "body is not text"
+    assert batch.check_row({"partner_id": "p", "control": "XYZ", "body": "b"}, CONTROLS) == "unknown control: XYZ"
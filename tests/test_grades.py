@@ -0,0 +1,41 @@
+import pytest
+
+import grades
+
+DEF_001_QUESTION = ("1. What grading would you give for the partner's response from a scale of 1 to 100, "
+                    "and why?")
+
+@pytest.mark.parametrize("answer, grade", [
+    # DEF-001 answers repeat each question before answering it
+    (DEF_001_QUESTION + "\n\nI would give it 35. The response describes the offering but has no public URL.\n\n"
+     "2. What is the service offering about, and how does it relate to AWS Cloud?\n\nA migration service.", 35),
+    (DEF_001_QUESTION + "\nI would give the partner's response a 72, as it covers who, what and how.", 72),
+    (DEF_001_QUESTION + "\n\nGrade: 80\n\nThe offer is clearly described.", 80),
+    (DEF_001_QUESTION + "\n\n65 - the target customers are described, the delivery mechanism is not.", 65),
+    (DEF_001_QUESTION + "\n\nOn a scale of 1 to 100, I would rate it a score of 65.", 65),
+    ("1. 40\nThe response lacks an architecture diagram.\n2. It is a data lake offering.", 40),
+    # SEC-001 answers open with the grade
+    ("85\n\nThe SOP enables MFA on the root user and sets the account contacts.", 85),
+    ("Grade: 45/100\n\nCloudWatch alerts are not mentioned.", 45),
+    ("Rating: 70\n\nThe process is described, but not the alerts.", 70),
+    ("I would grade this response 90 out of 100. Every step is covered.", 90),
+    ("Based on the requirements, a score of 55 is appropriate: MFA is enabled, contacts are not set.", 55),
+    ("Grade: 100. The SOP covers MFA, contact information and alerts.", 100),
+    # The grade followed by a short explanation, as the prompts ask for
+    ("70. The SOP is good", 70),
+    ("The grade is based on 3 factors. Overall 85/100.", 85),
+    ("Grade - 4 out of 5 steps; 70/100", 70),
+    ("I would rate it 60", 60),
+])
+def test_parse_grade(answer, grade):
+    assert grades.parse_grade(answer) == grade
+
+@pytest.mark.parametrize("answer", [
+    None,
+    "",
+    "I am unable to grade this response as it is empty.",
+    DEF_001_QUESTION + "\n\nThe response does not give enough information to grade.",
+    "1. The partner describes a migration offering.\n2. It targets enterprises.",
+])
+def test_no_grade(answer):
+    assert grades.parse_grade(answer) is None
@@ -0,0 +1,47 @@
+import time
+import threading
+
+import pytest
+
+import bedrock_clients
+import hedging
+import throttling
+
+REGIONS = ["us-east-1", "us-west-2", "ap-southeast-1", "ap-northeast-1", "eu-central-1"]
+
+@pytest.fixture
+def slow_regions(monkeypatch):
+    """Every region takes 0.3 seconds to answer; returns the regions called."""
+    called = []
+    lock = threading.Lock()
+
+    def invoke_model(client, modelId, body, streaming, **kwargs):
+        with lock:
+            called.append(client)
+        time.sleep(0.3)
+        return {'body': iter([{"chunk": {}}]) if streaming else None}
+
+    monkeypatch.setattr(hedging, "_trackers", {})
+    monkeypatch.setattr(hedging, "_breakers", {})
+    monkeypatch.setattr(hedging, "DEFAULT_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(hedging, "serves", lambda region, modelId: True)
+    monkeypatch.setattr(bedrock_clients, "get_client", lambda region: region)
+    monkeypatch.setattr(throttling, "invoke_model", invoke_model)
+    return called
+
+def test_streamed_call_is_hedged_once(slow_regions):
+    response = hedging.invoke_model("us-east-1", "anthropic.claude-v2", "{}", True, REGIONS)
+    list(response['body'])
+    assert slow_regions == ["us-east-1", "us-west-2"]
+
+def test_invoke_model_is_not_hedged_before_it_is_timed(slow_regions):
+    response = hedging.invoke_model("us-east-1", "anthropic.claude-v2", "{}", False, REGIONS)
+    assert response['region'] == "us-east-1"
+    assert slow_regions == ["us-east-1"]
+
+def test_invoke_model_is_hedged_on_whole_call_latency(slow_regions):
+    tracker = hedging.get_tracker("us-east-1", "anthropic.claude-v2", streaming=False)
+    for _ in range(hedging.MIN_SAMPLES):
+        tracker.add(0.05)
+    hedging.invoke_model("us-east-1", "anthropic.claude-v2", "{}", False, REGIONS)
+    assert len(slow_regions) == 2
@@ -0,0 +1,19 @@
+import grades
+import history
+
+def test_consensus_is_recorded_per_model(tmp_path, monkeypatch):
+    store = history.EvaluationHistory(str(tmp_path / "history.sqlite3"))
+    monkeypatch.setattr(history, "get_history", lambda: store)
+    result = grades.consensus([
+        grades.ModelGrade("anthropic.claude-v2", 80, "Grade: 80", None, 1.0),
+        grades.ModelGrade("amazon.titan-text-express-v1", 74, "Grade: 74", None, 1.5),
+        grades.ModelGrade("meta.llama2-70b-chat-v1", None, None, TimeoutError("slow"), 2.0),
+    ], quorum=2)
+    history.record_consensus("acme", "SEC-001", "us-east-1", "Our SOP enables MFA.", result)
+
+    assert store.count() == 2
+    [claude] = store.query(modelId="anthropic.claude-v2")
+    assert (claude.grade, claude.result, claude.mode) == (80, "Grade: 80", "consensus")
+    assert claude.details["consensus"]["median"] == 77
+    assert claude.details["consensus"]["grades"]["meta.llama2-70b-chat-v1"] is None
+    assert store.trend("acme", "SEC-001", modelId="amazon.titan-text-express-v1")[0][1] == 74
@@ -0,0 +1,38 @@
+import io
+import random
+
+import pytest
+
+import long_input
+import token_counter
+
+MODEL_ID = "anthropic.claude-v2"
+
+def partner_text():
+    rng = random.Random(7)
+    words = ["migration", "the", "AWS", "account", "root", "user", "MFA", "CloudTrail", "of", "a", "SOP"]
+    lines = []
+    for number in range(400):
+        # Mostly short lines, with a line far longer than a chunk now and then
+        length = rng.choice([5, 12, 40, 90]) if number % 37 else 3000
+        lines.append(" ".join(rng.choice(words) for _ in range(length)))
+    # Lines without spaces: CJK text and base64
+    lines.append("".join(rng.choice("数据安全账户审计") for _ in range(4000)))
+    lines.append("".join(rng.choice("ABCDEFGHabcdefgh0123+/") for _ in range(12000)))
+    return "\n".join(lines) + "\n"
+
+@pytest.mark.parametrize("chunk_tokens, overlap_tokens", [(500, 200), (1000, 200), (300, 0)])
+def test_chunks_fit_and_cover_the_input(chunk_tokens, overlap_tokens):
+    text = partner_text()
+    counter = token_counter.get_counter(MODEL_ID)
+    chunks = list(long_input.chunks(io.StringIO(text), MODEL_ID, chunk_tokens, overlap_tokens))
+    assert len(chunks) > 10
+    assert max(counter.count(chunk) for chunk in chunks) <= chunk_tokens
+    # Every chunk after the first starts with text from the one before it
+    # or with new text: the input is in the chunks in order, whole
+    start = position = 0
+    for chunk in chunks:
+        start = text.find(chunk, start)
+        assert 0 <= start <= position
+        position = start + len(chunk)
+    assert position == len(text)
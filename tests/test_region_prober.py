@@ -0,0 +1,27 @@
+import time
+
+import region_prober
+
+def make_prober(tmp_path):
+    # The background thread only wakes after interval, so nothing is probed
+    return region_prober.RegionProber(["us-east-1"], path=str(tmp_path / "latency.json"), interval=3600)
+
+def test_watch_keeps_models_asked_for_lately(tmp_path):
+    prober = make_prober(tmp_path)
+    prober.watch("anthropic.claude-v2")
+    assert prober.prune() == ["anthropic.claude-v2"]
+    assert prober.thread is not None
+
+def test_prune_drops_models_not_asked_for(tmp_path):
+    prober = make_prober(tmp_path)
+    prober.watch("anthropic.claude-v2")
+    prober.watch("meta.llama2-13b-chat-v1")
+    prober.watched["anthropic.claude-v2"] = time.time() - region_prober.WATCH_TTL - 1
+    assert prober.prune() == ["meta.llama2-13b-chat-v1"]
+
+def test_prune_ends_the_thread_once_nothing_is_watched(tmp_path):
+    prober = make_prober(tmp_path)
+    prober.watch("anthropic.claude-v2")
+    prober.watched["anthropic.claude-v2"] = time.time() - region_prober.WATCH_TTL - 1
+    assert prober.prune() == []
+    assert prober.thread is None
@@ -0,0 +1,86 @@
+import io
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import response_cache
+import throttling
+
+MODEL_ID = "anthropic.claude-v2"
+
+class Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    return clock
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return response_cache.ResponseCache(str(tmp_path / "responses.sqlite3"), max_bytes=110, ttl=60)
+
+def test_hit_and_miss(cache):
+    assert cache.get("a") is None
+    cache.put("a", MODEL_ID, True, [b"one", b"two"])
+    assert cache.get("a") == (True, [b"one", b"two"])
+    assert cache.get("b") is None
+
+def test_expiry(cache, clock):
+    cache.put("a", MODEL_ID, False, [b"answer"])
+    clock.now += 59
+    assert cache.get("a") is not None
+    clock.now += 2
+    assert cache.get("a") is None
+
+def test_least_recently_used_is_evicted_past_max_bytes(cache, clock):
+    # Each response is stored as '["x...x"]', 34 bytes: three fit in 110
+    for key in "abc":
+        cache.put(key, MODEL_ID, False, [b"x" * 30])
+        clock.now += 1
+    cache.get("a")
+    clock.now += 1
+    cache.put("d", MODEL_ID, False, [b"x" * 30])
+    assert cache.get("b") is None
+    assert [cache.get(key) is not None for key in "acd"] == [True, True, True]
+
+@pytest.fixture
+def bedrock(monkeypatch, cache):
+    """Counts the invocations that reach Bedrock."""
+    calls = []
+
+    def invoke_model(client, modelId, body, streaming, **kwargs):
+        calls.append(body)
+        return {'body': io.BytesIO(b'{"completion": "Grade: 80"}')}
+
+    monkeypatch.setattr(throttling, "invoke_model", invoke_model)
+    monkeypatch.setattr(response_cache, "get_cache", lambda: cache)
+    return calls
+
+CLIENT = SimpleNamespace(meta=SimpleNamespace(region_name="us-east-1"))
+
+def invoke(temperature, force=False):
+    body = json.dumps({"prompt": "Human: grade\n\nAssistant:", "temperature": temperature})
+    response = response_cache.invoke(CLIENT, MODEL_ID, body, False, use_cache=True, force=force)
+    return response['body'].read(), response.get('cached', False)
+
+def test_invoke_replays_at_temperature_zero(bedrock):
+    assert invoke(0) == (b'{"completion": "Grade: 80"}', False)
+    assert invoke(0) == (b'{"completion": "Grade: 80"}', True)
+    assert len(bedrock) == 1
+
+def test_invoke_bypasses_the_cache_when_sampling(bedrock):
+    invoke(0.7)
+    assert invoke(0.7)[1] is False
+    assert len(bedrock) == 2
+
+def test_force_caches_sampled_answers(bedrock):
+    invoke(0.7, force=True)
+    assert invoke(0.7, force=True)[1] is True
+    assert len(bedrock) == 1
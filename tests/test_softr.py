@@ -0,0 +1,51 @@
+import softr
+
+CONTROLS = ["DEF-001", "SEC-001", "SEC-002"]
+
+def test_packed_prompt_has_the_partner_input_once_and_every_control():
+    prompt = softr.construct_packed_prompt(CONTROLS, "Our SOP enables MFA.")
+    assert prompt.count("Our SOP enables MFA.") == 1
+    for control in CONTROLS:
+        assert '<control id="{}">'.format(control) in prompt
+
+def test_split_packed_result():
+    result = ('<result id="SEC-001">\n85\nMFA is enabled.\n</result>\n'
+              '<result id="DEF-001">\n70. The offering is described.\n</result>')
+    assert softr.split_packed_result(result, CONTROLS) == {
+        "SEC-001": "85\nMFA is enabled.", "DEF-001": "70. The offering is described."}
+
+def test_split_packed_result_skips_empty_unknown_and_repeated_sections():
+    result = ('<result id="DEF-001">First</result><result id="DEF-001">Second</result>'
+              '<result id="SEC-002">  </result><result id="RISK-001">Not asked for</result>'
+              '<result id="SEC-001">Cut off')
+    assert softr.split_packed_result(result, CONTROLS) == {"DEF-001": "First"}
+
+def test_packs_too_long_for_the_context_window_are_split(monkeypatch):
+    calls = []
+
+    def evaluate_packed(client, controls, modelId, prompt_input, streaming, *args):
+        calls.append(controls)
+        return {control: "Grade: 80" for control in controls}
+
+    def evaluate_control(client, control, modelId, prompt_input, streaming, *args):
+        calls.append(control)
+        return "Grade: 70"
+
+    monkeypatch.setattr(softr, "evaluate_packed", evaluate_packed)
+    monkeypatch.setattr(softr, "evaluate_control", evaluate_control)
+    # Llama 2: a 4096 token context window, with up to 2048 of them for the answer
+    modelId = "meta.llama2-13b-chat-v1"
+    prompt_input = "The partner runs migrations for enterprises. " * 40
+    assert not softr.packed_fits(modelId, CONTROLS, prompt_input)
+    report, fallback = softr.evaluate_controls_packed(None, CONTROLS, modelId, prompt_input, False, pack_size=3)
+    assert calls == [["DEF-001"], ["SEC-001", "SEC-002"]]
+    assert report == [(control, "Grade: 80", None) for control in CONTROLS]
+    assert fallback == []
+
+def test_controls_that_fit_with_no_other_are_evaluated_on_their_own(monkeypatch):
+    monkeypatch.setattr(softr, "evaluate_packed", lambda *args: {})
+    monkeypatch.setattr(softr, "evaluate_control", lambda *args: "Grade: 70")
+    monkeypatch.setattr(softr, "packed_fits", lambda modelId, controls, prompt_input: False)
+    report, fallback = softr.evaluate_controls_packed(None, CONTROLS, "anthropic.claude-v2", "x", False)
+    assert fallback == CONTROLS
+    assert report == [(control, "Grade: 70", None) for control in CONTROLS]
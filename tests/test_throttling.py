@@ -0,0 +1,98 @@
+import pytest
+
+import throttling
+
+class Clock:
+    """Stands in for time.monotonic and time.sleep: sleeping moves it on."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        # Like a real sleep, at least a little time goes by
+        seconds = max(seconds, 1e-6)
+        self.now += seconds
+        self.slept += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttling.time, "monotonic", clock)
+    monkeypatch.setattr(throttling.time, "sleep", clock.sleep)
+    return clock
+
+def take(bucket, clock, count):
+    """Seconds it takes to acquire count tokens."""
+    started = clock.now
+    for _ in range(count):
+        bucket.acquire(clock.now + 60)
+    return clock.now - started
+
+def test_initial_burst_then_rate(clock):
+    bucket = throttling.TokenBucket(rate=5, burst=10)
+    assert take(bucket, clock, 10) == 0
+    assert take(bucket, clock, 5) == pytest.approx(1.0, abs=1e-4)
+
+def test_refill_is_capped(clock):
+    bucket = throttling.TokenBucket(rate=5, burst=1)
+    take(bucket, clock, 1)
+    clock.now += 60
+    # No more than a second's worth of requests is saved up
+    assert take(bucket, clock, 5) == 0
+    assert take(bucket, clock, 1) == pytest.approx(0.2, abs=1e-4)
+
+def test_burst_cap_until_the_first_throttle(clock):
+    bucket = throttling.TokenBucket(rate=5, burst=20)
+    take(bucket, clock, 20)
+    clock.now += 60
+    assert take(bucket, clock, 20) == 0
+    bucket.on_throttle()
+    clock.now += 60
+    # Now one second's worth at the halved rate, 2.5 requests, is saved up:
+    # the third waits for the half token missing
+    assert take(bucket, clock, 2) == 0
+    assert take(bucket, clock, 1) == pytest.approx(0.5 / 2.5, abs=1e-4)
+
+def test_deadline(clock):
+    bucket = throttling.TokenBucket(rate=1, burst=1)
+    take(bucket, clock, 1)
+    with pytest.raises(throttling.InvocationError):
+        bucket.acquire(clock.now + 0.5)
+
+def test_slow_start_adds_a_request_per_second_per_success(clock):
+    bucket = throttling.TokenBucket(rate=5)
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 15
+
+def test_throttle_halves_the_rate_once_per_cooldown(clock):
+    bucket = throttling.TokenBucket(rate=16)
+    bucket.on_throttle()
+    bucket.on_throttle()
+    assert bucket.rate == 8
+    assert not bucket.slow_start
+    clock.now += throttling.DECREASE_COOLDOWN
+    bucket.on_throttle()
+    assert bucket.rate == 4
+
+def test_rate_stays_within_limits(clock):
+    bucket = throttling.TokenBucket(rate=throttling.MIN_RATE * 1.5)
+    for _ in range(5):
+        clock.now += throttling.DECREASE_COOLDOWN
+        bucket.on_throttle()
+    assert bucket.rate == throttling.MIN_RATE
+    bucket = throttling.TokenBucket(rate=throttling.MAX_RATE - 0.5)
+    bucket.on_success()
+    assert bucket.rate == throttling.MAX_RATE
+
+def test_additive_recovery_after_a_throttle(clock):
+    bucket = throttling.TokenBucket(rate=20)
+    bucket.on_throttle()
+    # A second of traffic at 10 requests/s adds ADDITIVE_INCREASE requests/s
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == pytest.approx(10 + throttling.ADDITIVE_INCREASE, rel=0.01)
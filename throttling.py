@@ -0,0 +1,178 @@
+import os
+import time
+import random
+import threading
+
+import metrics
+
+# Client-side rate limit per (region, model). It starts with a burst of as
+# many requests as the client has connections, then in slow start: every
+# success adds 1 request/s, doubling the rate every round of requests, until
+# Bedrock first throttles. From then on it adapts AIMD style: every success
+# adds ADDITIVE_INCREASE requests/s per second of sustained traffic, every
+# throttle halves the rate (at most once per DECREASE_COOLDOWN). The initial
+# values are read whenever a bucket is created, so they can be changed at
+# run time as well as with SOFTR_INITIAL_RATE and SOFTR_INITIAL_BURST.
+INITIAL_RATE = float(os.environ.get("SOFTR_INITIAL_RATE", "5"))
+INITIAL_BURST = int(os.environ.get("SOFTR_INITIAL_BURST", "0"))
+MIN_RATE = 0.2
+MAX_RATE = float(os.environ.get("SOFTR_MAX_RATE", "1000"))
+ADDITIVE_INCREASE = 1.0
+MULTIPLICATIVE_DECREASE = 0.5
+DECREASE_COOLDOWN = 1.0
+
+# Retries with full-jitter exponential backoff, within a per-request deadline
+MAX_ATTEMPTS = 6
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 20.0
+DEADLINE = 120.0
+
+THROTTLING_ERRORS = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+}
+
+TRANSIENT_ERRORS = THROTTLING_ERRORS | {
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelTimeoutException",
+    "ModelNotReadyException",
+}
+
+accept = 'application/json'
+contentType = 'application/json'
+
+class InvocationError(Exception):
+    """The model could not be invoked, even after retrying."""
+
+    def __init__(self, message, error=None, attempts=0):
+        super().__init__(message)
+        self.error = error
+        self.attempts = attempts
+
+class TokenBucket:
+    def __init__(self, rate=None, burst=None):
+        self.rate = INITIAL_RATE if rate is None else rate
+        self.burst = max(1, INITIAL_BURST, burst or 0)
+        self.tokens = float(self.burst)
+        self.slow_start = True
+        self.updated = time.monotonic()
+        self.decreased = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        # Allow bursts of up to one second's worth of requests, or the
+        # initial burst until the first throttle
+        self.tokens = min(max(1.0, self.rate, self.burst), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, deadline):
+        """Take a token, waiting for one until the monotonic deadline."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+
+            if now + wait > deadline:
+                raise InvocationError("Deadline exceeded while waiting for request capacity")
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            if self.slow_start:
+                self.rate = min(MAX_RATE, self.rate + 1.0)
+            else:
+                self.rate = min(MAX_RATE, self.rate + ADDITIVE_INCREASE / self.rate)
+
+    def on_throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            # Concurrent requests of one burst get throttled together; count them once
+            if now - self.decreased < DECREASE_COOLDOWN:
+                return
+            self.decreased = now
+            self.slow_start = False
+            self.burst = 1
+            self.rate = max(MIN_RATE, self.rate * MULTIPLICATIVE_DECREASE)
+            self.tokens = min(self.tokens, 0.0)
+
+_buckets = {}
+_lock = threading.Lock()
+
+def get_bucket(region, modelId, burst=None):
+    with _lock:
+        bucket = _buckets.get((region, modelId))
+        if bucket is None:
+            bucket = _buckets[(region, modelId)] = TokenBucket(burst=burst)
+        return bucket
+
+def error_code(err):
+    # Only needed once a call has failed, by when botocore is loaded anyway
+    from botocore.exceptions import ClientError
+    if isinstance(err, ClientError):
+        return err.response.get('Error', {}).get('Code', '')
+    return type(err).__name__
+
+def is_transient(err):
+    from botocore.exceptions import ConnectionError, ReadTimeoutError
+    if isinstance(err, (ConnectionError, ReadTimeoutError)):
+        return True
+    return error_code(err) in TRANSIENT_ERRORS
+
+def call(region, modelId, request, deadline=DEADLINE, burst=None):
+    """Run request() under the (region, model) rate limit, retrying transient
+    errors with jittered exponential backoff until deadline seconds have
+    passed. Raises InvocationError with the last error when giving up."""
+    bucket = get_bucket(region, modelId, burst)
+    end = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        attempt += 1
+        bucket.acquire(end)
+        try:
+            result = request()
+        except Exception as err:
+            code = error_code(err)
+            if code in THROTTLING_ERRORS:
+                bucket.on_throttle()
+                metrics.record_throttle(region, modelId)
+
+            if not is_transient(err):
+                raise InvocationError(str(err), err, attempt) from err
+            if attempt >= MAX_ATTEMPTS:
+                raise InvocationError("{} (gave up after {} attempts)".format(err, attempt), err, attempt) from err
+
+            delay = random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (attempt - 1)))
+            if time.monotonic() + delay > end:
+                raise InvocationError("{} (deadline exceeded after {} attempts)".format(err, attempt), err, attempt) from err
+            time.sleep(delay)
+            continue
+
+        bucket.on_success()
+        return result
+
+def invoke_model(client, modelId, body, streaming, deadline=DEADLINE):
+    """InvokeModel (or InvokeModelWithResponseStream) with adaptive rate
+    limiting and retries. Every invocation is recorded in metrics."""
+    if streaming:
+        request = lambda: client.invoke_model_with_response_stream(
+            body=body, modelId=modelId, accept=accept,  contentType=contentType)
+    else:
+        request = lambda: client.invoke_model(
+            body=body, modelId=modelId, accept=accept,  contentType=contentType)
+
+    region = client.meta.region_name
+    # A first burst fills the client's connection pool
+    burst = getattr(getattr(client.meta, 'config', None), 'max_pool_connections', None)
+    started = time.monotonic()
+    try:
+        response = call(region, modelId, request, deadline, burst)
+    except InvocationError as err:
+        metrics.record_failure(region, modelId, body, started, err)
+        raise
+    return metrics.instrument(response, region, modelId, body, streaming, started)
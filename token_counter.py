@@ -0,0 +1,131 @@
+import os
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import bedrock_clients
+import providers
+
+# Token counts are estimates unless the model family's tokenizer has been
+# provided: no tokenizer ships with the apps and nothing is downloaded.
+# Tokenizers are read from tokenizer.json files (Hugging Face `tokenizers`
+# format) in this folder, named after the model family, e.g.
+# anthropic.claude.json or meta.llama2.json. Claude's tokenizer is also
+# found in the `anthropic` package (versions before 0.39 ship it), when that
+# is installed.
+TOKENIZERS_DIR = os.environ.get("SOFTR_TOKENIZERS_DIR") or bedrock_clients.cache_dir("tokenizers")
+CACHE_SIZE = 10000
+
+# Typical characters per token of each family's tokenizer on English text,
+# spaces and punctuation included. Anthropic gives 3.5 for Claude; the
+# others are rough figures, not measured: benchmarks/token_estimate.py
+# fits them once the family's tokenizer is available
+CHARS_PER_TOKEN = {
+    "anthropic.claude": 3.5,
+    "meta.llama2": 3.6,
+    "amazon.titan": 4.0,
+    "cohere.command": 4.2,
+    "ai21.j2": 4.8,
+}
+
+# Tokens per character outside ASCII: BPE vocabularies hold few merges of
+# them, so CJK text and the like take about a token a character
+NON_ASCII_TOKENS_PER_CHAR = 1.0
+
+class EstimatingTokenizer:
+    """Offline approximation of a BPE tokenizer from the family's average
+    characters per token. Common words, with the space before them and
+    punctuation following them, are merged into single tokens, so the
+    average over the whole text is closer than counting words one by one."""
+
+    exact = False
+
+    def __init__(self, chars_per_token):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text):
+        ascii_chars = len(text.encode("ascii", "ignore"))
+        other_chars = len(text) - ascii_chars
+        return math.ceil(ascii_chars / self.chars_per_token + other_chars * NON_ASCII_TOKENS_PER_CHAR)
+
+class FileTokenizer:
+    exact = True
+
+    def __init__(self, path):
+        from tokenizers import Tokenizer
+        self.tokenizer = Tokenizer.from_file(path)
+
+    def count(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+def tokenizer_paths(family):
+    yield os.path.join(TOKENIZERS_DIR, family + ".json")
+    if family == "anthropic.claude":
+        import importlib.util
+        spec = importlib.util.find_spec("anthropic")
+        if spec is not None and spec.origin:
+            yield os.path.join(os.path.dirname(spec.origin), "tokenizer.json")
+
+@lru_cache(maxsize=None)
+def get_tokenizer(family):
+    for path in tokenizer_paths(family):
+        if os.path.isfile(path):
+            try:
+                return FileTokenizer(path)
+            except ImportError:
+                break
+    return EstimatingTokenizer(CHARS_PER_TOKEN.get(family, 4.0))
+
+class TokenCounter:
+    """Token counts for one model family, cached by a hash of the text so
+    that only new messages are ever tokenized."""
+
+    def __init__(self, family):
+        self.tokenizer = get_tokenizer(family)
+        self.exact = self.tokenizer.exact
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def count(self, text):
+        key = hashlib.sha1(text.encode('utf-8')).digest()
+        with self.lock:
+            tokens = self.cache.get(key)
+            if tokens is not None:
+                self.cache.move_to_end(key)
+                return tokens
+
+        tokens = self.tokenizer.count(text)
+        with self.lock:
+            self.cache[key] = tokens
+            if len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return tokens
+
+    def count_messages(self, messages):
+        return sum(self.count(message) for message in messages)
+
+_counters = {}
+_lock = threading.Lock()
+
+def get_counter(modelId):
+    family = providers.get_provider(modelId).family
+    with _lock:
+        counter = _counters.get(family)
+        if counter is None:
+            counter = _counters[family] = TokenCounter(family)
+        return counter
+
+def count_tokens(modelId, text):
+    return get_counter(modelId).count(text)
+
+def display(modelId, tokens):
+    """A token count as shown to users: "~N" when it is an estimate."""
+    return "{}".format(tokens) if get_counter(modelId).exact else "~{}".format(tokens)
+
+def check_context(modelId, prompt, max_tokens):
+    """Return (prompt tokens, context window, whether prompt and completion fit)."""
+    context_window = providers.get_provider(modelId).context_window
+    tokens = count_tokens(modelId, prompt)
+    return tokens, context_window, tokens + max_tokens <= context_window